@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+'''
+Compare the speed of the timestamp formatting used by the download API
+extractors (api.extractors.util.epoch_to_text) with the straightforward
+datetime.fromtimestamp(...).isoformat() it replaces. Run it from the
+tfc_web directory (the one containing manage.py) like this:
+
+$ python3 ../scripts/benchmark_epoch_to_text.py [rows]
+
+Timestamps are one per second from the start of a month, roughly matching
+the order in which extractors see them.
+'''
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.getcwd())
+
+from api.extractors.util import (  # noqa: E402
+    epoch_to_text, epochs_to_text, slow_epoch_to_text)
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+START = 1583020800  # 2020-03-01T00:00:00Z, a month including a DST change
+
+timestamps = list(range(START, START + ROWS))
+
+
+def bench(name, fn):
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    print('{0:<20} {1:>12,.0f} rows/s'.format(name, ROWS / elapsed))
+    return result
+
+
+expected = bench('slow_epoch_to_text', lambda: [slow_epoch_to_text(ts) for ts in timestamps])
+single = bench('epoch_to_text', lambda: [epoch_to_text(ts) for ts in timestamps])
+batch = bench('epochs_to_text', lambda: epochs_to_text(timestamps))
+assert single == expected and batch == expected, 'Results differ!'
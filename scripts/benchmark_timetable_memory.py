@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+'''
+Measure the memory used by the timetables of transport.utils.transxchange
+for the TransXChange files of TNDS zips (or of XML files), as downloaded
+by update_bus_info in data/TNDS. Run it from the tfc_web directory (the
+one containing manage.py) like this:
+
+$ python3 ../scripts/benchmark_timetable_memory.py data/TNDS/EA.zip [date]
+
+For each file it reports the memory allocated by update_bus_info while
+parsing the file, including its compiled timetable (parse_peak), the memory
+allocated while building the Timetable of the date (peak) and still held by
+it afterwards, the size of the cached
+Timetable when parsed from the zip and when made from the compiled
+timetable stored by update_bus_info (DayTimetable), and the size of the
+compiled timetable itself.
+'''
+
+import datetime
+import io
+import os
+import pickle
+import sys
+import time
+import tracemalloc
+import zipfile
+import zlib
+
+sys.path.insert(0, os.getcwd())
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tfc_web.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from transport.management.commands.update_bus_info import parse_xml  # noqa: E402
+from transport.utils.transxchange import (  # noqa: E402
+    DayTimetable, Timetable, compile_timetable)
+
+if len(sys.argv) < 2:
+    sys.exit(__doc__)
+PATHS = [path for path in sys.argv[1:] if not path[:1].isdigit()]
+DATES = [datetime.date.fromisoformat(date) for date in sys.argv[1:] if date[:1].isdigit()]
+DATE = DATES[0] if DATES else datetime.date.today()
+
+
+def xml_files():
+    for path in PATHS:
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                for name in archive.namelist():
+                    yield name, archive.read(name)
+        else:
+            with open(path, 'rb') as xml_file:
+                yield os.path.basename(path), xml_file.read()
+
+
+def cached_size(timetable):
+    # The cached form of the Timetables parsed from the zips, see timetables_from_archive()
+    for grouping in timetable.groupings:
+        del grouping.journeypatterns
+        for row in grouping.rows:
+            del row.next
+    for name in ('journeypatterns', 'stops'):
+        delattr(timetable, name)
+    return len(pickle.dumps(timetable, pickle.HIGHEST_PROTOCOL))
+
+
+def measure(xml_content):
+    tracemalloc.start()
+    parse_xml('benchmark.xml', io.BytesIO(xml_content))
+    parse_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    timetable = Timetable(io.BytesIO(xml_content), DATE)
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if not hasattr(timetable, 'groupings'):
+        return None
+
+    compiled = compile_timetable(io.BytesIO(xml_content))
+    compiled_timetable = pickle.loads(zlib.decompress(compiled))
+    started = time.perf_counter()
+    day_timetable = DayTimetable(compiled_timetable, DATE)
+    slice_ms = (time.perf_counter() - started) * 1000
+    return {
+        'parse_peak': parse_peak,
+        'peak': peak,
+        'held': held,
+        'cached': cached_size(timetable),
+        'day_cached': len(pickle.dumps(day_timetable, pickle.HIGHEST_PROTOCOL)),
+        'compiled': len(compiled),
+        'slice_ms': slice_ms,
+    }
+
+
+COLUMNS = ['parse_peak', 'peak', 'held', 'cached', 'day_cached', 'compiled', 'slice_ms']
+
+
+def format_columns(result):
+    return ' '.join(('{0:>11,.2f}' if column == 'slice_ms' else '{0:>11,}').format(result[column])
+                    for column in COLUMNS)
+
+print('Timetables of {}'.format(DATE))
+print('{0:<40} {1}'.format('file', ' '.join('{0:>11}'.format(column) for column in COLUMNS)))
+totals = dict.fromkeys(COLUMNS, 0)
+files = 0
+for name, xml_content in xml_files():
+    try:
+        result = measure(xml_content)
+    except Exception as e:
+        print('{0:<40} {1}'.format(name[:40], e))
+        continue
+    if result is None:
+        continue
+    files += 1
+    for column in COLUMNS:
+        totals[column] += result[column]
+    print('{0:<40} {1}'.format(name[:40], format_columns(result)))
+print('{0:<40} {1}'.format('total ({} files)'.format(files), format_columns(totals)))
+print('parse_peak, peak and held are bytes allocated, cached, day_cached and compiled bytes pickled, slice_ms milliseconds')
@@ -7,7 +7,7 @@ and store it in CVS files.
 import json
 import logging
 
-from .util import epoch_to_text
+from .util import epochs_to_text
 
 logger = logging.getLogger(__name__)
 
@@ -34,9 +34,11 @@ def bus_extractor(files, writer):
             logger.debug('Processing %s', file)
             with open(file) as reader:
                 data = json.load(reader)
-                for record in data['request_data']:
+                records = data['request_data']
+                ts_texts = epochs_to_text(record['acp_ts'] for record in records)
+                for record, ts_text in zip(records, ts_texts):
                     record['ts'] = record['acp_ts']
-                    record['ts_text'] = epoch_to_text(record['acp_ts'])
+                    record['ts_text'] = ts_text
                     writer.writerow([record.get(f) for f in fields])
         except OSError as e:
             logger.error('Error opening %s: %s', file, e)
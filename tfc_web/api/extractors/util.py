@@ -1,12 +1,63 @@
 # Utility functions for extractors
 
 from datetime import datetime
+from functools import lru_cache
 
 from pytz import timezone
 
+TZ = timezone('Europe/London')
+
+# 'MM:SS' for every second within an hour
+MINUTES_SECONDS = ['{0:02d}:{1:02d}'.format(*divmod(s, 60)) for s in range(3600)]
+
+
+def slow_epoch_to_text(ts):
+    '''
+    Convert an epoch timestamp to UK local time as text, the obvious way
+    '''
+    return datetime.fromtimestamp(ts, tz=TZ).isoformat()
+
+
+@lru_cache(maxsize=4096)
+def _hour_to_text(hour):
+    '''
+    Return the ('YYYY-MM-DDTHH:', '+HH:MM') text either side of the
+    minutes and seconds for local times in the UTC hour starting at
+    epoch time hour * 3600, or None if minutes and seconds in local time
+    don't match those in UTC (i.e. the offset isn't a whole number of
+    hours).
+
+    UK time zone transitions always happen on a UTC hour, so every
+    timestamp within the same UTC hour shares its date, hour and offset.
+    '''
+    local = datetime.fromtimestamp(hour * 3600, tz=TZ)
+    if local.minute or local.second:
+        return None
+    text = local.isoformat()
+    return text[:14], text[19:]
+
 
 def epoch_to_text(ts):
     '''
-    Convert an epoch timestamp to UK local time as text
+    Convert an epoch timestamp to UK local time as text. Produces the
+    same result as slow_epoch_to_text() but only does the time zone
+    conversion once per hour of timestamps.
+    '''
+    if not isinstance(ts, int):
+        if ts != int(ts):
+            # Fractional seconds - let isoformat() deal with them
+            return slow_epoch_to_text(ts)
+        ts = int(ts)
+    hour, second = divmod(ts, 3600)
+    parts = _hour_to_text(hour)
+    if parts is None:
+        return slow_epoch_to_text(ts)
+    return parts[0] + MINUTES_SECONDS[second] + parts[1]
+
+
+def epochs_to_text(timestamps):
+    '''
+    Convert a sequence of epoch timestamps to a list of UK local times
+    as text
     '''
-    return datetime.fromtimestamp(ts, tz=timezone('Europe/London')).isoformat()
+    return [epoch_to_text(ts) for ts in timestamps]
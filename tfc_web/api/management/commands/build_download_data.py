@@ -11,11 +11,15 @@ import fcntl
 import glob
 
 import importlib
+import io
+import json
 import logging
 import os
+import shutil
+import time
 
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed, wait
 from datetime import date
-from tempfile import NamedTemporaryFile
 from zipfile import ZipFile, ZIP_DEFLATED
 
 from dateutil.relativedelta import relativedelta
@@ -35,6 +39,12 @@ logger.debug('DEST_DIR: %s', DEST_DIR)
 
 TODAY = date.today()
 
+# Directory, within each feed's destination directory, holding the
+# manifests recording the source files each archive was built from
+MANIFEST_DIR = '.manifest'
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
 # Configuration of the archives to maintain. File patterns are processed
 # by .format() with a single named parameter 'date' containing a
 # datetime.date() object representing the start of the period to process
@@ -51,121 +61,412 @@ def get_function(name):
     return getattr(module, function)
 
 
-def get_latest_dtm(files):
+def get_latest_dtm(sources):
     '''
-    Given a list of file names, return the most recent DTM of all of them
+    Given a dictionary of file name -> (mtime_ns, size), return the most
+    recent DTM of all of them
     '''
 
-    latest = None
-    for file in files:
-        dtm = os.path.getmtime(file)
-        logger.debug('File %s, dtm: %s', file, dtm)
-        if latest is None or dtm > latest:
-            latest = dtm
-
-    logger.debug('Latest dnt is %s', latest)
+    latest = max(mtime for (mtime, size) in sources.values()) / 1e9
+    logger.debug('Latest dtm is %s', latest)
     return latest
 
 
-def build_archive(feed, archive, d, force):
+def get_sources(source_pattern, stat_cache):
     '''
-    Create or refresh an individual archive for date 'd'
+    Expand source_pattern and return a dictionary, in file name order,
+    mapping each matching file name relative to SOURCE_DIR to its
+    (mtime_ns, size). Each file is only stat-ed once per run, however
+    many archives it contributes to.
     '''
 
-    # Substitute 'd' into the supplied sources and destination
-    source_pattern = archive['source_pattern'].format(date=d)
-    logger.debug('Build archive source pattern: %s', source_pattern)
+    sources = {}
+    for file in sorted(glob.glob(os.path.join(SOURCE_DIR, source_pattern))):
+        if file not in stat_cache:
+            try:
+                st = os.stat(file)
+            except FileNotFoundError:
+                continue
+            stat_cache[file] = (st.st_mtime_ns, st.st_size)
+        sources[os.path.relpath(file, SOURCE_DIR)] = stat_cache[file]
+    return sources
+
+
+def get_destination(feed, archive, d):
+    '''
+    Return the path of the zip file for an individual archive for date
+    'd', and of the manifest recording what it was built from
+    '''
 
     destination = os.path.join(
         feed['destination'],
         feed['name'],
         archive['destination_filename'].format(date=d)
     )
-    logger.debug('Build archive destination: %s', destination)
+    logger.debug('Archive destination: %s', destination)
 
     zip_dest = os.path.join(DEST_DIR, destination + '.zip')
-    arcname = os.path.basename(destination) + '.csv'
-    source_files = sorted(glob.glob(os.path.join(SOURCE_DIR, source_pattern)))
+    manifest = os.path.join(
+        os.path.dirname(zip_dest), MANIFEST_DIR,
+        os.path.basename(destination) + '.json')
+    return zip_dest, manifest
+
+
+def read_manifest(manifest):
+    '''
+    Return the content of an archive manifest, or None if it's missing
+    or unreadable
+    '''
 
-    work_to_do = False
+    try:
+        with open(manifest) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.error('Error reading manifest %s: %s', manifest, e)
+        return None
+
+
+def write_manifest(manifest, extractor, sources, rows=None):
+    '''
+    Record the extractor and source files an archive was built from,
+    and the number of CSV rows (including the header) it contains
+    '''
+
+    os.makedirs(os.path.dirname(manifest), exist_ok=True)
+    pid = '-' + str(os.getpid())
+    with open(manifest + pid, 'w') as f:
+        json.dump({
+            'extractor': extractor,
+            'sources': {file: list(stat) for (file, stat) in sources.items()},
+            'rows': rows,
+        }, f)
+    os.rename(manifest + pid, manifest)
 
-    if len(source_files) == 0:
+
+def plan_archive(feed, archive, d, force, stat_cache):
+    '''
+    Decide whether an individual archive for date 'd' needs to be
+    created or refreshed. Return the parameters for write_archive() if
+    so, otherwise None (deleting the archive if there's no source data).
+    '''
+
+    # Substitute 'd' into the supplied sources and destination
+    source_pattern = archive['source_pattern'].format(date=d)
+    logger.debug('Build archive source pattern: %s', source_pattern)
+
+    zip_dest, manifest = get_destination(feed, archive, d)
+    sources = get_sources(source_pattern, stat_cache)
+
+    if len(sources) == 0:
         # Positively don't want an archive if there aren't any files
         logger.debug('No files to process')
-        try:
-            os.remove(zip_dest)
-            logger.info('Deleted %s', zip_dest)
-        except FileNotFoundError:
-            pass
+        remove_archive(zip_dest, manifest)
+        return None
+
+    logger.debug('Files to process: %s', len(sources))
+    if not os.path.exists(zip_dest):
+        # Create a missing archive
+        logger.info('Creating %s', zip_dest)
+    elif force:
+        # Re-create existing archive if forced...
+        logger.info('Force refreshing %s', zip_dest)
     else:
-        logger.debug('Files to process: %s', len(source_files))
-        if os.path.exists(zip_dest):
-            # Re-create existing archive if force or the archive is older than at least one source
-            if force:
-                logger.info('Force refreshing %s', zip_dest)
-                work_to_do = True
-            else:
-                source_dtm = get_latest_dtm(source_files)
-                dest_dtm = os.path.getmtime(zip_dest)
-                logger.debug('source dtm: %s, dest_dtm: %s', source_dtm, dest_dtm)
-                if source_dtm > dest_dtm:
-                    logger.info('Refreshing %s', zip_dest)
-                    work_to_do = True
+        # ...or if its sources have changed since it was built
+        previous = read_manifest(manifest)
+        if previous is not None:
+            changed = (previous.get('extractor') != archive['extractor'] or
+                       previous.get('sources') != {file: list(stat) for (file, stat) in sources.items()})
         else:
-            # Create a missing archive
-            logger.info('Creating %s', zip_dest)
-            work_to_do = True
+            # No manifest (yet), so fall back to comparing dates
+            source_dtm = get_latest_dtm(sources)
+            dest_dtm = os.path.getmtime(zip_dest)
+            logger.debug('source dtm: %s, dest_dtm: %s', source_dtm, dest_dtm)
+            changed = source_dtm > dest_dtm
+            if not changed:
+                write_manifest(manifest, archive['extractor'], sources)
+        if not changed:
+            return None
+        logger.info('Refreshing %s', zip_dest)
+
+    job = {
+        'zip_dest': zip_dest,
+        'manifest': manifest,
+        'arcname': get_arcname(zip_dest),
+        'extractor': archive['extractor'],
+        'sources': sources,
+    }
+    if 'derive_from' in archive:
+        job['parts'] = plan_parts(feed, archive, d, sources, stat_cache)
+    return job
+
+
+def get_arcname(zip_dest):
+    '''
+    Return the name of the CSV file within the archive zip_dest
+    '''
 
-    if work_to_do:
-        logger.debug('Writing: %s', zip_dest)
-        # Write CSV to a temporary file because you can't stream into a zip file
-        with NamedTemporaryFile(mode='w', newline='') as csvfile:
-            writer = csv.writer(csvfile, dialect='excel')
+    return os.path.basename(zip_dest)[:-len('.zip')] + '.csv'
 
-            # Retrieve the archive's extractor fn from the 'extractors' module
-            # and run it
-            extractor = get_function(archive['extractor'])
-            extractor(source_files, writer)
-            csvfile.flush()
 
-            # Make the destination directory if missing
-            dir = os.path.dirname(zip_dest)
-            if dir:
-                os.makedirs(dir, exist_ok=True)
+def plan_parts(feed, archive, d, sources, stat_cache):
+    '''
+    Work out how to build the archive for date 'd' from the (finer
+    grained) archives of the archive named by its 'derive_from'. Returns
+    a list of parts, in source file order, each either
+    ('archive', zip_dest, rows) for a component archive whose CSV rows can be
+    copied because it was built by the same extractor from exactly the
+    same files, or ('extract', [file, ...]) for files that have to be
+    extracted from scratch. Returns None if the archive can't be derived.
+    '''
 
-            # Create the zip file under a temporary name, add the csv file to it
-            pid = '-' + str(os.getpid())
-            with ZipFile(zip_dest + pid, mode='w', compression=ZIP_DEFLATED) as zip:
-                zip.write(csvfile.name, arcname=arcname)
+    component = next((a for a in feed['archives'] if a['name'] == archive['derive_from']), None)
+    if component is None:
+        logger.error('Archive %s derives from unknown archive %s', archive['name'], archive['derive_from'])
+        return None
+
+    parts = []
+    covered = {}
+    step = relativedelta(**archive['step'])
+    component_step = relativedelta(**component['step'])
+    c = d
+    while c < d + step:
+        component_sources = get_sources(component['source_pattern'].format(date=c), stat_cache)
+        covered.update(component_sources)
+        if component_sources:
+            zip_dest, manifest = get_destination(feed, component, c)
+            previous = read_manifest(manifest)
+            if (previous is not None and
+                    previous.get('rows') is not None and
+                    previous.get('extractor') == archive['extractor'] and
+                    previous.get('sources') == {file: list(stat) for (file, stat) in component_sources.items()} and
+                    os.path.exists(zip_dest)):
+                parts.append(('archive', zip_dest, previous['rows']))
+            elif parts and parts[-1][0] == 'extract':
+                parts[-1][1].extend(component_sources)
+            else:
+                parts.append(('extract', list(component_sources)))
+        c += component_step
 
-            # Move the new zip file into place
-            os.rename(zip_dest + pid, zip_dest)
+    # Only worth it if the component archives cover exactly the same
+    # files, in the same order, and at least one can be reused
+    if list(covered) != list(sources):
+        logger.warning('Archive %s for %s doesn\'t match its %s archives - extracting from scratch',
+                       archive['name'], d, component['name'])
+        return None
+    if not any(part[0] == 'archive' for part in parts):
+        return None
+    return parts
 
 
-def delete_archive(feed, archive, d):
+class CountingWriter:
     '''
-    Delete an individual archive dor date 'd' if it exists
+    Wrap a CSV writer, counting the rows written through it
     '''
 
-    destination = os.path.join(
-        feed['destination'],
-        feed['name'],
-        archive['destination_filename'].format(date=d)
-    )
-    logger.debug('Delete archive, destination: %s', destination)
+    def __init__(self, writer):
+        self.writer = writer
+        self.rows = 0
+        # Number of rows to silently discard (e.g. a repeated header)
+        self.skip = 0
 
-    zip_dest = os.path.join(DEST_DIR, destination + '.zip')
+    def writerow(self, row):
+        if self.skip:
+            self.skip -= 1
+            return
+        self.rows += 1
+        return self.writer.writerow(row)
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+
+def write_archive(job):
+    '''
+    Run an archive's extractor over its source files and stream the
+    result straight into its zip file, or if it's derived from other
+    archives concatenate their CSV rows, only running the extractor for
+    files they don't cover. This is the unit of work farmed out to worker
+    processes by --jobs. Returns statistics about the archive written.
+    '''
+
+    zip_dest = job['zip_dest']
+    source_files = [os.path.join(SOURCE_DIR, file) for file in job['sources']]
+
+    logger.debug('Writing: %s', zip_dest)
+    started = time.monotonic()
+
+    # Make the destination directory if missing
+    dir = os.path.dirname(zip_dest)
+    if dir:
+        os.makedirs(dir, exist_ok=True)
+
+    # Create the zip file under a temporary name and write the CSV
+    # directly into it
+    pid = '-' + str(os.getpid())
+    try:
+        with ZipFile(zip_dest + pid, mode='w', compression=ZIP_DEFLATED,
+                     compresslevel=job['compresslevel']) as zip:
+            with zip.open(job['arcname'], mode='w', force_zip64=True) as member:
+                with io.TextIOWrapper(member, encoding='utf-8', newline='') as csvfile:
+                    writer = CountingWriter(csv.writer(csvfile, dialect='excel'))
+
+                    # Retrieve the archive's extractor fn from the 'extractors'
+                    # module
+                    extractor = get_function(job['extractor'])
+
+                    parts = job.get('parts') or [('extract', list(job['sources']))]
+                    for n, part in enumerate(parts):
+                        if part[0] == 'extract':
+                            # Run the extractor, dropping the header
+                            # for all but the first part
+                            writer.skip = 1 if n > 0 else 0
+                            extractor([os.path.join(SOURCE_DIR, file) for file in part[1]], writer)
+                        else:
+                            # Copy the rows from a component archive
+                            csvfile.flush()
+                            copy_rows(part[1], member, header=(n == 0))
+                            writer.rows += part[2] - (0 if n == 0 else 1)
+            info = zip.getinfo(job['arcname'])
+    except BaseException:
+        try:
+            os.remove(zip_dest + pid)
+        except FileNotFoundError:
+            pass
+        raise
+
+    # Move the new zip file into place
+    os.rename(zip_dest + pid, zip_dest)
+
+    write_manifest(job['manifest'], job['extractor'], job['sources'], writer.rows)
+
+    elapsed = time.monotonic() - started
+    stats = {
+        'files': len(source_files),
+        'rows': writer.rows,
+        'bytes': info.file_size,
+        'compressed_bytes': info.compress_size,
+        'seconds': elapsed,
+    }
+    logger.info(
+        'Wrote %s: %s files, %s rows, %s bytes (%s compressed) in %.1fs, '
+        '%.0f rows/s, %.2f MB/s',
+        zip_dest, stats['files'], stats['rows'], stats['bytes'],
+        stats['compressed_bytes'], elapsed,
+        stats['rows'] / elapsed if elapsed else 0,
+        stats['bytes'] / elapsed / 1e6 if elapsed else 0)
+    return stats
+
+
+def copy_rows(zip_src, output, header):
+    '''
+    Copy the CSV data from the archive zip_src to the binary file
+    object output, omitting its header row unless 'header'
+    '''
+
+    with ZipFile(zip_src) as zip:
+        with zip.open(get_arcname(zip_src)) as input:
+            if not header:
+                input.readline()
+            shutil.copyfileobj(input, output, COPY_BUFFER_SIZE)
+
+
+def report_totals(feed, results):
+    '''
+    Log the total work done for a feed, given write_archive()'s results
+    '''
+
+    if not results:
+        return
+    seconds = sum(r['seconds'] for r in results)
+    rows = sum(r['rows'] for r in results)
+    logger.info(
+        'Feed %s: %s archives, %s files, %s rows, %s bytes (%s compressed) '
+        'in %.1fs of build time, %.0f rows/s',
+        feed['name'], len(results),
+        sum(r['files'] for r in results), rows,
+        sum(r['bytes'] for r in results),
+        sum(r['compressed_bytes'] for r in results), seconds,
+        rows / seconds if seconds else 0)
+
+
+def build_archive(feed, archive, d, options, stat_cache, executor=None):
+    '''
+    Create or refresh an individual archive for date 'd'. If 'executor'
+    is supplied, submit the work to it, otherwise do it now. Either way
+    return a future for write_archive()'s result, or None if there was
+    nothing to do.
+    '''
+
+    job = plan_archive(feed, archive, d, options['force'], stat_cache)
+    if job is None:
+        return None
+    job['compresslevel'] = options['compression_level']
+    if executor is None:
+        future = Future()
+        future.set_result(write_archive(job))
+    else:
+        future = executor.submit(write_archive, job)
+    future.zip_dest = job['zip_dest']
+    return future
+
+
+def remove_archive(zip_dest, manifest):
+    '''
+    Remove an archive file and its manifest if they exist
+    '''
 
     try:
         os.remove(zip_dest)
         logger.info('Deleted %s', zip_dest)
     except FileNotFoundError:
         pass
+    try:
+        os.remove(manifest)
+    except FileNotFoundError:
+        pass
+
+
+def delete_archive(feed, archive, d):
+    '''
+    Delete an individual archive dor date 'd' if it exists
+    '''
+
+    remove_archive(*get_destination(feed, archive, d))
+
+
+def archive_levels(archives):
+    '''
+    Group archives into a list of lists such that each archive comes
+    after any archive it derives from
+    '''
+
+    by_name = {archive['name']: archive for archive in archives}
+
+    def depth(archive, seen=()):
+        source = by_name.get(archive.get('derive_from'))
+        if source is None or archive['name'] in seen:
+            return 0
+        return depth(source, seen + (archive['name'],)) + 1
 
+    levels = []
+    for archive in archives:
+        level = depth(archive)
+        while len(levels) <= level:
+            levels.append([])
+        levels[level].append(archive)
+    return levels
 
-def process_feed(feed, force):
+
+def process_feed(feed, options, stat_cache, executor=None):
     '''
-    Process an individual feed
+    Process an individual feed. Returns the feed's lock file, which must
+    be closed once any work submitted to 'executor' has completed, a
+    list of futures for that work, and a list of (archive, date) pairs for
+    archives to delete once it has. Returns (None, [], []) if the feed
+    couldn't be locked.
     '''
 
     logger.debug('Processing %s feed', feed['name'])
@@ -176,59 +477,113 @@ def process_feed(feed, force):
         fcntl.lockf(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
     except IOError:
         logger.error('Failed to acquire lock for %s feed - someone else is processing it', feed['name'])
-        return
+        lock_file.close()
+        return None, [], []
+
+    futures = []
+    deletions = []
 
-    # All of the feed's archives...
+    # All of the feed's archives, building those that others derive from
+    # first and leaving deletions until the end in case an archive
+    # that's about to be deleted can still be used to derive another...
     if 'archives' in feed:
-        for archive in feed['archives']:
-
-            logger.debug('Processing %s archive', archive['name'])
-
-            # Start date for the archives: the archive's 'start' date,
-            # failing that 1 Jan in the feed's first_year
-            start = (TODAY - relativedelta(**archive['start']) if 'start' in archive
-                     else date(feed['first_year'], 1, 1))
-            # End date for the archives: the archive's 'end' date,
-            # failing that yesterday
-            end = (TODAY - relativedelta(**archive['end']) if 'end' in archive
-                   else TODAY - relativedelta(days=1))
-
-            # Loop from 1 Jan in the feed's first_year to yesterday by
-            # the archive's 'step'. Build or delete archives depending
-            # on where we are relative to 'start' and 'end'
-            step = relativedelta(**archive['step'])
-            d = date(feed['first_year'], 1, 1)
-            while d + step <= TODAY:
-                if d >= start and d <= end:
-                    build_archive(feed, archive, d, force)
-                else:
-                    delete_archive(feed, archive, d)
-                d += step
+        for level in archive_levels(feed['archives']):
+
+            # Archives in this level may be derived from those in the
+            # last, so wait for them (failures are reported later)
+            wait(futures)
+
+            for archive in level:
+
+                logger.debug('Processing %s archive', archive['name'])
+
+                # Start date for the archives: the archive's 'start' date,
+                # failing that 1 Jan in the feed's first_year
+                start = (TODAY - relativedelta(**archive['start']) if 'start' in archive
+                         else date(feed['first_year'], 1, 1))
+                # End date for the archives: the archive's 'end' date,
+                # failing that yesterday
+                end = (TODAY - relativedelta(**archive['end']) if 'end' in archive
+                       else TODAY - relativedelta(days=1))
+
+                # Loop from 1 Jan in the feed's first_year to yesterday by
+                # the archive's 'step'. Build or delete archives depending
+                # on where we are relative to 'start' and 'end'
+                step = relativedelta(**archive['step'])
+                d = date(feed['first_year'], 1, 1)
+                while d + step <= TODAY:
+                    if d >= start and d <= end:
+                        futures.append(build_archive(feed, archive, d, options, stat_cache, executor))
+                    else:
+                        deletions.append((archive, d))
+                    d += step
+
+                futures = [future for future in futures if future is not None]
 
     # ...and build the metadata
     if 'metadata' in feed:
         for metadata in feed['metadata']:
-            build_archive(feed, metadata, None, force)
+            futures.append(build_archive(feed, metadata, None, options, stat_cache, executor))
 
-    # And release the lock
-    lock_file.close()
+    return lock_file, [future for future in futures if future is not None], deletions
 
 
-def process_feeds(feed_list, force):
+def delete_archives(feed, deletions):
     '''
-    Process all the feeds
+    Delete the archives listed by process_feed()
     '''
 
+    for archive, d in deletions:
+        delete_archive(feed, archive, d)
+
+
+def process_feeds(feed_list, options):
+    '''
+    Process all the feeds, using a pool of options['jobs'] worker
+    processes to build archives if that's more than 1
+    '''
+
+    feeds = []
     for feed in settings.DOWNLOAD_FEEDS:
         logger.debug('Considering %s', feed['name'])
         # If we have a list of feeds then only process those
         if feed_list:
             if feed['name'] in feed_list:
-                process_feed(feed, force)
+                feeds.append(feed)
         # Otherwise, process every feed with 'archive_by_default': True
         else:
             if feed.get('archive_by_default'):
-                process_feed(feed, force)
+                feeds.append(feed)
+
+    stat_cache = {}
+
+    if options['jobs'] <= 1:
+        for feed in feeds:
+            lock_file, futures, deletions = process_feed(feed, options, stat_cache)
+            if lock_file:
+                delete_archives(feed, deletions)
+                # And release the lock
+                lock_file.close()
+                report_totals(feed, [future.result() for future in futures])
+        return
+
+    with ProcessPoolExecutor(max_workers=options['jobs']) as executor:
+        locked = []
+        for feed in feeds:
+            lock_file, futures, deletions = process_feed(feed, options, stat_cache, executor)
+            if lock_file:
+                locked.append((feed, lock_file, futures, deletions))
+        for feed, lock_file, futures, deletions in locked:
+            results = []
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception:
+                    logger.exception('Failed to build %s', future.zip_dest)
+            delete_archives(feed, deletions)
+            # Release each feed's lock once all its archives are done
+            lock_file.close()
+            report_totals(feed, results)
 
 
 class Command (BaseCommand):
@@ -250,8 +605,26 @@ class Command (BaseCommand):
             help='Force (re-)generation of archives',
         )
 
+        # Number of worker processes
+        parser.add_argument(
+            '--jobs',
+            type=int,
+            default=1,
+            help='Build up to this many archives at once in separate processes (default 1)',
+        )
+
+        # Compression level
+        parser.add_argument(
+            '--compression-level',
+            type=int,
+            choices=range(0, 10),
+            default=getattr(settings, 'DOWNLOAD_COMPRESSION_LEVEL', None),
+            metavar='0-9',
+            help='zlib compression level for archives (default 6, or DOWNLOAD_COMPRESSION_LEVEL if set)',
+        )
+
     def handle(self, *args, **options):
         try:
-            process_feeds(options['feed'], options['force'])
+            process_feeds(options['feed'], options)
         except KeyboardInterrupt:
             pass
@@ -75,6 +75,8 @@ def test_parking():
     make_request('parking/grafton-east-car-park/', '')
     make_request('parking/history/grafton-east-car-park/?start_date=2018-01-01', 'request_data')
     make_request('parking/latest/grafton-east-car-park/', '')
+    make_request('parking/latest/', 'request_data')
+    make_request('parking/latest/?ids=grafton-east-car-park', 'request_data')
     make_request('parking/previous/grafton-east-car-park/', '')
 
 
@@ -109,3 +111,23 @@ def test_zone():
     make_request('zone/', 'zone_list')
     make_request('zone/east_road_in/', '')
     make_request('zone/history/east_road_in/?start_date=2018-01-02', 'request_data')
+
+
+# BTJourney endpoints
+#
+# Link ids come from the link list and the latest journey times, as links
+# are occasionally added
+def test_btjourney():
+    links = make_request('traffic/btjourney/link/', 'link_list')
+    make_request('traffic/btjourney/route/', 'route_list')
+    make_request('traffic/btjourney/site/', 'site_list')
+    a_link_id = links['link_list'][0]['id']
+    make_request(f'traffic/btjourney/link_or_route/{a_link_id}/', '')
+
+    latest = make_request('traffic/btjourney/latest/', 'request_data')
+    a_latest_id = latest['request_data'][0]['id']
+    make_request(f'traffic/btjourney/latest/{a_latest_id}/', '')
+    filtered = make_request('traffic/btjourney/latest/', 'request_data', params={'ids': a_latest_id})
+    assert [record['id'] for record in filtered['request_data']] == [a_latest_id]
+    make_request('traffic/btjourney/latest/?ids=' + ','.join(
+        record['id'] for record in latest['request_data'][:3]), 'request_data')
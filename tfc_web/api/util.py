@@ -1,15 +1,17 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from django.conf import settings
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
 from urllib.request import Request, urlopen
 from urllib.error import HTTPError
 from rest_framework import status, serializers
 from rest_framework.exceptions import APIException
+from rest_framework.utils.encoders import JSONEncoder
 import codecs
 import json
 import logging
 import os
 import re
+import threading
 
 
 # Path to the data store
@@ -35,6 +37,9 @@ class EpochField(serializers.Field):
 # maximum days allowed in one hit
 MAX_DAYS = 31
 
+# approximate size of each chunk of a streamed JSON response
+STREAM_CHUNK_SIZE = 64 * 1024
+
 
 class ListArgsSerializer(serializers.Serializer):
     ''' Common query string parameters '''
@@ -56,6 +61,33 @@ class ListArgsSerializer(serializers.Serializer):
         return data
 
 
+def get_list_args(params):
+    '''
+    Validate the start_date and (optional) end_date in params (e.g. a
+    request's query_params) and return a list of the dates they cover
+    '''
+    args = ListArgsSerializer(data=params)
+    args.is_valid(raise_exception=True)
+    start_date = args.validated_data.get('start_date')
+    end_date = args.validated_data.get('end_date')
+    if end_date is None:
+        end_date = start_date
+    day_count = (end_date - start_date).days + 1
+    return [start_date + timedelta(n) for n in range(day_count)]
+
+
+def get_ids_arg(request, name='ids'):
+    '''
+    Return the list of identifiers in the comma-separated query string
+    parameter 'name' (without blanks or duplicates), or None if the
+    parameter wasn't supplied
+    '''
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    return list(dict.fromkeys(id for id in value.split(',') if id))
+
+
 def safe_build(path):
     '''
     Build a pathname from DATA_PATH and path, checking that the
@@ -77,14 +109,23 @@ def read_json(path):
     '''
     try:
         filename = safe_build(path)
+        return load_json(filename)
+    except FileNotFoundError:
+        logger.info("Failed to open '{0}'".format(filename))
+        raise
+
+
+def load_json(filename):
+    '''
+    Read and parse a file containing well-formed JSON, given its
+    full filename
+    '''
+    try:
         with open(filename) as f:
             return json.load(f)
     except json.JSONDecodeError:
         logger.error("Failed to parse '{0}'".format(filename))
         raise
-    except FileNotFoundError:
-        logger.info("Failed to open '{0}'".format(filename))
-        raise
 
 
 def read_json_fragments(path):
@@ -108,6 +149,145 @@ def read_json_fragments(path):
     return results
 
 
+def iter_json_fragments(paths):
+    '''
+    Lazily read a sequence of files, each containing multiple lines of
+    well-formed JSON, yielding each parsed line in turn. Files that don't
+    exist are skipped.
+    '''
+    for path in paths:
+        filename = safe_build(path)
+        try:
+            f = open(filename)
+        except FileNotFoundError:
+            logger.info("Failed to open '{0}'".format(filename))
+            continue
+        with f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logger.error("Failed to parse '{0}' from '{1}'"
+                                 .format(line, filename))
+                    raise
+
+
+def wants_streaming(request):
+    '''
+    True if the response to request can be streamed as raw JSON rather
+    than going through DRF's renderers (which would rule out the
+    browsable API)
+    '''
+    renderer = getattr(request, 'accepted_renderer', None)
+    return renderer is not None and renderer.format == 'json'
+
+
+def stream_json_list(key, records, child_serializer):
+    '''
+    Return a StreamingHttpResponse containing a JSON object with a single
+    member 'key' holding a list of records, each serialized with
+    child_serializer as it is read. The output matches what
+    Response(SomeSerializer({key: list(records)}).data) would produce,
+    but without holding all the records in memory.
+    '''
+    encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    def generate():
+        yield '{{{0}:['.format(encoder.encode(key))
+        separator = ''
+        chunk = []
+        size = 0
+        for record in records:
+            item = encoder.encode(child_serializer.to_representation(record))
+            chunk.append(item)
+            size += len(item)
+            # Emit reasonably sized chunks rather than one per record
+            if size >= STREAM_CHUNK_SIZE:
+                yield separator + ','.join(chunk)
+                separator = ','
+                chunk = []
+                size = 0
+        if chunk:
+            yield separator + ','.join(chunk)
+        yield ']}'
+
+    return StreamingHttpResponse(
+        generate(), content_type='application/json')
+
+
+class FileCache:
+    '''
+    A per-process cache of values derived from files below DATA_PATH.
+
+    get(path) calls loader(filename) the first time path is requested and
+    thereafter returns the same value until the file's mtime, inode or
+    size changes (which covers both in-place rewrites and the
+    write-then-rename used by the data feeds). Cached values are shared
+    between requests and must not be modified by callers.
+    '''
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        filename = safe_build(path)
+        try:
+            st = os.stat(filename)
+        except FileNotFoundError:
+            logger.info("Failed to open '{0}'".format(filename))
+            with self.lock:
+                self.entries.pop(filename, None)
+            raise
+        signature = (st.st_mtime_ns, st.st_ino, st.st_size)
+        with self.lock:
+            entry = self.entries.get(filename)
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+        value = self.loader(filename)
+        with self.lock:
+            self.entries[filename] = (signature, value)
+        return value
+
+
+class ConfigFile:
+    '''
+    A parsed config list file, plus lazily-built indexes mapping
+    identifiers to individual configs
+    '''
+
+    def __init__(self, filename):
+        self.configs = load_json(filename)
+        self.indexes = {}
+
+    def lookup(self, key, id_field_name, id):
+        index = self.indexes.get((key, id_field_name))
+        if index is None:
+            index = {}
+            for config in self.configs[key]:
+                # Keep the first of any duplicates, as a linear scan would
+                index.setdefault(config.get(id_field_name), config)
+            self.indexes[(key, id_field_name)] = index
+        return index.get(id)
+
+
+config_cache = FileCache(ConfigFile)
+
+
+class MonitorSnapshot:
+    '''
+    A parsed 'data_monitor_json' file, plus an index mapping the value
+    of id_field_name to each record in its 'request_data' list
+    '''
+
+    def __init__(self, filename, id_field_name):
+        self.data = load_json(filename)
+        self.records = {}
+        for record in self.data['request_data']:
+            self.records.setdefault(record.get(id_field_name), record)
+
+
 def get_config(type, id=None, key=None, id_field_name=None):
     '''
     Get the config for a metric 'type'. If 'id' is None, return the
@@ -121,25 +301,32 @@ def get_config(type, id=None, key=None, id_field_name=None):
 
     Try to read 'list_all.json' and fall back to 'list.json' to support
     zones in which list.json isn't complete.
+
+    Parsed list files are cached in config_cache and only re-read when
+    they change on disk, so the result must not be modified.
     '''
     try:
         filename = 'sys/data_{0}_config/list_all.json'.format(type)
-        configs = read_json(filename)
+        config_file = config_cache.get(filename)
     except FileNotFoundError:
         filename = 'sys/data_{0}_config/list.json'.format(type)
-        configs = read_json(filename)
+        config_file = config_cache.get(filename)
     if id is None:
-        return configs
-    for config in configs[key]:
-        if config.get(id_field_name) == id:
-            return config
+        return config_file.configs
+    config = config_file.lookup(key, id_field_name, id)
+    if config is not None:
+        return config
     logger.error('Config type {0} for "{1}" not found'.format(type, id))
     raise TFCValidationError('Bad ID "{0}"'.format(id))
 
 
 def do_api_call(query):
     '''
-    Helper function for authenticated access to the API
+    Helper function for authenticated access to the API over HTTP.
+
+    Views running in this process should use the <app>.api.services
+    modules instead, which return the same data without a loopback
+    request; this remains as a fallback for anything that can't.
     '''
     logger.debug('Query: %s', query)
     if not check_query(query):
@@ -0,0 +1,70 @@
+'''
+In-process access to air quality data, shared by the API views in
+aq.api.views and the HTML views in aq.views. Functions returning
+serialized data produce exactly what the corresponding API endpoint
+would return.
+'''
+from datetime import datetime
+import logging
+
+from rest_framework.exceptions import NotFound
+
+from .serializers import (
+    AQListSerializer, AQConfigSerializer,
+    AQDataSerializer)
+from api import util
+
+logger = logging.getLogger(__name__)
+
+
+def get_aq_config(station_id=None):
+    if station_id is None:
+        return util.get_config('cam_aq')
+    else:
+        try:
+            return util.get_config('cam_aq', station_id,
+                                   'aq_list', 'StationID')
+        except util.TFCValidationError as e:
+            raise NotFound("Station not found: {0}".format(e))
+
+
+def get_aq_history(station_id, sensor_type, month):
+    '''
+    Return the data for sensor_type on station_id for month ('YYYY-MM')
+    '''
+    # Note that this validates station_id!
+    config = get_aq_config(station_id)
+
+    if sensor_type not in config['SensorTypes']:
+        raise NotFound("No sensor '{0}' on station '{1}'"
+                       .format(sensor_type, station_id))
+
+    try:
+        month = datetime.strptime(month, '%Y-%m')
+    except ValueError:
+        raise util.TFCValidationError(
+            "Month '{0}' has the wrong format. Use YYYY-MM".format(month))
+
+    try:
+        filename = (
+            'cam_aq/data_bin/{1:%Y}/{1:%m}/{0}/{0}_{2}_{1:%Y-%m}.json'
+            .format(station_id, month, sensor_type)
+            )
+        return util.read_json(filename)
+    except FileNotFoundError:
+        raise NotFound("No data found for station '{0}', sensor '{1}', "
+                       "month '{2:%Y-%m}'"
+                       .format(station_id, sensor_type, month))
+
+
+def aq_list():
+    return AQListSerializer(get_aq_config()).data
+
+
+def aq_config(station_id):
+    return AQConfigSerializer(get_aq_config(station_id)).data
+
+
+def aq_history(station_id, sensor_type, month):
+    return AQDataSerializer(
+        get_aq_history(station_id, sensor_type, month)).data
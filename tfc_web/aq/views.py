@@ -2,10 +2,10 @@ import json
 from django.shortcuts import render
 from django.http import Http404
 from datetime import date, timedelta, datetime
-from urllib.error import HTTPError
+from rest_framework.exceptions import NotFound
 import logging
 
-from api.util import do_api_call
+from aq.api import services
 
 logger = logging.getLogger(__name__)
 
@@ -16,20 +16,19 @@ logger = logging.getLogger(__name__)
 
 def get_aq_list():
 
-    data = do_api_call('/api/v1/aq/')
+    data = services.aq_list()
     return {'request_data': data}
 
 
 def get_aq_metadata(station_id):
 
-    data = do_api_call('/api/v1/aq/' + station_id)
+    data = services.aq_config(station_id)
     return {'request_data': data}
 
 
 def get_aq_history(station_id, sensor_type, month):
 
-        data = do_api_call(
-            '/api/v1/aq/history/' + station_id + '/' + sensor_type + '/' + month)
+        data = services.aq_history(station_id, sensor_type, month)
         return {'request_data': data}
 
 #############################################################################
@@ -70,17 +69,13 @@ def aq_plot(request, station_id):
             sensor_json.append(
                 get_aq_history(station_id, sensor_type, this_date)
             )
-        except HTTPError as e:
-            if e.code != 404:
-                raise e
+        except NotFound:
+            pass
 
     try:
         station_config = get_aq_metadata(station_id)
-    except HTTPError as e:
-        if e.code == 404:
-            raise Http404("AQ Plot invalid station id {0}".format(station_id))
-        else:
-            raise e
+    except NotFound:
+        raise Http404("AQ Plot invalid station id {0}".format(station_id))
 
     user_date = q_date.strftime('%Y-%m-%d')
     YYYY = user_date[0:4]
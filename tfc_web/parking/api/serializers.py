@@ -19,6 +19,7 @@ class ParkingRecordSerializer(serializers.Serializer):
 
 
 class ParkingHistorySerializer(serializers.Serializer):
+    # Also the list of latest records of parking_latest_list
     request_data = ParkingRecordSerializer(many=True)
 
 
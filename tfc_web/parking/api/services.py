@@ -0,0 +1,136 @@
+'''
+In-process access to car park data, shared by the API views in
+parking.api.views and the HTML views in parking.views. Functions
+returning serialized data produce exactly what the corresponding API
+endpoint would return.
+'''
+from functools import partial
+import logging
+
+from rest_framework.exceptions import NotFound
+
+from .serializers import (
+    ParkingListSerializer, ParkingConfigSerializer,
+    ParkingRecordSerializer, ParkingHistorySerializer)
+from api import util
+
+logger = logging.getLogger(__name__)
+
+
+def get_feed_config(feed_id):
+    return util.get_config('feed', feed_id, 'feed_list', 'feed_id')
+
+
+def get_parking_config(parking_id=None):
+    if parking_id is None:
+        return util.get_config('parking')
+    else:
+        try:
+            return util.get_config('parking', parking_id,
+                                   'parking_list', 'parking_id')
+        except (util.TFCValidationError) as e:
+            raise NotFound("Car park not found: {0}".format(e))
+
+
+parking_monitor_cache = util.FileCache(
+    partial(util.MonitorSnapshot, id_field_name='parking_id'))
+
+
+def read_parking_monitor(config, suffix=''):
+    '''
+    Get recent or previous-recent data for the car park described by
+    config, or None if the monitor file doesn't include it
+    '''
+    parking_id = config['parking_id']
+    feed_id = config['feed_id']
+    # Read latest data
+    filename = ('{0}/data_monitor_json/post_data.json{1}'
+                .format(feed_id, suffix))
+    snapshot = parking_monitor_cache.get(filename)
+    # Find this car park
+    value = snapshot.records.get(parking_id)
+    if value is None:
+        return None
+    # Populate a copy of the car park record with feed_id & ts from envelope
+    value = dict(value)
+    value['feed_id'] = snapshot.data['feed_id']
+    value['ts'] = snapshot.data['ts']
+    value['acp_ts'] = value['ts']
+    return value
+
+
+def get_parking_monitor(parking_id, suffix=''):
+    '''
+    Get recent or previous-recent data for a particular car park
+    '''
+    config = get_parking_config(parking_id)
+    value = read_parking_monitor(config, suffix)
+    if value is None:
+        raise NotFound("No data found for '{0}'".format(parking_id))
+    return value
+
+
+def get_parking_monitor_list(parking_ids=None, suffix=''):
+    '''
+    Get recent or previous-recent data for each of a list of car parks,
+    or for all car parks if parking_ids is None, omitting any for
+    which there is no data
+    '''
+    if parking_ids is None:
+        configs = get_parking_config()['parking_list']
+    else:
+        configs = [get_parking_config(parking_id)
+                   for parking_id in parking_ids]
+    results = []
+    for config in configs:
+        try:
+            value = read_parking_monitor(config, suffix)
+        except FileNotFoundError:
+            continue
+        if value is not None:
+            results.append(value)
+    return results
+
+
+def get_parking_history(parking_id, dates):
+    '''
+    Return an iterator over the historic records for a car park for
+    each date in dates
+    '''
+    # Note that this validates parking_id!
+    config = get_parking_config(parking_id)
+    feed_id = config['feed_id']
+
+    filenames = [
+        '{0}/data_park/{2:%Y}/{2:%m}/{2:%d}/{1}_{2:%Y-%m-%d}.txt'
+        .format(feed_id, parking_id, date)
+        for date in dates
+    ]
+    return util.iter_json_fragments(filenames)
+
+
+def parking_list():
+    return ParkingListSerializer(get_parking_config()).data
+
+
+def parking_config(parking_id):
+    return ParkingConfigSerializer(get_parking_config(parking_id)).data
+
+
+def parking_history(parking_id, dates):
+    results = list(get_parking_history(parking_id, dates))
+    return ParkingHistorySerializer({'request_data': results}).data
+
+
+def parking_latest(parking_id):
+    return ParkingRecordSerializer(get_parking_monitor(parking_id)).data
+
+
+def parking_previous(parking_id):
+    return ParkingRecordSerializer(
+        get_parking_monitor(parking_id, '.prev')).data
+
+
+def parking_latest_list(parking_ids=None):
+    results = get_parking_monitor_list(parking_ids)
+    return ParkingHistorySerializer({'request_data': results}).data
@@ -4,6 +4,7 @@ from . import views
 
 urlpatterns = [
     url(r'^$', views.ParkingList.as_view()),
+    url(r'^latest/$', views.ParkingLatestList.as_view()),
     url(r'^(?P<parking_id>[^/]+)/$', views.ParkingConfig.as_view()),
     url(r'^latest/(?P<parking_id>[^/]+)/$', views.ParkingLatest.as_view()),
     url(r'^previous/(?P<parking_id>[^/]+)/$', views.ParkingPrevious.as_view()),
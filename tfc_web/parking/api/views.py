@@ -1,14 +1,11 @@
-from .serializers import (
-    ParkingListSerializer, ParkingConfigSerializer,
-    ParkingRecordSerializer, ParkingHistorySerializer)
+from .serializers import ParkingRecordSerializer
+from . import services
 from api import util, auth
 import coreapi
 import coreschema
-from datetime import timedelta
 from rest_framework.response import Response
 from rest_framework.schemas import AutoSchema
 import logging
-from rest_framework.exceptions import NotFound
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +21,22 @@ parking_id_fields = [
     ),
 ]
 
+ids_fields = [
+    coreapi.Field(
+        "ids",
+        required=False,
+        location="query",
+        schema=coreschema.String(
+            description="Comma-separated list of car park identifiers "
+                        "(e.g. 'grafton-east-car-park,grand-arcade-car-park'). "
+                        "Defaults to all car parks"),
+        description="Comma-separated list of car park identifiers "
+                    "(e.g. 'grafton-east-car-park,grand-arcade-car-park'). "
+                    "Defaults to all car parks",
+        example="grafton-east-car-park,grand-arcade-car-park",
+    ),
+]
+
 list_args_fields = [
     coreapi.Field(
         "start_date",
@@ -51,51 +64,13 @@ list_args_fields = [
 ]
 
 
-def get_feed_config(feed_id):
-    return util.get_config('feed', feed_id, 'feed_list', 'feed_id')
-
-
-def get_parking_config(parking_id=None):
-    if parking_id is None:
-        return util.get_config('parking')
-    else:
-        try:
-            return util.get_config('parking', parking_id,
-                                   'parking_list', 'parking_id')
-        except (util.TFCValidationError) as e:
-            raise NotFound("Car park not found: {0}".format(e))
-
-
-def get_parking_monitor(parking_id, suffix=''):
-    '''
-    Get recent or previous-recent data for a particular car park
-    '''
-    config = get_parking_config(parking_id)
-    feed_id = config['feed_id']
-    # Read latest data
-    filename = ('{0}/data_monitor_json/post_data.json{1}'
-                .format(feed_id, suffix))
-    data = util.read_json(filename)
-    # Find this car park
-    for value in data['request_data']:
-        if value['parking_id'] == parking_id:
-            # Populate car park record with feed_id & ts from envelope
-            value['feed_id'] = data['feed_id']
-            value['ts'] = data['ts']
-            value['acp_ts'] = value['ts']
-            return value
-    raise NotFound("No data found for '{0}'".format(parking_id))
-
-
 class ParkingList(auth.AuthenticateddAPIView):
     '''
     List metadata for all known car parks, including each car park's
     _parking-id_.
     '''
     def get(self, request):
-        data = get_parking_config()
-        serializer = ParkingListSerializer(data)
-        return Response(serializer.data)
+        return Response(services.parking_list())
 
 
 class ParkingConfig(auth.AuthenticateddAPIView):
@@ -105,9 +80,7 @@ class ParkingConfig(auth.AuthenticateddAPIView):
     schema = AutoSchema(manual_fields=parking_id_fields)
 
     def get(self, request, parking_id):
-        data = get_parking_config(parking_id)
-        serializer = ParkingConfigSerializer(data)
-        return Response(serializer.data)
+        return Response(services.parking_config(parking_id))
 
 
 class ParkingHistory(auth.AuthenticateddAPIView):
@@ -121,31 +94,14 @@ class ParkingHistory(auth.AuthenticateddAPIView):
 
     def get(self, request, parking_id):
 
-        args = util.ListArgsSerializer(data=request.query_params)
-        args.is_valid(raise_exception=True)
-
-        # Note that this validates parking_id!
-        config = get_parking_config(parking_id)
-        feed_id = config['feed_id']
-
-        start_date = args.validated_data.get('start_date')
-        end_date = args.validated_data.get('end_date')
-        if end_date is None:
-            end_date = start_date
-        day_count = (end_date - start_date).days + 1
-
-        results = []
-        for date in (start_date + timedelta(n) for n in range(day_count)):
-            try:
-                filename = (
-                    '{0}/data_park/{2:%Y}/{2:%m}/{2:%d}/{1}_{2:%Y-%m-%d}.txt'
-                    .format(feed_id, parking_id, date)
-                    )
-                results = results + util.read_json_fragments(filename)
-            except FileNotFoundError:
-                pass
-        serializer = ParkingHistorySerializer({'request_data': results})
-        return Response(serializer.data)
+        dates = util.get_list_args(request.query_params)
+
+        if util.wants_streaming(request):
+            results = services.get_parking_history(parking_id, dates)
+            return util.stream_json_list(
+                'request_data', results, ParkingRecordSerializer())
+
+        return Response(services.parking_history(parking_id, dates))
 
 
 class ParkingLatest(auth.AuthenticateddAPIView):
@@ -156,9 +112,21 @@ class ParkingLatest(auth.AuthenticateddAPIView):
     schema = AutoSchema(manual_fields=parking_id_fields)
 
     def get(self, request, parking_id):
-        data = get_parking_monitor(parking_id)
-        serializer = ParkingRecordSerializer(data)
-        return Response(serializer.data)
+        return Response(services.parking_latest(parking_id))
+
+
+class ParkingLatestList(auth.AuthenticateddAPIView):
+    '''
+    Return most recent car park occupancy data for all car parks, or for
+    the car parks identified by a comma-separated list of _parking_id_s
+    in _ids_. Car parks for which no recent data is available are
+    omitted.
+    '''
+    schema = AutoSchema(manual_fields=ids_fields)
+
+    def get(self, request):
+        return Response(
+            services.parking_latest_list(util.get_ids_arg(request)))
 
 
 class ParkingPrevious(auth.AuthenticateddAPIView):
@@ -169,6 +137,4 @@ class ParkingPrevious(auth.AuthenticateddAPIView):
     schema = AutoSchema(manual_fields=parking_id_fields)
 
     def get(self, request, parking_id):
-        data = get_parking_monitor(parking_id, '.prev')
-        serializer = ParkingRecordSerializer(data)
-        return Response(serializer.data)
+        return Response(services.parking_previous(parking_id))
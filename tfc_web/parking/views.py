@@ -1,12 +1,13 @@
 import json
 from datetime import date, timedelta, datetime
-from urllib.error import HTTPError
 from django.shortcuts import render
 from django.http import Http404
 from django.views.decorators.clickjacking import xframe_options_exempt
+from rest_framework.exceptions import NotFound
 import logging
 
-from api.util import do_api_call
+from api.util import get_list_args
+from parking.api import services
 
 logger = logging.getLogger(__name__)
 
@@ -17,42 +18,29 @@ logger = logging.getLogger(__name__)
 
 def get_parking_list():
 
-    data = do_api_call('/api/v1/parking/')
+    data = services.parking_list()
     return {'request_data': data}
 
 
 def get_parking_metadata(parking_id):
 
-    data = do_api_call('/api/v1/parking/' + parking_id)
+    data = services.parking_config(parking_id)
     # Fix for change between old and new API field names
     return {'request_data': data}
 
 
 def get_parking_history(parking_id, date):
     try:
-        return do_api_call(
-            '/api/v1/parking/history/' + parking_id +
-            '?start_date=' + date)
-    except HTTPError as e:
-        if e.code != 404:
-            raise e
-        else:
-            raise Http404
+        return services.parking_history(
+            parking_id, get_list_args({'start_date': date}))
+    except NotFound:
+        raise Http404
 
 
-def get_parking_occupancy(parking_list):
+def get_parking_occupancy():
 
-    request_data = []
-    for car_park in parking_list['request_data']['parking_list']:
-        try:
-            data = do_api_call(
-                '/api/v1/parking/latest/' +
-                car_park['parking_id'])
-            request_data.append(data)
-        except HTTPError as e:
-            if e.code != 404:
-                raise e
-    return {'request_data': {'request_data': request_data}}
+    data = services.parking_latest_list()
+    return {'request_data': data}
 
 #############################################################################
 # parking/plot/<parking_id>?date=YYYY-MM-DD&priordays=n[,n...]              #
@@ -116,7 +104,7 @@ def parking_plot(request, parking_id):
 def parking_map(request):
 
     parking_list = get_parking_list()
-    parking_feed = get_parking_occupancy(parking_list)
+    parking_feed = get_parking_occupancy()
 
     return render(request, 'parking/parking_map.html', {
         'config_parking_list': json.dumps(parking_list),
@@ -130,7 +118,7 @@ def parking_map(request):
 
 def parking_list(request):
     parking_list = get_parking_list()
-    parking_feed = get_parking_occupancy(parking_list)
+    parking_feed = get_parking_occupancy()
 
     return render(request, 'parking/parking_list.html', {
         'config_parking_list': json.dumps(parking_list),
@@ -300,6 +300,7 @@ DOWNLOAD_FEEDS = [
                 'source_pattern': os.path.join('cam_park_rss/data_park', '{date:%Y}', '*', '*', '*.txt'),
                 'destination_filename': 'parking-{date:%Y}',
                 'extractor': 'api.extractors.parking.cam_park_rss_extractor',
+                'derive_from': 'month',
                 'step': {'years': 1}
             },
             {
@@ -308,6 +309,7 @@ DOWNLOAD_FEEDS = [
                 'source_pattern': os.path.join('cam_park_rss/data_park', '{date:%Y}', '{date:%m}', '*', '*.txt'),
                 'destination_filename': 'parking-{date:%Y}-{date:%m}',
                 'extractor': 'api.extractors.parking.cam_park_rss_extractor',
+                'derive_from': 'day',
                 'step': {'months': 1}
             },
             {
@@ -347,6 +349,7 @@ DOWNLOAD_FEEDS = [
                 'source_pattern': os.path.join('cloudamber/sirivm/data_zone', '{date:%Y}', '*', '*', '*.txt'),
                 'destination_filename': 'zone-{date:%Y}',
                 'extractor': 'api.extractors.zone.zone_extractor',
+                'derive_from': 'month',
                 'step': {'years': 1}
             },
             {
@@ -355,6 +358,7 @@ DOWNLOAD_FEEDS = [
                 'source_pattern': os.path.join('cloudamber/sirivm/data_zone', '{date:%Y}', '{date:%m}', '*', '*.txt'),
                 'destination_filename': 'zone-{date:%Y}-{date:%m}',
                 'extractor': 'api.extractors.zone.zone_extractor',
+                'derive_from': 'day',
                 'step': {'months': 1}
             },
             {
@@ -412,6 +416,7 @@ DOWNLOAD_FEEDS = [
                 'source_pattern': os.path.join('btjourney/journeytimes/data_link', '{date:%Y}', '*', '*', '*.txt'),
                 'destination_filename': 'btjourney-{date:%Y}',
                 'extractor': 'api.extractors.btjourney.btjourney_journey_extractor',
+                'derive_from': 'month',
                 'step': {'years': 1}
             },
             {
@@ -420,6 +425,7 @@ DOWNLOAD_FEEDS = [
                 'source_pattern': os.path.join('btjourney/journeytimes/data_link', '{date:%Y}', '{date:%m}', '*', '*.txt'),
                 'destination_filename': 'btjourney-{date:%Y}-{date:%m}',
                 'extractor': 'api.extractors.btjourney.btjourney_journey_extractor',
+                'derive_from': 'day',
                 'step': {'months': 1}
             },
             {
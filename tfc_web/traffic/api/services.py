@@ -0,0 +1,263 @@
+'''
+In-process access to zone and BTJourney data, shared by the API views
+in traffic.api.views and the HTML views in traffic.views. Functions
+returning serialized data produce exactly what the corresponding API
+endpoint would return.
+'''
+from collections.abc import Mapping
+from functools import partial
+import logging
+import os
+import threading
+
+from rest_framework.exceptions import NotFound
+
+from .serializers import (
+    ZoneListSerializer, ZoneConfigSerializer, ZoneHistorySerializer,
+    BTJourneySiteSerializer, BTJourneySiteListSerializer,
+    BTJourneyLinkOrRouteSerializer,
+    BTJourneyLinkListSerializer, BTJourneyRouteListSerializer,
+    BTJourneyLinkRecordSerializer, BTJourneyLinkRecordListSerializer)
+from api import util
+
+
+logger = logging.getLogger(__name__)
+
+
+# # Zones
+
+def get_zone_config(zone_id=None):
+    if zone_id is None:
+        return util.get_config('zone')
+    else:
+        try:
+            return util.get_config('zone', zone_id,
+                                   'zone_list', 'zone.id')
+        except (util.TFCValidationError) as e:
+            raise NotFound("Zone not found: {0}".format(e))
+
+
+def swap_dot_and_underscore(data):
+    ''' serializer can't cope with '.' in keys - switch to '_' '''
+    return {key.replace('.', '_'): value for (key, value) in data.items()}
+
+
+def get_zone_history(zone_id, dates):
+    '''
+    Return an iterator over the historic records for a zone for each
+    date in dates
+    '''
+    # Note that this validates zone_id!
+    get_zone_config(zone_id)
+
+    filenames = [
+        'cloudamber/sirivm/data_zone/'
+        '{1:%Y}/{1:%m}/{1:%d}/{0}_{1:%Y-%m-%d}.txt'
+        .format(zone_id, date)
+        for date in dates
+    ]
+    return util.iter_json_fragments(filenames)
+
+
+def zone_list():
+    data = get_zone_config()
+    # serializer can't cope with '.' in keys - switch to '_'
+    fixed_zones = []
+    for zone in data['zone_list']:
+        fixed_zone = swap_dot_and_underscore(zone)
+        fixed_zones.append(fixed_zone)
+    return ZoneListSerializer({"zone_list": fixed_zones}).data
+
+
+def zone_config(zone_id):
+    data = get_zone_config(zone_id)
+    return ZoneConfigSerializer(swap_dot_and_underscore(data)).data
+
+
+def zone_history(zone_id, dates):
+    results = list(get_zone_history(zone_id, dates))
+    return ZoneHistorySerializer({'request_data': results}).data
+
+
+# # BTJourney
+
+class BTJourneyLocations:
+    '''
+    In-memory registry of the link, route or site configs in
+    btjourney/locations/data_<which>/, keyed by id.
+
+    The directory is re-scanned and every <id>.json re-read only when the
+    directory's mtime or inode changes, i.e. when configs are added,
+    removed or replaced by rename.
+    '''
+
+    def __init__(self, which):
+        self.path = 'btjourney/locations/data_{0}/'.format(which)
+        self.signature = None
+        self.configs = {}
+        self.lock = threading.Lock()
+
+    def get(self):
+        '''
+        Return a dictionary of id -> config, which must not be modified
+        '''
+        path = util.safe_build(self.path)
+        try:
+            st = os.stat(path)
+            signature = (st.st_mtime_ns, st.st_ino)
+        except FileNotFoundError:
+            signature = None
+        with self.lock:
+            if signature != self.signature:
+                self.configs = self.load(path) if signature else {}
+                self.signature = signature
+            return self.configs
+
+    @staticmethod
+    def load(path):
+        configs = {}
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.endswith('.json'):
+                        configs[entry.name[:-5]] = util.load_json(entry.path)
+        except FileNotFoundError:
+            pass
+        return configs
+
+
+bt_locations = {which: BTJourneyLocations(which)
+                for which in ('link', 'route', 'site')}
+
+
+def bt_list_configs(which):
+    '''
+    Return a definitive list of the links, routes or sites for which location data exists
+    '''
+    return list(bt_locations[which].get())
+
+
+def bt_config_exists(which, id):
+    '''
+    Return True if location data exists for link, route or site id
+    '''
+    return id in bt_locations[which].get()
+
+
+def bt_get_config(which, id=None):
+    '''
+    Return link, route or site configs, either for id if provided, or for
+    everything
+    '''
+    configs = bt_locations[which].get()
+
+    if id is None:
+        return list(configs.values())
+
+    else:
+        if id in configs:
+            return configs[id]
+        else:
+            raise NotFound("{0} id '{1}' not found".format(which, id))
+
+
+bt_monitor_cache = util.FileCache(
+    partial(util.MonitorSnapshot, id_field_name='id'))
+
+
+def bt_read_latest():
+    '''
+    Read the current data monitor file, returning a MonitorSnapshot
+    (or None if there isn't one)
+    '''
+    filename = 'btjourney/journeytimes/data_monitor_json/post_data.json'
+    try:
+        return bt_monitor_cache.get(filename)
+    except FileNotFoundError:
+        return None
+
+
+def bt_fix_period(results):
+    '''
+    For reasons unknown, the period field in journey data is occasionally
+    an empty object rather than an integer. In particular this has been
+    observed for very recently created links
+    (see e.g. CAMBRIDGE_JTMS|9800YRAA8RIZ on 2020-02-16)
+    '''
+    for result in results:
+        if isinstance(result['period'], Mapping):
+            result['period'] = None
+        yield result
+
+
+def get_btjourney_history(id, dates):
+    '''
+    Return an iterator over the historic journey time records for a link
+    or route for each date in dates
+    '''
+    if not bt_config_exists('link', id) and not bt_config_exists('route', id):
+        raise NotFound("Link with id '{0}' not found".format(id))
+
+    filenames = [
+        'btjourney/journeytimes/data_link/{1:%Y}/{1:%m}/{1:%d}/{0}_{1:%Y-%m-%d}.txt'
+        .format(id, date)
+        for date in dates
+    ]
+    return bt_fix_period(util.iter_json_fragments(filenames))
+
+
+def btjourney_link_list():
+    data = bt_get_config('link')
+    return BTJourneyLinkListSerializer({'link_list': data}).data
+
+
+def btjourney_route_list():
+    data = bt_get_config('route')
+    return BTJourneyRouteListSerializer({'route_list': data}).data
+
+
+def btjourney_link_or_route(id):
+    try:
+        data = bt_get_config('link', id)
+    except NotFound:
+        try:
+            data = bt_get_config('route', id)
+        except NotFound:
+            raise NotFound("Link or route id '{0}' not found".format(id))
+    return BTJourneyLinkOrRouteSerializer(data).data
+
+
+def btjourney_site_list():
+    data = bt_get_config('site')
+    return BTJourneySiteListSerializer({'site_list': data}).data
+
+
+def btjourney_site(site_id):
+    return BTJourneySiteSerializer(bt_get_config('site', site_id)).data
+
+
+def btjourney_history(id, dates):
+    results = list(get_btjourney_history(id, dates))
+    return BTJourneyLinkRecordListSerializer({'request_data': results}).data
+
+
+def btjourney_latest_list(ids=None):
+    snapshot = bt_read_latest()
+    if snapshot is None:
+        data = {'request_data': []}
+    elif ids is None:
+        data = snapshot.data
+    else:
+        data = dict(snapshot.data, request_data=[
+            snapshot.records[id] for id in ids if id in snapshot.records])
+    return BTJourneyLinkRecordListSerializer(data).data
+
+
+def btjourney_latest(id):
+    snapshot = bt_read_latest()
+    value = snapshot.records.get(id) if snapshot else None
+    if value is None:
+        raise NotFound("No data found for link '{0}'".format(id))
+
+    value = dict(value, ts=snapshot.data['ts'])
+    return BTJourneyLinkRecordSerializer(value).data
@@ -1,21 +1,13 @@
-from collections.abc import Mapping
-from datetime import timedelta
 import logging
-import os
 
 from rest_framework.response import Response
-from rest_framework.exceptions import NotFound
 from rest_framework.schemas import AutoSchema
 
 import coreapi
 import coreschema
 
-from .serializers import (
-    ZoneListSerializer, ZoneConfigSerializer, ZoneHistorySerializer,
-    BTJourneySiteSerializer, BTJourneySiteListSerializer,
-    BTJourneyLinkOrRouteSerializer,
-    BTJourneyLinkListSerializer, BTJourneyRouteListSerializer,
-    BTJourneyLinkRecordSerializer, BTJourneyLinkRecordListSerializer)
+from .serializers import ZoneRecordSerializer, BTJourneyLinkRecordSerializer
+from . import services
 from api import util, auth
 
 
@@ -45,6 +37,22 @@ link_or_route_id_fields = [
     ),
 ]
 
+ids_fields = [
+    coreapi.Field(
+        "ids",
+        required=False,
+        location="query",
+        schema=coreschema.String(
+            description="Comma-separated list of link or route identifiers "
+                        "(e.g. 'CAMBRIDGE_JTMS|9800W1CHALH6,CAMBRIDGE_JTMS|9800WMBVAGBF'). "
+                        "Defaults to all links and routes"),
+        description="Comma-separated list of link or route identifiers "
+                    "(e.g. 'CAMBRIDGE_JTMS|9800W1CHALH6,CAMBRIDGE_JTMS|9800WMBVAGBF'). "
+                    "Defaults to all links and routes",
+        example="CAMBRIDGE_JTMS|9800W1CHALH6,CAMBRIDGE_JTMS|9800WMBVAGBF",
+    ),
+]
+
 site_id_fields = [
     coreapi.Field(
         "site_id",
@@ -86,36 +94,13 @@ list_args_fields = [
 
 # # Zones
 
-def get_zone_config(zone_id=None):
-    if zone_id is None:
-        return util.get_config('zone')
-    else:
-        try:
-            return util.get_config('zone', zone_id,
-                                   'zone_list', 'zone.id')
-        except (util.TFCValidationError) as e:
-            raise NotFound("Zone not found: {0}".format(e))
-
-
-def swap_dot_and_underscore(data):
-    ''' serializer can't cope with '.' in keys - switch to '_' '''
-    return {key.replace('.', '_'): value for (key, value) in data.items()}
-
-
 class ZoneList(auth.AuthenticateddAPIView):
     '''
     List metadata for all known zones, including each zone's
     _zone_id_.
     '''
     def get(self, request):
-        data = get_zone_config()
-        # serializer can't cope with '.' in keys - switch to '_'
-        fixed_zones = []
-        for zone in data['zone_list']:
-            fixed_zone = swap_dot_and_underscore(zone)
-            fixed_zones.append(fixed_zone)
-        serializer = ZoneListSerializer({"zone_list": fixed_zones})
-        return Response(serializer.data)
+        return Response(services.zone_list())
 
 
 class ZoneConfig(auth.AuthenticateddAPIView):
@@ -125,9 +110,7 @@ class ZoneConfig(auth.AuthenticateddAPIView):
     schema = AutoSchema(manual_fields=zone_id_fields)
 
     def get(self, request, zone_id):
-        data = get_zone_config(zone_id)
-        serializer = ZoneConfigSerializer(swap_dot_and_underscore(data))
-        return Response(serializer.data)
+        return Response(services.zone_config(zone_id))
 
 
 class ZoneHistory(auth.AuthenticateddAPIView):
@@ -140,88 +123,17 @@ class ZoneHistory(auth.AuthenticateddAPIView):
 
     def get(self, request, zone_id):
 
-        args = util.ListArgsSerializer(data=request.query_params)
-        args.is_valid(raise_exception=True)
-
-        # Note that this validates zone_id!
-        get_zone_config(zone_id)
-
-        start_date = args.validated_data.get('start_date')
-        end_date = args.validated_data.get('end_date')
-        if end_date is None:
-            end_date = start_date
-        day_count = (end_date - start_date).days + 1
-
-        results = []
-        for date in (start_date + timedelta(n) for n in range(day_count)):
-            try:
-                filename = (
-                    'cloudamber/sirivm/data_zone/'
-                    '{1:%Y}/{1:%m}/{1:%d}/{0}_{1:%Y-%m-%d}.txt'
-                    .format(zone_id, date)
-                    )
-                results = results + util.read_json_fragments(filename)
-            except (FileNotFoundError):
-                pass
-        serializer = ZoneHistorySerializer({'request_data': results})
-        return Response(serializer.data)
+        dates = util.get_list_args(request.query_params)
 
+        if util.wants_streaming(request):
+            results = services.get_zone_history(zone_id, dates)
+            return util.stream_json_list(
+                'request_data', results, ZoneRecordSerializer())
 
-# # BTJourney
-
-def bt_list_configs(which):
-    '''
-    Return a definitive list of the links, routes or sites for which location data exists
-    '''
-    results = []
-    path = util.safe_build('btjourney/locations/data_{0}/'.format(which))
-    try:
-        for file in os.listdir(path):
-            if os.path.isfile(os.path.join(path, file)) and file.endswith('.json'):
-                results.append(file[:-5])
-    except FileNotFoundError:
-        pass
-    return results
-
-
-def bt_read_config(which, id):
-    '''
-    Return the link, route or site config for id
-    '''
-    filename = 'btjourney/locations/data_{0}/{1}.json'.format(which, id)
-    return util.read_json(filename)
+        return Response(services.zone_history(zone_id, dates))
 
 
-def bt_get_config(which, id=None):
-    '''
-    Return link, route or site configs, either for id if provided, or for
-    everything
-    '''
-    configs = bt_list_configs(which)
-
-    if id is None:
-        results = []
-        for config in configs:
-            results.append(bt_read_config(which, config))
-        return results
-
-    else:
-        if id in configs:
-            return bt_read_config(which, id)
-        else:
-            raise NotFound("{0} id '{1}' not found".format(which, id))
-
-
-def bt_read_latest():
-    '''
-    Read the current data monitor file
-    '''
-    filename = 'btjourney/journeytimes/data_monitor_json/post_data.json'
-    try:
-        return util.read_json(filename)
-    except FileNotFoundError:
-        return {'request_data': []}
-
+# # BTJourney
 
 class BTJourneyLinkList(auth.AuthenticateddAPIView):
     '''
@@ -231,9 +143,7 @@ class BTJourneyLinkList(auth.AuthenticateddAPIView):
     journey time data will not be available for all of these links all of the time.
     '''
     def get(self, request):
-        data = bt_get_config('link')
-        serializer = BTJourneyLinkListSerializer({'link_list': data})
-        return Response(serializer.data)
+        return Response(services.btjourney_link_list())
 
 
 class BTJourneyRouteList(auth.AuthenticateddAPIView):
@@ -244,9 +154,7 @@ class BTJourneyRouteList(auth.AuthenticateddAPIView):
     journey time data will not be available for all of these routes all of the time.
     '''
     def get(self, request):
-        data = bt_get_config('route')
-        serializer = BTJourneyRouteListSerializer({'route_list': data})
-        return Response(serializer.data)
+        return Response(services.btjourney_route_list())
 
 
 class BTJourneyLinkOrRouteConfig(auth.AuthenticateddAPIView):
@@ -261,15 +169,7 @@ class BTJourneyLinkOrRouteConfig(auth.AuthenticateddAPIView):
     schema = AutoSchema(manual_fields=link_or_route_id_fields)
 
     def get(self, request, id):
-        try:
-            data = bt_get_config('link', id)
-        except NotFound:
-            try:
-                data = bt_get_config('route', id)
-            except NotFound:
-                raise NotFound("Link or route id '{0}' not found".format(id))
-        serializer = BTJourneyLinkOrRouteSerializer(data)
-        return Response(serializer.data)
+        return Response(services.btjourney_link_or_route(id))
 
 
 class BTJourneySiteList(auth.AuthenticateddAPIView):
@@ -277,9 +177,7 @@ class BTJourneySiteList(auth.AuthenticateddAPIView):
     List metadata for all known sensor 'sites'.
     '''
     def get(self, request):
-        data = bt_get_config('site')
-        serializer = BTJourneySiteListSerializer({'site_list': data})
-        return Response(serializer.data)
+        return Response(services.btjourney_site_list())
 
 
 class BTJourneySiteConfig(auth.AuthenticateddAPIView):
@@ -289,9 +187,7 @@ class BTJourneySiteConfig(auth.AuthenticateddAPIView):
     schema = AutoSchema(manual_fields=site_id_fields)
 
     def get(self, request, site_id):
-        data = bt_get_config('site', site_id)
-        serializer = BTJourneySiteSerializer(data)
-        return Response(serializer.data)
+        return Response(services.btjourney_site(site_id))
 
 
 class BTJourneyLinkHistory(auth.AuthenticateddAPIView):
@@ -309,57 +205,34 @@ class BTJourneyLinkHistory(auth.AuthenticateddAPIView):
 
     def get(self, request, id):
 
-        args = util.ListArgsSerializer(data=request.query_params)
-        args.is_valid(raise_exception=True)
-
-        if id not in bt_list_configs('link') and id not in bt_list_configs('route'):
-            raise NotFound("Link with id '{0}' not found".format(id))
-
-        start_date = args.validated_data.get('start_date')
-        end_date = args.validated_data.get('end_date')
-        if end_date is None:
-            end_date = start_date
-        day_count = (end_date - start_date).days + 1
-
-        results = []
-        for date in (start_date + timedelta(n) for n in range(day_count)):
-            try:
-                filename = (
-                    'btjourney/journeytimes/data_link/{1:%Y}/{1:%m}/{1:%d}/{0}_{1:%Y-%m-%d}.txt'
-                    .format(id, date)
-                    )
-                results = results + util.read_json_fragments(filename)
-            except FileNotFoundError:
-                pass
-
-        # For reasons unknown, the period field in journey data is occasionally
-        # an empty object rather than an integer. In particular this has been
-        # observed for very recently created links
-        # (see e.g. CAMBRIDGE_JTMS|9800YRAA8RIZ on 2020-02-16)
-        for result in results:
-            if isinstance(result['period'], Mapping):
-                result['period'] = None
-
-        serializer = BTJourneyLinkRecordListSerializer({'request_data': results})
-        return Response(serializer.data)
+        dates = util.get_list_args(request.query_params)
+
+        if util.wants_streaming(request):
+            results = services.get_btjourney_history(id, dates)
+            return util.stream_json_list(
+                'request_data', results, BTJourneyLinkRecordSerializer())
+
+        return Response(services.btjourney_history(id, dates))
 
 
 class BTJourneyLinkLatestList(auth.AuthenticateddAPIView):
     '''
     Return most recent journey times for all currently monitored 'links'
     (journey segments between pairs
-    of sensors) and 'routes' (journey segments built from multiple links)
+    of sensors) and 'routes' (journey segments built from multiple links),
+    or just for those identified by a comma-separated list of _id_s in
+    _ids_. Links or routes for which no recent data is available are
+    omitted.
 
     Links and routes are occasionally added. This endpoint might return
     journey time data for links or routes for which metadata is not yet
     available.
     '''
+    schema = AutoSchema(manual_fields=ids_fields)
 
     def get(self, request):
-
-        data = bt_read_latest()
-        serializer = BTJourneyLinkRecordListSerializer(data)
-        return Response(serializer.data)
+        return Response(
+            services.btjourney_latest_list(util.get_ids_arg(request)))
 
 
 class BTJourneyLinkLatest(auth.AuthenticateddAPIView):
@@ -375,12 +248,4 @@ class BTJourneyLinkLatest(auth.AuthenticateddAPIView):
     schema = AutoSchema(manual_fields=link_or_route_id_fields)
 
     def get(self, request, id):
-
-        data = bt_read_latest()
-
-        for value in data['request_data']:
-            if value['id'] == id:
-                value['ts'] = data['ts']
-                serializer = BTJourneyLinkRecordSerializer(value)
-                return Response(serializer.data)
-        raise NotFound("No data found for link '{0}'".format(id))
+        return Response(services.btjourney_latest(id))
@@ -9,10 +9,11 @@ from django.shortcuts import render
 from django.urls import reverse
 from django.http import Http404, JsonResponse
 from django.views.decorators.clickjacking import xframe_options_exempt
-from urllib.error import HTTPError
+from rest_framework.exceptions import APIException, NotFound, ValidationError
 import logging
 
-from api.util import do_api_call
+from api.util import get_list_args
+from traffic.api import services
 from traffic.models import ANPRCamera, TripChain
 
 
@@ -51,21 +52,20 @@ def anpr_map(request, return_format='html'):
 
 def get_zone_list():
 
-    data = do_api_call('/api/v1/traffic/zone/')
+    data = services.zone_list()
     return {'request_data': data}
 
 
 def get_zone_metadata(zone_id):
 
-    data = do_api_call('/api/v1/traffic/zone/' + zone_id)
+    data = services.zone_config(zone_id)
     return {'request_data': {'options': {'config': data}}}
 
 
 def get_zone_history(zone_id, date):
 
-        return do_api_call(
-            '/api/v1/traffic/zone/history/' + zone_id +
-            '?start_date=' + date)
+        return services.zone_history(
+            zone_id, get_list_args({'start_date': date}))
 
 
 #############################################################################
@@ -94,8 +94,8 @@ def zone_transit_plot(request, zone_id):
     try:
         transit_json = get_zone_history(zone_id, user_date)
         zone_config = get_zone_metadata(zone_id)
-    except HTTPError as e:
-        raise Http404("Page not found {0}".format(e.code))
+    except APIException as e:
+        raise Http404("Page not found {0}".format(e.status_code))
     except Exception as e:
         raise Http404("Page not found e {0}".format(e.__class__.__name__))
 
@@ -172,24 +172,23 @@ def zone_map(request, zone_id):
 
 def get_link_list():
 
-    return do_api_call('/api/v1/traffic/btjourney/link/')
+    return services.btjourney_link_list()
 
 
 def get_route_list():
 
-    return do_api_call('/api/v1/traffic/btjourney/route/')
+    return services.btjourney_route_list()
 
 
 def get_btjourney_link_or_route(link_id):
 
-    return do_api_call('/api/v1/traffic/btjourney/link_or_route/' + link_id)
+    return services.btjourney_link_or_route(link_id)
 
 
 def get_btjourney_history(link_id, date):
 
-        return do_api_call(
-            '/api/v1/traffic/btjourney/history/' + link_id +
-            '?start_date=' + date)
+        return services.btjourney_history(
+            link_id, get_list_args({'start_date': date}))
 
 
 def add_sortable_names(link_list):
@@ -222,11 +221,8 @@ def btjourney_plot(request, link_id):
     try:
         journey_json = get_btjourney_history(link_id, user_date)
         link_config = get_btjourney_link_or_route(link_id)
-    except HTTPError as e:
-        if e.code == 404:
-            raise Http404("btjourney plot invalid link id {0}".format(link_id))
-        else:
-            raise e
+    except (NotFound, ValidationError):
+        raise Http404("btjourney plot invalid link id {0}".format(link_id))
 
     return render(request, 'traffic/btjourney_plot.html', {
         'config_date':  user_date,
@@ -46,7 +46,7 @@ class JourneyPatternSerializer(serializers.ModelSerializer):
 class JourneyPatternTimingLinkSerializer(serializers.ModelSerializer):    
     class Meta:
         model = JourneyPatternTimingLink
-        fields = ['from_display', 'from_stop_id', 'from_timing_status', 'from_sequence_number', 'to_display', 'to_stop_id', 'to_timing_status', 'to_sequence_number', 'run_time', 'direction']
+        fields = ['from_display', 'from_stop_id', 'from_timing_status', 'from_sequence_number', 'to_display', 'to_stop_id', 'to_timing_status', 'to_sequence_number', 'run_time', 'from_offset', 'to_offset', 'direction']
 
 
 class LineSerializer(serializers.ModelSerializer):
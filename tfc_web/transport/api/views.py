@@ -187,20 +187,7 @@ def journeys_by_time_and_stop(request):
     if nresults < 1:
         return Response({"details": "nresults is should be at least 1"}, status=400)
 
-    departures = stop.next_departures(datetime_from)
-    departures = departures[:nresults]
-
-    # Convert all stop_id to full stop objects
-    stop_ids_list = []
-    for departure in departures:
-        for timetable_entry in departure['timetable']:
-            stop_ids_list.append(timetable_entry['stop_id'])
-    # This means that we only rely on 1 single SQL query to get all the stops, making it faster
-    stop_objects = list(Stop.objects.filter(atco_code__in=stop_ids_list))
-    for departure in departures:
-        for timetable_entry in departure['timetable']:
-            timetable_entry['stop'] = StopSerializer(
-                next((stop for stop in stop_objects if stop.atco_code == timetable_entry['stop_id']), None)).data
+    departures = stop.next_departures(datetime_from, nresults)
 
     if len(departures) < nresults:
         # no more results for the current day selected
@@ -220,18 +207,28 @@ def journeys_by_time_and_stop(request):
             next_datetime = departures[-1]['time']
             departures = departures[:-1]
 
+    # Convert all stop_id to full stop objects with a single SQL query, serializing each stop only once
+    stop_ids = {timetable_entry['stop_id'] for departure in departures for timetable_entry in departure['timetable']}
+    stops = {stop.atco_code: stop for stop in Stop.objects.filter(atco_code__in=stop_ids)}
+    stops = {stop_id: StopSerializer(stops.get(stop_id)).data for stop_id in stop_ids}
+
+    # journey_pattern, service, line and operator are already loaded by next_departures (select_related)
+    journey_patterns = {}
+    expand_journey = request.GET.get('expand_journey', 'false').lower() == 'true'
     results_json = {'results': []}
     for result in departures:
-        journey = VehicleJourneySummarisedSerializer(result['vehicle_journey']).data
+        vehicle_journey = result['vehicle_journey']
+        if vehicle_journey.journey_pattern_id not in journey_patterns:
+            journey_patterns[vehicle_journey.journey_pattern_id] = \
+                JourneyPatternSerializer(vehicle_journey.journey_pattern).data
+        for timetable_entry in result['timetable']:
+            timetable_entry['stop'] = stops[timetable_entry['stop_id']]
+        journey = VehicleJourneySummarisedSerializer(vehicle_journey).data
         journey['timetable'] = result['timetable']
         results_json['results'].append({
             'time': result['time'],
-            'journey': journey
-                if request.GET.get('expand_journey', 'false').lower() == 'true' else result['vehicle_journey'].id,
-            #'line': LineSerializer(result.vehicle_journey.journey_pattern.route.line).data})
-            #'service': ServiceSerializer(result['vehicle_journey'].service).data})
-            'journey_pattern': JourneyPatternSerializer(result['vehicle_journey'].journey_pattern).data})
-
+            'journey': journey if expand_journey else vehicle_journey.id,
+            'journey_pattern': journey_patterns[vehicle_journey.journey_pattern_id]})
 
     results_json['next'] = "%s?stop_id=%s&datetime_from=%s&nresults=%s&expand_journey=%s" % \
                            (reverse(journeys_by_time_and_stop), stop_id, quote(next_datetime.isoformat()), nresults,
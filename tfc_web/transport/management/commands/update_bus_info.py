@@ -1,18 +1,26 @@
 import os
+import hashlib
 import logging
 import re
 import zipfile
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from time import perf_counter
 import xml.etree.ElementTree as ET
 from datetime import datetime, timedelta
-from django.db import transaction
-from django.utils.timezone import is_naive, make_aware
+from django.contrib.gis.geos import LineString
+from django.db import connections, transaction
+from django.utils.timezone import is_naive, make_aware, now
 from django.core.management import BaseCommand
 from urllib.request import urlretrieve
+from isodate import parse_duration
 from django.conf import settings
 from django.db import transaction
-from transport.models import TransXChange, Operator, Service, JourneyPattern, Stop, VehicleJourney, JourneyPatternTimingLink, Line
+from transport.models import update_gis_fields, TransXChange, Operator, Service, JourneyPattern, Stop, VehicleJourney, JourneyPatternTimingLink, Line, \
+    StopTime, CanonicalJourneyPattern, CanonicalJourneyPatternGeometry, SIMPLIFIED_ZOOM_LEVELS, simplify_tolerance
 from transport.api.views import DAYS
-from transport.utils.transxchange import BANK_HOLIDAYS, WEEKDAYS, DayOfWeek
+from transport.utils.transxchange import WEEKDAYS, DayOfWeek, DUMMY_DATE, Timetable, dump_compiled_timetable
 
 
 logger = logging.getLogger(__name__)
@@ -58,49 +66,123 @@ def cmd_status():
     print("Line objects: {}".format(Line.objects.all().count()))
     print("VehicleJourney objects: {}".format(VehicleJourney.objects.all().count()))
     print("TransXChange objects: {}".format(TransXChange.objects.all().count()))
+    print("StopTime objects: {}".format(StopTime.objects.all().count()))
     print("Latest update: {}".format(TransXChange.objects.latest('modification_date_time').modification_date_time))
 
 ###############################################################
 # Load TNDS XML data file into PostgreSQL from filesystem
 ###############################################################
-def load_xml_file(tnds_zone, filename):
+def load_xml_file(tnds_zone, filename, reload=False):
     #print('load_xml_file loading {} {}'.format(tnds_zone, filename))
+    started = perf_counter()
     try:
-        with open(filename) as xml_file:
+        with open(filename, 'rb') as xml_file:
             with transaction.atomic():
-                load_xml(tnds_zone, filename, xml_file.read())
+                tx, stats = load_xml(tnds_zone, filename, xml_file, reload)
     except Exception as e:
+        stats = Counter(failed=1)
         logger.exception("Error while trying to process file %s, exception was %s" % (filename, e))
+    print_load_report(tnds_zone, stats, perf_counter() - started)
 
 
 ###############################################################
 # Load TNDS Zip file into PostgreSQL from filesystem
 ###############################################################
-def load_zip_file(tnds_zone, filename):
+def parse_zip_member(zip_filename, filename):
+    with zipfile.ZipFile(zip_filename) as traveline_zip_file:
+        with traveline_zip_file.open(filename) as xml_file:
+            return parse_xml(filename, xml_file)
+
+
+def parse_zip_members(zip_filename, filenames, workers):
+    # Yields (filename, function returning the parsed file) in the order of filenames. With more than one
+    # worker the files are parsed in a pool of processes, a few files ahead of the caller saving them.
+    if workers <= 1:
+        for filename in filenames:
+            yield filename, partial(parse_zip_member, zip_filename, filename)
+        return
+
+    # Forked workers must not share the database connection of this process
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for filename in filenames:
+            pending.append((filename, executor.submit(parse_zip_member, zip_filename, filename).result))
+            if len(pending) > 2 * workers:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+
+def load_zip_file(tnds_zone, filename, workers=1, reload=False, delete_missing=False):
     print('load_zip_file loading {} {}'.format(tnds_zone, filename))
+    started = perf_counter()
+    stats = Counter()
     try:
-        traveline_zip_file = zipfile.ZipFile(filename)
-        for filename in traveline_zip_file.namelist():
+        # The TransXChange of every file of the zip, to find the files of the zone which disappeared
+        loaded_tx_ids = set()
+        with zipfile.ZipFile(filename) as traveline_zip_file:
+            filenames = traveline_zip_file.namelist()
+            if not reload:
+                # Skip the files with the same content as when they were last loaded without parsing them
+                loaded_hashes = dict(TransXChange.objects.filter(tnds_zone=tnds_zone, content_hash__isnull=False)
+                                     .values_list('content_hash', 'id'))
+                changed_filenames = []
+                for member in filenames:
+                    with traveline_zip_file.open(member) as xml_file:
+                        tx_id = loaded_hashes.get(content_hash(xml_file))
+                    if tx_id is None:
+                        changed_filenames.append(member)
+                    else:
+                        loaded_tx_ids.add(tx_id)
+                        stats['unchanged'] += 1
+                filenames = changed_filenames
+        # Files are always saved one at a time and in the order of the zip, whatever the number of workers,
+        # so that repeated imports produce identical data
+        for filename, parsed in parse_zip_members(filename, filenames, workers):
             logger.info("Processing file %s" % filename)
             try:
-                with traveline_zip_file.open(filename) as xml_file:
-                    with transaction.atomic():
-                        load_xml(tnds_zone, filename, xml_file.read())
+                parsed = parsed()
+                with transaction.atomic():
+                    tx, file_stats = save_xml(tnds_zone, parsed, reload)
+                loaded_tx_ids.add(tx.id)
+                stats += file_stats
             except Exception as e:
+                stats['failed'] += 1
                 logger.exception("Error while trying to process file %s, exception was %s" % (filename, e))
+        if delete_missing:
+            if stats['failed']:
+                # A file which failed to load may still be the one behind any of the previous files of the zone
+                logger.warning("Not deleting the missing files of %s as %d files failed to load" %
+                               (tnds_zone, stats['failed']))
+            else:
+                stats['deleted'] += delete_missing_files(tnds_zone, loaded_tx_ids)
     except Exception as e:
         logger.exception("Error while trying to process file %s, exception was %s" % (filename, e))
+    print_load_report(tnds_zone, stats, perf_counter() - started)
+
+
+def delete_missing_files(tnds_zone, loaded_tx_ids):
+    # Deletes the files of a zone not in loaded_tx_ids, i.e. the files no longer in the zip and the previous
+    # revisions of the files which changed, with their services, journey patterns, vehicle journeys and stop
+    # times. Stops, operators and lines are shared between files and are kept.
+    missing = TransXChange.objects.filter(tnds_zone=tnds_zone).exclude(id__in=loaded_tx_ids)
+    for tx in missing:
+        logger.info("Deleting file %s revision %s" % (tx.file_name, tx.revision_number))
+    with transaction.atomic():
+        deleted, deleted_by_model = missing.delete()
+    return deleted_by_model.get(TransXChange._meta.label, 0)
 
 
 ###############################################################
 # Download TNDS XML zip files and parse into PostgreSQL
 ###############################################################
-def load_ftp():
+def load_ftp(workers=1, reload=False, delete_missing=False):
     for tnds_zone in settings.TNDS_ZONES:
         local_filename, headers = urlretrieve('ftp://%s:%s@ftp.tnds.basemap.co.uk/%s.zip' %
                                               (settings.TNDS_USERNAME, settings.TNDS_PASSWORD, tnds_zone),
                                               filename=os.path.join(settings.TNDS_NEW_DIR, '%s.zip' % tnds_zone))
-        load_zip_file(tnds_zone, local_filename)
+        load_zip_file(tnds_zone, local_filename, workers, reload, delete_missing)
 
     for tnds_zone in settings.TNDS_ZONES:
         os.rename(os.path.join(settings.TNDS_NEW_DIR, '%s.zip' % tnds_zone),
@@ -108,16 +190,66 @@ def load_ftp():
 
 
 ###############################################################
-# Create XML -> Stops object in PostgreSQL and return it
+# Insert or update a list of model objects in bulk
+###############################################################
+def bulk_upsert(objs, queryset, key_fields, batch_size=1000):
+    # Equivalent to one update_or_create per object, matching rows of queryset on key_fields, with a fixed number
+    # of queries. Objects sharing a key are deduplicated (the last one wins, as with update_or_create) and
+    # the objects returned have their primary key set.
+    def key(obj):
+        return tuple(getattr(obj, field) for field in key_fields)
+
+    objs = list({key(obj): obj for obj in objs}.values())
+    existing = {tuple(values[:-1]): values[-1] for values in queryset.values_list(*key_fields, 'pk')}
+    to_create = []
+    to_update = []
+    for obj in objs:
+        pk = existing.get(key(obj))
+        if pk is None:
+            to_create.append(obj)
+        else:
+            obj.pk = pk
+            to_update.append(obj)
+
+    model = queryset.model
+    update_fields = [field.name for field in model._meta.concrete_fields
+                     if not field.primary_key and field.attname not in key_fields]
+    model.objects.bulk_create(to_create, batch_size=batch_size)
+    if to_update and update_fields:
+        model.objects.bulk_update(to_update, update_fields, batch_size=batch_size)
+    return objs
+
+
+###############################################################
+# Map the id of XML elements to the elements
+###############################################################
+def index_by_id(root, ns, path):
+    # Built once per file so that references (RouteRef, RouteLinkRef...) are resolved with a dict lookup
+    # rather than a scan of the whole tree for each reference. Like root.find(), the first element wins.
+    index = {}
+    for element in root.iterfind(path, ns):
+        index.setdefault(element.attrib.get('id'), element)
+    return index
+
+
+def index_route_links(root, ns):
+    # Only the Distance and Direction of the RouteLinks are loaded, keeping them rather than the elements
+    # lets parse_xml() free their Track geometry as soon as the RouteSections are read
+    return {
+        route_link_id: (route_link_node.findtext('ns:Distance', namespaces=ns),
+                        route_link_node.findtext('ns:Direction', namespaces=ns))
+        for route_link_id, route_link_node in index_by_id(root, ns, './/ns:RouteLink').items()
+    }
+
+
+###############################################################
+# Create XML -> Stops objects
 ###############################################################
-def load_stops(root, ns, tx):
+def parse_stops(root, ns):
     # We collect the list of all stop id in the XML file
-    stop_ids = []
-    stops = []
+    stops = {}
     for stop_node in root.findall('.//ns:AnnotatedStopPointRef', ns):
         atco_code = stop_node.find('ns:StopPointRef', ns).text
-        stop_ids.append(atco_code)
-
         stop = Stop(
             atco_code = atco_code,
             common_name = stop_node.findtext('ns:CommonName', namespaces=ns),
@@ -125,53 +257,65 @@ def load_stops(root, ns, tx):
             longitude = stop_node.findtext('ns:Location/ns:Longitude', namespaces=ns),
             latitude = stop_node.findtext('ns:Location/ns:Latitude', namespaces=ns)
         )
-        stops.append(stop)
+        stops[atco_code] = stop
+    return list(stops.values())
 
-    existing_stops = Stop.objects.filter(atco_code__in=stop_ids).values_list('atco_code', flat=True)
-    stop_ids_that_need_importing = set(stop_ids).difference(set(existing_stops))
-    
-    for stop in stops:
-        if stop.atco_code in stop_ids_that_need_importing:
-            try:
-                stop.save()
-            except Exception as e:
-                print('Stop save error in {} for {} lat={}, lng={}'.format(tx.file_name, stop.atco_code,stop.latitude, stop.longitude))
-                raise e
+
+###############################################################
+# Save the Stops not in PostgreSQL yet
+###############################################################
+def save_stops(stops, file_name):
+    stops = {stop.atco_code: stop for stop in stops}
+    existing_stops = set(Stop.objects.filter(atco_code__in=stops).values_list('atco_code', flat=True))
+    stops_that_need_importing = [stop for atco_code, stop in stops.items() if atco_code not in existing_stops]
+
+    for stop in stops_that_need_importing:
+        # bulk_create does not send the pre_save signal that sets gis_location
+        try:
+            update_gis_fields(Stop, stop)
+        except Exception as e:
+            print('Stop save error in {} for {} lat={}, lng={}'.format(file_name, stop.atco_code,stop.latitude, stop.longitude))
+            raise e
+    Stop.objects.bulk_create(stops_that_need_importing)
+    return len(stops_that_need_importing)
 
 
 ###############################################################
-# Create XML -> Operator object in PostgreSQL and return it
+# Create XML -> Operator objects
 ###############################################################
-def load_operators(root, ns):
+def parse_operators(root, ns):
+    operators = []
     for operator_node in root.findall('.//ns:Operator', ns):
-        operator, created = Operator.objects.update_or_create(
+        operators.append(Operator(
             operator_id=operator_node.attrib.get('id'),
-            defaults={
-                'operator_code': operator_node.findtext('ns:OperatorCode', namespaces=ns),
-                'operator_short_name': operator_node.findtext('ns:OperatorShortName', namespaces=ns),
-                'operator_name': operator_node.findtext('ns:OperatorNameOnLicence', namespaces=ns),
-                'trading_name': operator_node.findtext('ns:TradingName', namespaces=ns),
-                'contact_phone': operator_node.findtext('ns:ContactDetails/ns:PhoneNumber', namespaces=ns),
-                'contact_email': operator_node.findtext('ns:ContactDetails/ns:Email', namespaces=ns),
-                'contact_url': operator_node.findtext('ns:ContactDetails/ns:Url', namespaces=ns),
-                'national_operator_code': operator_node.findtext('ns:NationalOperatorCode', namespaces=ns),
-                'license_number': operator_node.findtext('ns:LicenceNumber', namespaces=ns),
-                'license_expiry_date': datetime.strptime(operator_node.findtext('ns:OperatorLicence/ns:EffectiveToDate', namespaces=ns), '%Y-%m-%d') if operator_node.findtext('ns:OperatorLicence/ns:EffectiveToDate', namespaces=ns) is not None else None,
-                'street': operator_node.findtext('ns:OperatorAddress/ns:AddressLine1', namespaces=ns),
-                'locality': operator_node.findtext('ns:OperatorAddress/ns:AddressLine2', namespaces=ns),
-                'town': operator_node.findtext('ns:OperatorAddress/ns:Town', namespaces=ns),
-                'postcode': operator_node.findtext('ns:OperatorAddress/ns:PostCode', namespaces=ns)
-            }
-        )
-    return operator
+            operator_code=operator_node.findtext('ns:OperatorCode', namespaces=ns),
+            operator_short_name=operator_node.findtext('ns:OperatorShortName', namespaces=ns),
+            operator_name=operator_node.findtext('ns:OperatorNameOnLicence', namespaces=ns),
+            trading_name=operator_node.findtext('ns:TradingName', namespaces=ns),
+            contact_phone=operator_node.findtext('ns:ContactDetails/ns:PhoneNumber', namespaces=ns),
+            contact_email=operator_node.findtext('ns:ContactDetails/ns:Email', namespaces=ns),
+            contact_url=operator_node.findtext('ns:ContactDetails/ns:Url', namespaces=ns),
+            national_operator_code=operator_node.findtext('ns:NationalOperatorCode', namespaces=ns),
+            license_number=operator_node.findtext('ns:LicenceNumber', namespaces=ns),
+            license_expiry_date=datetime.strptime(operator_node.findtext('ns:OperatorLicence/ns:EffectiveToDate', namespaces=ns), '%Y-%m-%d') if operator_node.findtext('ns:OperatorLicence/ns:EffectiveToDate', namespaces=ns) is not None else None,
+            street=operator_node.findtext('ns:OperatorAddress/ns:AddressLine1', namespaces=ns),
+            locality=operator_node.findtext('ns:OperatorAddress/ns:AddressLine2', namespaces=ns),
+            town=operator_node.findtext('ns:OperatorAddress/ns:Town', namespaces=ns),
+            postcode=operator_node.findtext('ns:OperatorAddress/ns:PostCode', namespaces=ns)
+        ))
+    return operators
 
 
 #################################################################
-# Create XML -> Service and JourneyPattern objects in PostgreSQL
+# Create XML -> Service and JourneyPattern objects
 #################################################################
-def load_services_and_journeys(root, ns, tx):
-
-    #print('load_services_and_journeys() tx={}'.format(tx));
+def parse_services_and_journeys(root, ns, route_nodes, route_links, journey_pattern_section_nodes):
+    # route_nodes and journey_pattern_section_nodes are the Route and JourneyPatternSection elements by id,
+    # route_links the (Distance, Direction) of the RouteLinks by id, see parse_xml()
+    lines = []
+    services = []
+    journey_patterns = []
+    jptls = [] # (JourneyPattern, JourneyPatternTimingLink) as the JourneyPattern has no primary key yet
 
     # Create Service objects
     for service_node in root.findall('.//ns:Service', ns):
@@ -181,33 +325,27 @@ def load_services_and_journeys(root, ns, tx):
 
         for line_node in service_node.findall('.//ns:Line', ns):
             line_id = service_code + line_node.attrib['id']
-            #print('load_services_and_journeys(): line_id={}'.format(line_id))
-            line, created = Line.objects.update_or_create(
+            line = Line(
                 line_id=line_id,
-                defaults={
-                    'line_name': line_node.findtext('ns:LineName', namespaces=ns),
-                    'description': line_node.findtext('ns:Description', namespaces=ns),
-                    'transport_mode': line_node.findtext('ns:TransportMode', namespaces=ns),
-                    'private_code': line_node.findtext('ns:PrivateCode', namespaces=ns),
-                }
+                line_name=line_node.findtext('ns:LineName', namespaces=ns),
+                description=line_node.findtext('ns:Description', namespaces=ns),
+                transport_mode=line_node.findtext('ns:TransportMode', namespaces=ns),
+                private_code=line_node.findtext('ns:PrivateCode', namespaces=ns),
             )
+            lines.append(line)
 
-        #print('load_services_and_journeys(): update_or_create(service_code={})'.format(service_code))
-        service, created = Service.objects.update_or_create(
-            #tx = tx,
+        service = Service(
             service_code = service_code,
-            defaults=dict(
-                tx = tx,
-                operating_period_start = datetime.fromisoformat(service_node.find('ns:OperatingPeriod/ns:StartDate', ns).text) if service_node.find('ns:OperatingPeriod/ns:StartDate', ns) is not None else None,
-                operating_period_end = datetime.fromisoformat(service_node.find('ns:OperatingPeriod/ns:EndDate', ns).text) if service_node.find('ns:OperatingPeriod/ns:EndDate', ns) is not None else None,
-                registered_travel_mode = service_node.findtext('ns:RegisteredTravelMode', namespaces=ns),
-                description = service_node.findtext('ns:Description', namespaces=ns),
-                standard_origin = service_node.findtext('ns:StandardService/ns:Origin', namespaces=ns),
-                standard_destination = service_node.findtext('ns:StandardService/ns:Destination', namespaces=ns),
-                operator_id = service_node.findtext('ns:RegisteredOperatorRef', namespaces=ns),
-                line = line
-            )
+            operating_period_start = datetime.fromisoformat(service_node.find('ns:OperatingPeriod/ns:StartDate', ns).text) if service_node.find('ns:OperatingPeriod/ns:StartDate', ns) is not None else None,
+            operating_period_end = datetime.fromisoformat(service_node.find('ns:OperatingPeriod/ns:EndDate', ns).text) if service_node.find('ns:OperatingPeriod/ns:EndDate', ns) is not None else None,
+            registered_travel_mode = service_node.findtext('ns:RegisteredTravelMode', namespaces=ns),
+            description = service_node.findtext('ns:Description', namespaces=ns),
+            standard_origin = service_node.findtext('ns:StandardService/ns:Origin', namespaces=ns),
+            standard_destination = service_node.findtext('ns:StandardService/ns:Destination', namespaces=ns),
+            operator_id = service_node.findtext('ns:RegisteredOperatorRef', namespaces=ns),
+            line = line
         )
+        services.append(service)
         
         # EXAMPLE 1
 
@@ -263,150 +401,326 @@ def load_services_and_journeys(root, ns, tx):
         # Create JourneyPattern objects
         for journey_pattern_node in service_node.findall('.//ns:JourneyPattern', ns):
             route_id = getattr(journey_pattern_node.find('ns:RouteRef', ns), 'text', None)
-            route_node = root.find(f'.//ns:Route[@id="{route_id}"]', ns)
+            route_node = route_nodes.get(route_id)
 
-            journey_pattern, created = JourneyPattern.objects.update_or_create(
+            journey_pattern = JourneyPattern(
                 jp_id = journey_pattern_node.attrib['id'],
                 service=service,
-                defaults={
-                    'destination_display': journey_pattern_node.findtext('ns:DestinationDisplay', namespaces=ns),  
-                    'direction': journey_pattern_node.findtext('ns:Direction', namespaces=ns),
-                    'route_private_code': route_node.findtext('ns:PrivateCode', namespaces=ns) if route_node is not None else None,
-                    'route_description': route_node.findtext('ns:Description', namespaces=ns) if route_node is not None else None
-                }
+                destination_display=journey_pattern_node.findtext('ns:DestinationDisplay', namespaces=ns),
+                direction=journey_pattern_node.findtext('ns:Direction', namespaces=ns),
+                route_private_code=route_node.findtext('ns:PrivateCode', namespaces=ns) if route_node is not None else None,
+                route_description=route_node.findtext('ns:Description', namespaces=ns) if route_node is not None else None
             )
+            journey_patterns.append(journey_pattern)
 
             order = 1
+            offset = 0
             for jptl_id in journey_pattern_node.findall('ns:JourneyPatternSectionRefs', ns):
                 jptl_id = jptl_id.text
-                for jptl_node in root.findall(f'.//ns:JourneyPatternSection[@id="{jptl_id}"]/ns:JourneyPatternTimingLink', ns):
+                journey_pattern_section_node = journey_pattern_section_nodes.get(jptl_id)
+                if journey_pattern_section_node is None:
+                    continue
+                for jptl_node in journey_pattern_section_node.iterfind('ns:JourneyPatternTimingLink', ns):
                     from_node = jptl_node.find('ns:From', ns)
                     to_node = jptl_node.find('ns:To', ns)
                     route_link_id = getattr(jptl_node.find('ns:RouteLinkRef', ns), 'text', None)
-                    route_link_node = root.find(f'.//ns:RouteLink[@id="{route_link_id}"]', ns)
+                    distance, direction = route_links.get(route_link_id, (None, None))
+                    run_time = jptl_node.findtext('ns:RunTime', namespaces=ns)
+                    from_offset = offset
+                    if run_time:
+                        offset += int(parse_duration(run_time).total_seconds())
 
-                    jptl, created = JourneyPatternTimingLink.objects.update_or_create(
+                    jptls.append((journey_pattern, JourneyPatternTimingLink(
                         jptl_id = jptl_node.attrib['id'],
-                        jp=journey_pattern,
-                        defaults={
-                            'order': order,
-                            'from_display': from_node.findtext('ns:DynamicDestinationDisplay', namespaces=ns),
-                            'from_stop_id': from_node.findtext('ns:StopPointRef', namespaces=ns),
-                            'from_timing_status': from_node.findtext('ns:TimingStatus', namespaces=ns),
-                            'from_sequence_number': from_node.attrib['SequenceNumber'] if 'SequenceNumber' in from_node.attrib else None,
-                            'to_display': to_node.findtext('ns:DynamicDestinationDisplay', namespaces=ns),
-                            'to_stop_id': to_node.findtext('ns:StopPointRef', namespaces=ns),
-                            'to_timing_status': to_node.findtext('ns:TimingStatus', namespaces=ns),
-                            'to_sequence_number': to_node.attrib['SequenceNumber'] if 'SequenceNumber' in to_node.attrib else None,
-                            'run_time': jptl_node.findtext('ns:RunTime', namespaces=ns),
-                            'distance': route_link_node.findtext('ns:Distance', namespaces=ns) if route_link_node is not None else None,
-                            'direction': route_link_node.findtext('ns:Direction', namespaces=ns) if route_link_node is not None else None
-                        }
-                    )
+                        order=order,
+                        from_display=from_node.findtext('ns:DynamicDestinationDisplay', namespaces=ns),
+                        from_stop_id=from_node.findtext('ns:StopPointRef', namespaces=ns),
+                        from_timing_status=from_node.findtext('ns:TimingStatus', namespaces=ns),
+                        from_sequence_number=from_node.attrib['SequenceNumber'] if 'SequenceNumber' in from_node.attrib else None,
+                        to_display=to_node.findtext('ns:DynamicDestinationDisplay', namespaces=ns),
+                        to_stop_id=to_node.findtext('ns:StopPointRef', namespaces=ns),
+                        to_timing_status=to_node.findtext('ns:TimingStatus', namespaces=ns),
+                        to_sequence_number=to_node.attrib['SequenceNumber'] if 'SequenceNumber' in to_node.attrib else None,
+                        run_time=run_time,
+                        from_offset=from_offset,
+                        to_offset=offset,
+                        distance=distance,
+                        direction=direction
+                    )))
                     order += 1
-            
-            journey_pattern.update_coordinates()
-
-
-###############################################################
-# Create XML -> VehicleJourney objects in PostgreSQL
-###############################################################
-def load_vehicle_journeys(root, ns, tx):
-
-    # Create VehicleJourney objects
-    for vj_node in root.findall('.//ns:VehicleJourney', ns):
-        service_ref = vj_node.findtext('ns:ServiceRef', namespaces=ns)
-        line_ref = vj_node.findtext('ns:LineRef', namespaces=ns)
-        service = Service.objects.get(service_code=service_ref)
-
-        vehicle_journey_code = vj_node.findtext('ns:VehicleJourneyCode', namespaces=ns)
-        vehicle_journey_id = vj_node.findtext('ns:VehicleJourneyId', namespaces=ns)
-
-        departure_time = vj_node.findtext('ns:DepartureTime', namespaces=ns)
-
-        direction = vj_node.findtext('ns:Direction', namespaces=ns)
-
-        operating_period = vj_node.find('ns:OperatingPeriod', ns)
-        start_date = service.operating_period_start
-        end_date = service.operating_period_end
-        end_date = None
-        if operating_period:
-            start_date = operating_period.findtext('ns:StartDate', namespaces=ns)
-            end_date = operating_period.findtext('ns:EndDate', namespaces=ns)
-
-        operating_profile = vj_node.find('ns:OperatingProfile', ns)
-        if operating_profile is None:
-            operating_profile = root.find(f'.//ns:Service[ns:ServiceCode = "{service_ref}"]/ns:OperatingProfile', ns)
-
-        days_of_week = {}
-        for day, *expressions in DAYS:
-            day_lower = day.lower()
-            day_active = False
-            for expression in expressions:
-                if operating_profile.findtext(f'ns:RegularDayType/ns:DaysOfWeek/ns:{expression}', namespaces=ns) is not None:
-                    day_active = True
-                    break
-            days_of_week[day_lower] = day_active
-
-        bank_holiday_operation = operating_profile.find('ns:BankHolidayOperation', ns)
-        if bank_holiday_operation is not None:
-            bank_holiday_operation = ET.tostring(bank_holiday_operation)
-
-        journey_pattern_ref = vj_node.findtext('ns:JourneyPatternRef', namespaces=ns)
-        journey_pattern = JourneyPattern.objects.get(jp_id=journey_pattern_ref, service=service)
-
-        vj, created = VehicleJourney.objects.update_or_create(
-            service = service,
-            vehicle_journey_code = vehicle_journey_code,
-            defaults={
-                'journey_pattern': journey_pattern,
-                'operator_id': vj_node.findtext('ns:OperatorRef', namespaces=ns),
-                'line_id': service_ref+line_ref,
-                'direction': direction,
-                'service': service,
-                'vehicle_journey_id': vehicle_journey_id,
-                'departure_time': departure_time,
-                'start_date': start_date,
-                'end_date': end_date,
-                'bank_holiday_operation': bank_holiday_operation,
-                **days_of_week
-            }
-        )
 
-        #   <VehicleJourneys>
-        #     <VehicleJourney SequenceNumber="1049">
-        #       <PrivateCode>4SU:O:0:3431:t4h-E8L86BA</PrivateCode>
-        #       <Direction>inbound</Direction>
-        #       <OperatingProfile>
-        #         <RegularDayType>
-        #           <DaysOfWeek>
-        #             <Sunday />....
-        #           </DaysOfWeek>
-        #         </RegularDayType>
-        #         <BankHolidayOperation>
-        #           <DaysOfOperation>
-        #             <GoodFriday />....
-        #           </DaysOfOperation>
-        #           <DaysOfNonOperation>
-        #             <ChristmasDay />....
-        #           </DaysOfNonOperation>
-        #         </BankHolidayOperation>
-        #       </OperatingProfile>
-        #       <VehicleJourneyCode>VJ1049</VehicleJourneyCode>
-        #       <ServiceRef>EA_SC_SCCM_4_1</ServiceRef>
-        #       <LineRef>SL1</LineRef>
-        #       <JourneyPatternRef>JP3</JourneyPatternRef>
-        #       <DepartureTime>08:39:00</DepartureTime>
-        #     </VehicleJourney>
-
-    return vj
+    return lines, services, journey_patterns, jptls
+
+
+#################################################################
+# Save Service and JourneyPattern objects in PostgreSQL
+#################################################################
+def save_services_and_journeys(tx, lines, services, journey_patterns, jptls):
+    for service in services:
+        service.tx = tx
+    bulk_upsert(lines, Line.objects.filter(line_id__in=[line.line_id for line in lines]), ('line_id',))
+    services = bulk_upsert(services, Service.objects.filter(service_code__in=[service.service_code for service in services]),
+                           ('service_code',))
+    journey_patterns = bulk_upsert(journey_patterns, JourneyPattern.objects.filter(service__in=services),
+                                   ('jp_id', 'service_id'))
+    journey_patterns = {(jp.jp_id, jp.service_id): jp for jp in journey_patterns}
+
+    for journey_pattern, jptl in jptls:
+        jptl.jp = journey_patterns[(journey_pattern.jp_id, journey_pattern.service_id)]
+    jptls = bulk_upsert([jptl for journey_pattern, jptl in jptls],
+                        JourneyPatternTimingLink.objects.filter(jp__in=journey_patterns.values()), ('jptl_id', 'jp_id'))
+
+    # Same as JourneyPattern.update_coordinates() but with a single query for the stops of the whole file
+    stop_locations = dict(Stop.objects.filter(
+        atco_code__in={jptl.from_stop_id for jptl in jptls} | {jptl.to_stop_id for jptl in jptls}
+    ).values_list('atco_code', 'gis_location'))
+    coordinates = {}
+    for jptl in sorted(jptls, key=lambda jptl: jptl.order):
+        if jptl.jp_id not in coordinates:
+            coordinates[jptl.jp_id] = [stop_locations.get(jptl.from_stop_id)]
+        coordinates[jptl.jp_id].append(stop_locations.get(jptl.to_stop_id))
+    for journey_pattern in journey_patterns.values():
+        points = [point for point in coordinates.get(journey_pattern.pk, []) if point is not None]
+        if len(points) > 1:
+            journey_pattern.coordinates = LineString(points)
+    JourneyPattern.objects.bulk_update(journey_patterns.values(), ['coordinates'], batch_size=1000)
+
+    return {service.service_code: service for service in services}, journey_patterns, len(jptls)
 
 
 ###############################################################
-# Load the XML content for a single service (i.e. TNDS file)
+# Create XML -> VehicleJourney objects
+###############################################################
+def parse_service_operating_profiles(root, ns):
+    # The default OperatingProfile of the journeys of each service, like root.find() the first service wins
+    return {
+        service_node.findtext('ns:ServiceCode', namespaces=ns): service_node.find('ns:OperatingProfile', ns)
+        for service_node in reversed(root.findall('.//ns:Service', ns))
+    }
+
+
+def parse_vehicle_journey(vj_node, ns, services, service_operating_profiles):
+    # Returns a (VehicleJourney, JourneyPatternRef) pair, the JourneyPattern is resolved by save_vehicle_journeys.
+    # services are the ones parsed from the same file by service code, used for the default start date.
+    service_ref = vj_node.findtext('ns:ServiceRef', namespaces=ns)
+    line_ref = vj_node.findtext('ns:LineRef', namespaces=ns)
+
+    vehicle_journey_code = vj_node.findtext('ns:VehicleJourneyCode', namespaces=ns)
+    vehicle_journey_id = vj_node.findtext('ns:VehicleJourneyId', namespaces=ns)
+
+    departure_time = datetime.strptime(vj_node.findtext('ns:DepartureTime', namespaces=ns), '%H:%M:%S').time()
+
+    direction = vj_node.findtext('ns:Direction', namespaces=ns)
+
+    operating_period = vj_node.find('ns:OperatingPeriod', ns)
+    # Journeys from services of other files get their start date from the database in save_vehicle_journeys
+    start_date = services[service_ref].operating_period_start if service_ref in services else None
+    end_date = None
+    if operating_period:
+        start_date = operating_period.findtext('ns:StartDate', namespaces=ns)
+        end_date = operating_period.findtext('ns:EndDate', namespaces=ns)
+
+    operating_profile = vj_node.find('ns:OperatingProfile', ns)
+    if operating_profile is None:
+        operating_profile = service_operating_profiles.get(service_ref)
+
+    days_of_week = {}
+    for day, *expressions in DAYS:
+        day_lower = day.lower()
+        day_active = False
+        for expression in expressions:
+            if operating_profile.findtext(f'ns:RegularDayType/ns:DaysOfWeek/ns:{expression}', namespaces=ns) is not None:
+                day_active = True
+                break
+        days_of_week[day_lower] = day_active
+
+    bank_holiday_operation = operating_profile.find('ns:BankHolidayOperation', ns)
+    if bank_holiday_operation is not None:
+        bank_holiday_operation = ET.tostring(bank_holiday_operation, encoding='unicode')
+
+    journey_pattern_ref = vj_node.findtext('ns:JourneyPatternRef', namespaces=ns)
+
+    #   <VehicleJourneys>
+    #     <VehicleJourney SequenceNumber="1049">
+    #       <PrivateCode>4SU:O:0:3431:t4h-E8L86BA</PrivateCode>
+    #       <Direction>inbound</Direction>
+    #       <OperatingProfile>
+    #         <RegularDayType>
+    #           <DaysOfWeek>
+    #             <Sunday />....
+    #           </DaysOfWeek>
+    #         </RegularDayType>
+    #         <BankHolidayOperation>
+    #           <DaysOfOperation>
+    #             <GoodFriday />....
+    #           </DaysOfOperation>
+    #           <DaysOfNonOperation>
+    #             <ChristmasDay />....
+    #           </DaysOfNonOperation>
+    #         </BankHolidayOperation>
+    #       </OperatingProfile>
+    #       <VehicleJourneyCode>VJ1049</VehicleJourneyCode>
+    #       <ServiceRef>EA_SC_SCCM_4_1</ServiceRef>
+    #       <LineRef>SL1</LineRef>
+    #       <JourneyPatternRef>JP3</JourneyPatternRef>
+    #       <DepartureTime>08:39:00</DepartureTime>
+    #     </VehicleJourney>
+
+    return VehicleJourney(
+        service_id = service_ref,
+        vehicle_journey_code = vehicle_journey_code,
+        operator_id=vj_node.findtext('ns:OperatorRef', namespaces=ns),
+        line_id=service_ref+line_ref,
+        direction=direction,
+        vehicle_journey_id=vehicle_journey_id,
+        departure_time=departure_time,
+        start_date=start_date,
+        end_date=end_date,
+        bank_holiday_operation=bank_holiday_operation,
+        **days_of_week
+    ), journey_pattern_ref
+
+
+###############################################################
+# Save VehicleJourney objects in PostgreSQL
+###############################################################
+def save_vehicle_journeys(vehicle_journeys, services, journey_patterns):
+    # services and journey_patterns are the ones saved from the same file by save_services_and_journeys
+    for vj, journey_pattern_ref in vehicle_journeys:
+        if vj.service_id not in services:
+            services[vj.service_id] = Service.objects.get(service_code=vj.service_id)
+        if (journey_pattern_ref, vj.service_id) not in journey_patterns:
+            journey_patterns[(journey_pattern_ref, vj.service_id)] = \
+                JourneyPattern.objects.get(jp_id=journey_pattern_ref, service_id=vj.service_id)
+        vj.service = services[vj.service_id]
+        vj.journey_pattern = journey_patterns[(journey_pattern_ref, vj.service_id)]
+        if vj.start_date is None:
+            vj.start_date = vj.service.operating_period_start
+
+    return bulk_upsert([vj for vj, journey_pattern_ref in vehicle_journeys],
+                       VehicleJourney.objects.filter(service__in=services.values()),
+                       ('vehicle_journey_code', 'service_id'))
+
+
 ###############################################################
-def load_xml(tnds_zone, filename, xml_content):
-    root = ET.fromstring(xml_content)
+# Build the StopTime index used by Stop.next_departures
+###############################################################
+def load_stop_times(vehicle_journeys):
+    # Offsets are computed once per JourneyPattern and shared by all its VehicleJourneys
+    vehicle_journeys = list(vehicle_journeys)
+    offsets = {}
+    stop_times = []
+    for vj in vehicle_journeys:
+        if vj.journey_pattern_id not in offsets:
+            offsets[vj.journey_pattern_id] = vj.journey_pattern.get_stop_offsets()
+        origin_departure = datetime.combine(DUMMY_DATE, vj.departure_time)
+        days = vj.days_of_week
+        for order, (stop_id, offset) in enumerate(offsets[vj.journey_pattern_id], 1):
+            stop_times.append(StopTime(
+                stop_id=stop_id,
+                vehicle_journey=vj,
+                order=order,
+                offset=offset,
+                time=(origin_departure + timedelta(seconds=offset)).time(),
+                days=days
+            ))
+
+    StopTime.objects.filter(vehicle_journey__in=vehicle_journeys).delete()
+    StopTime.objects.bulk_create(stop_times, batch_size=5000)
+    return len(stop_times)
+
+
+###############################################################
+# manage.py update_bus_info --stoptimes
+# rebuild the StopTime index for all the timetables in the database
+###############################################################
+def cmd_stop_times():
+    for service in Service.objects.all().iterator():
+        with transaction.atomic():
+            load_stop_times(VehicleJourney.objects.filter(service=service).select_related('journey_pattern'))
+
+
+###############################################################
+# Build the CanonicalJourneyPattern table used by the service maps
+###############################################################
+def load_canonical_journey_patterns(services):
+    # Picks the journey pattern with the most timing links of each service and direction (the first one saved
+    # when tied) and replaces the previous CanonicalJourneyPatterns of the services, with their coordinates
+    # simplified for each of SIMPLIFIED_ZOOM_LEVELS
+    services = list(services)
+    stops = {}
+    for jp_id, from_stop_id, to_stop_id in JourneyPatternTimingLink.objects.filter(jp__service__in=services) \
+            .order_by('jp_id', 'order').values_list('jp_id', 'from_stop_id', 'to_stop_id'):
+        if jp_id not in stops:
+            stops[jp_id] = [from_stop_id]
+        stops[jp_id].append(to_stop_id)
+
+    canonical = {}
+    for journey_pattern in JourneyPattern.objects.filter(service__in=services).order_by('pk'):
+        if journey_pattern.pk not in stops:
+            continue
+        key = (journey_pattern.service_id, journey_pattern.direction)
+        if key not in canonical or len(stops[journey_pattern.pk]) > len(stops[canonical[key].pk]):
+            canonical[key] = journey_pattern
+
+    CanonicalJourneyPattern.objects.filter(service__in=services).delete()
+    canonical_journey_patterns = CanonicalJourneyPattern.objects.bulk_create([
+        CanonicalJourneyPattern(
+            service_id=journey_pattern.service_id,
+            direction=journey_pattern.direction,
+            journey_pattern=journey_pattern,
+            route_description=journey_pattern.route_description,
+            num_timing_links=len(stops[journey_pattern.pk]) - 1,
+            stops=stops[journey_pattern.pk],
+            coordinates=journey_pattern.coordinates
+        ) for journey_pattern in canonical.values()])
+    CanonicalJourneyPatternGeometry.objects.bulk_create([
+        CanonicalJourneyPatternGeometry(
+            canonical_journey_pattern=canonical_journey_pattern,
+            zoom=zoom,
+            coordinates=canonical_journey_pattern.coordinates.simplify(simplify_tolerance(zoom))
+        ) for canonical_journey_pattern in canonical_journey_patterns if canonical_journey_pattern.coordinates
+        for zoom in SIMPLIFIED_ZOOM_LEVELS], batch_size=1000)
+    return len(canonical)
+
+
+###############################################################
+# manage.py update_bus_info --journeypatterns
+# rebuild the CanonicalJourneyPattern table for all the timetables in the database
+###############################################################
+def cmd_canonical_journey_patterns():
+    for service in Service.objects.all().iterator():
+        with transaction.atomic():
+            load_canonical_journey_patterns([service])
+
+
+###############################################################
+# Parse the XML content for a single service (i.e. TNDS file)
+###############################################################
+class HashingReader:
+    # Wraps a binary file to hash its content as it is read, see parse_xml()
+    def __init__(self, open_file):
+        self.open_file = open_file
+        self.hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.open_file.read(size)
+        self.hash.update(data)
+        return data
+
+
+def parse_xml(filename, xml_file):
+    # Pure ElementTree work without any database access, so that it can run in worker processes (--workers).
+    # Returns a dict of the model objects of the file for save_xml().
+    # The binary xml_file is streamed in a single pass, each section of the file being parsed and freed as soon
+    # as it has been read (and each VehicleJourney of the VehicleJourneys section, also given to the Timetable
+    # compiled for the timetable pages), so that neither the file nor its whole tree is ever in memory. What is
+    # held is the objects parsed from it, and the elements of the Routes, RouteSections and
+    # JourneyPatternSections until the Services referring to them have been parsed.
+    parse_start = perf_counter()
+    xml_file = HashingReader(xml_file)
+    events = ET.iterparse(xml_file, events=('start', 'end'))
+    _, root = next(events)
 
     ns = {'ns': 'http://www.transxchange.org.uk/'}
 
@@ -448,16 +762,15 @@ def load_xml(tnds_zone, filename, xml_content):
     transxchange_filename = transxchange.attrib.get('FileName') or filename
     revision_number = transxchange.attrib.get('RevisionNumber')
 
-    # Create TransXChange object
-    tx, created = TransXChange.objects.update_or_create(
-        file_name=transxchange_filename, 
-        creation_date_time=creation_time,
-        modification_date_time=modification_time, 
-        schema_version=schema_version,
-        revision_number=revision_number
-    )
-
-    #print('transxchange_id: {}, create={}'.format(tx, created))
+    parsed = {
+        'transxchange': dict(
+            file_name=transxchange_filename,
+            creation_date_time=creation_time,
+            modification_date_time=modification_time,
+            schema_version=schema_version,
+            revision_number=revision_number
+        )
+    }
 
     # {http://www.transxchange.org.uk/}StopPoints {}
     # {http://www.transxchange.org.uk/}RouteSections {}
@@ -475,15 +788,173 @@ def load_xml(tnds_zone, filename, xml_content):
     # {http://www.transxchange.org.uk/}PublicUse {}
     # {http://www.transxchange.org.uk/}StandardService {}
    
-    #print("load_xml():load_stops");
-    load_stops(root, ns, tx)
-    #print("load_xml():load_operators");
-    load_operators(root, ns)
-    #print("load_xml():load_services_and_journeys");
-    load_services_and_journeys(root, ns, tx)
-    #print("load_xml():load_vehicle_journeys");
-    load_vehicle_journeys(root, ns, tx)
-    #print("load_xml() completed")
+    parsed.update(stops=[], operators=[], lines=[], services=[], journey_patterns=[], jptls=[], vehicle_journeys=[])
+    route_nodes = {}
+    route_links = {}
+    journey_pattern_section_nodes = {}
+    services = {}
+    service_operating_profiles = {}
+    # The timetable pages are made from the compiled timetable of the file, see timetable_from_service()
+    timetable = Timetable(None, None)
+    timetable_error = None
+
+    # The sections are in the order of the TransXChange schema: the Routes, RouteSections and
+    # JourneyPatternSections referred to by the Services come before them, and the Services before the
+    # VehicleJourneys
+    tag_prefix = '{%s}' % ns['ns']
+    depth = 1
+    for event, element in events:
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth <= 2 and timetable_error is None:
+            try:
+                if not timetable.feed(element):
+                    timetable_error = 'journey without a journey pattern'
+            except Exception as e:
+                timetable_error = e
+        if depth == 2 and element.tag == tag_prefix + 'VehicleJourney':
+            parsed['vehicle_journeys'].append(
+                parse_vehicle_journey(element, ns, services, service_operating_profiles))
+            element.clear()
+        elif depth == 1:
+            tag = element.tag[len(tag_prefix):]
+            if tag == 'StopPoints':
+                parsed['stops'] = parse_stops(element, ns)
+            elif tag == 'RouteSections':
+                route_links.update(index_route_links(element, ns))
+            elif tag == 'Routes':
+                route_nodes.update(index_by_id(element, ns, './/ns:Route'))
+            elif tag == 'JourneyPatternSections':
+                journey_pattern_section_nodes.update(index_by_id(element, ns, './/ns:JourneyPatternSection'))
+            elif tag == 'Operators':
+                parsed['operators'] = parse_operators(element, ns)
+            elif tag == 'Services':
+                parsed['lines'], parsed['services'], parsed['journey_patterns'], parsed['jptls'] = \
+                    parse_services_and_journeys(element, ns, route_nodes, route_links, journey_pattern_section_nodes)
+                services = {service.service_code: service for service in parsed['services']}
+                service_operating_profiles = parse_service_operating_profiles(element, ns)
+                journey_pattern_section_nodes = {}
+            # The elements kept in the indexes above keep their content
+            element.clear()
+
+    parsed['content_hash'] = xml_file.hash.hexdigest()
+
+    parsed['timetable'] = None
+    if timetable_error is None:
+        try:
+            timetable.finish(root)
+            parsed['timetable'] = dump_compiled_timetable(timetable)
+        except Exception as e:
+            timetable_error = e
+    if timetable_error is not None:
+        logger.warning("Could not compile the timetable of file %s, exception was %s" % (filename, timetable_error))
+    parsed['parse_seconds'] = perf_counter() - parse_start
+    return parsed
+
+
+###############################################################
+# Save the objects parsed from a single service (i.e. TNDS file)
+###############################################################
+def content_hash(xml_file):
+    # Same as the content_hash of parse_xml(), without parsing the file
+    content_hash = hashlib.sha256()
+    for data in iter(partial(xml_file.read, 1 << 16), b''):
+        content_hash.update(data)
+    return content_hash.hexdigest()
+
+
+TRANSXCHANGE_REVISION_FIELDS = ('file_name', 'modification_date_time', 'revision_number')
+
+
+def save_xml(tnds_zone, parsed, reload=False):
+    # Returns the TransXChange of the file and a Counter of the rows written and of the seconds spent in
+    # each step, see print_load_report()
+    fields = dict(parsed['transxchange'], tnds_zone=tnds_zone, content_hash=parsed['content_hash'],
+                  timetable=parsed['timetable'])
+    revision = {name: fields.pop(name) for name in TRANSXCHANGE_REVISION_FIELDS}
+    tx = TransXChange.objects.filter(**revision).order_by('-id').first()
+    if tx is None:
+        tx = TransXChange(**revision)
+        unchanged = False
+    else:
+        # Files loaded before content hashes were recorded are assumed to be unchanged if their revision is
+        unchanged = tx.content_hash in (None, fields['content_hash'])
+    for name, value in fields.items():
+        setattr(tx, name, value)
+    if not unchanged or reload:
+        # Changes the version of the timetables in the database, see service_calendar.get_timetables_version
+        tx.loaded = now()
+    tx.save()
+    if unchanged and not reload:
+        return tx, load_missing_indexes(tx, Counter(unchanged=1, parse_seconds=parsed['parse_seconds']))
+
+    stats = Counter(files=1, parse_seconds=parsed['parse_seconds'])
+    step_start = perf_counter()
+
+    def step_done(step):
+        nonlocal step_start
+        step_end = perf_counter()
+        stats[step + '_seconds'] += step_end - step_start
+        step_start = step_end
+
+    stats['stops'] += save_stops(parsed['stops'], tx.file_name)
+    step_done('stops')
+    stats['operators'] += len(bulk_upsert(
+        parsed['operators'],
+        Operator.objects.filter(operator_id__in=[operator.operator_id for operator in parsed['operators']]),
+        ('operator_id',)))
+    step_done('operators')
+    services, journey_patterns, stats['timing_links'] = save_services_and_journeys(
+        tx, parsed['lines'], parsed['services'], parsed['journey_patterns'], parsed['jptls'])
+    stats['services'] += len(services)
+    stats['journey_patterns'] += len(journey_patterns)
+    step_done('services_and_journeys')
+    stats['canonical_journey_patterns'] += load_canonical_journey_patterns(services.values())
+    step_done('canonical_journey_patterns')
+    vehicle_journeys = save_vehicle_journeys(parsed['vehicle_journeys'], services, journey_patterns)
+    stats['vehicle_journeys'] += len(vehicle_journeys)
+    step_done('vehicle_journeys')
+    stats['stop_times'] += load_stop_times(vehicle_journeys)
+    step_done('stop_times')
+    return tx, stats
+
+
+def load_missing_indexes(tx, stats):
+    # Builds the StopTime and CanonicalJourneyPattern rows of an unchanged file which has none, i.e. loaded before
+    # they existed, so that the next import after the migrations fills them in without --stoptimes or
+    # --journeypatterns
+    services = list(tx.service_set.all())
+    if not StopTime.objects.filter(vehicle_journey__service__in=services).exists():
+        stats['stop_times'] += load_stop_times(
+            VehicleJourney.objects.filter(service__in=services).select_related('journey_pattern'))
+    if not CanonicalJourneyPattern.objects.filter(service__in=services).exists():
+        stats['canonical_journey_patterns'] += load_canonical_journey_patterns(services)
+    return stats
+
+
+###############################################################
+# Load the XML content for a single service (i.e. TNDS file)
+###############################################################
+def load_xml(tnds_zone, filename, xml_file, reload=False):
+    return save_xml(tnds_zone, parse_xml(filename, xml_file), reload)
+
+
+###############################################################
+# Print the rows written and time spent loading a zone
+###############################################################
+LOAD_REPORT_ROWS = ['stops', 'operators', 'services', 'journey_patterns', 'canonical_journey_patterns', 'timing_links',
+                    'vehicle_journeys', 'stop_times']
+LOAD_REPORT_STEPS = ['parse', 'stops', 'operators', 'services_and_journeys', 'canonical_journey_patterns',
+                     'vehicle_journeys', 'stop_times']
+
+
+def print_load_report(tnds_zone, stats, seconds):
+    print('{} loaded {} files ({} unchanged, {} failed, {} deleted) in {:.1f}s'.format(
+        tnds_zone, stats['files'], stats['unchanged'], stats['failed'], stats['deleted'], seconds))
+    print('    rows: ' + ', '.join('{} {}'.format(name, stats[name]) for name in LOAD_REPORT_ROWS))
+    print('    seconds: ' + ', '.join('{} {:.1f}'.format(step, stats[step + '_seconds']) for step in LOAD_REPORT_STEPS))
 
 ###########################################################################################
 ##### The manage.py Command class                 #########################################
@@ -531,25 +1002,58 @@ class Command(BaseCommand):
             help='Show database status for TNDS timetable data',
         )
 
+        parser.add_argument(
+            '--stoptimes',
+            nargs='?',
+            const='NO ARGS',
+            help='Rebuild the stop times index used for next departures from the timetables in the database',
+        )
+
+        parser.add_argument(
+            '--journeypatterns',
+            nargs='?',
+            const='NO ARGS',
+            help='Rebuild the canonical journey patterns used by the service maps from the timetables in the database',
+        )
+
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of processes parsing the XML files of a zip, see --loadzip and --loadftp (default 1)',
+        )
+
+        parser.add_argument(
+            '--reload',
+            action='store_true',
+            help='Load every XML file, including the ones unchanged since they were last loaded',
+        )
+
+        parser.add_argument(
+            '--delete-missing',
+            action='store_true',
+            help='Delete the timetables of the files of a zone which are no longer in its zip, see --loadzip and --loadftp',
+        )
+
     def handle(self, **options):
 
         if options['loadxml']:
             filename = options['loadxml']
             tnds_zone = options['zone']
             print('loading {}'.format(filename))
-            load_xml_file(tnds_zone, filename)
+            load_xml_file(tnds_zone, filename, options['reload'])
             return
 
         if options['loadzip']:
             filename = options['loadzip']
             tnds_zone = options['zone']
             print('loading {}'.format(filename))
-            load_zip_file(tnds_zone, filename)
+            load_zip_file(tnds_zone, filename, options['workers'], options['reload'], options['delete_missing'])
             return
 
         if options['loadftp']:
             print('loading timetables from TNDS')
-            load_ftp()
+            load_ftp(options['workers'], options['reload'], options['delete_missing'])
             return
 
         if options['clear']:
@@ -562,5 +1066,15 @@ class Command(BaseCommand):
             cmd_status()
             return
 
+        if options['stoptimes']:
+            print('Rebuilding stop times index')
+            cmd_stop_times()
+            return
+
+        if options['journeypatterns']:
+            print('Rebuilding canonical journey patterns')
+            cmd_canonical_journey_patterns()
+            return
+
         # if we fell through to here, then do --loadftp
-        load_ftp()
+        load_ftp(options['workers'], options['reload'], options['delete_missing'])
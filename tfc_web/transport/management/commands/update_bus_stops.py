@@ -1,57 +1,115 @@
 import csv
-import zipfile
 import logging
+from datetime import datetime
+from functools import lru_cache
+from itertools import islice
 from pyproj import Transformer, CRS
-from io import BytesIO, TextIOWrapper
+from io import TextIOWrapper
 from urllib.request import urlopen
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.utils.timezone import now
-from transport.models import Stop
+from transport.models import Stop, update_gis_fields
 
 
 logger = logging.getLogger(__name__)
 
 
+# Number of CSV rows compared with the database, transformed and saved at a time
+BATCH_SIZE = 5000
+
+# Stop fields set from the NaPTAN CSV, the other fields are left untouched on existing stops
+STOP_FIELDS = ['naptan_code', 'common_name', 'indicator', 'locality_name', 'longitude', 'latitude',
+               'modification_date', 'gis_location', 'data', 'last_modified']
+
+
+@lru_cache()
+def get_transformer(in_proj_epsg=27700, out_proj_epsg=4326):
+    return Transformer.from_crs(CRS(f"EPSG:{in_proj_epsg}"), CRS(f"EPSG:{out_proj_epsg}"))
+
+
 def convert_northing_easting_to_lat_lon(easting, northing, in_proj_epsg=27700, out_proj_epsg=4326):
-    in_proj = CRS(f"EPSG:{in_proj_epsg}")
-    out_proj = CRS(f"EPSG:{out_proj_epsg}")
-    transformer = Transformer.from_crs(in_proj, out_proj)
-    lat, lon = transformer.transform(easting, northing)
+    # easting and northing can also be lists, transformed in a single call
+    lat, lon = get_transformer(in_proj_epsg, out_proj_epsg).transform(easting, northing)
     return lat, lon
 
 
+def parse_modification_date(row):
+    try:
+        return datetime.fromisoformat(row['ModificationDateTime'].strip()).date()
+    except ValueError:
+        return None
+
+
+def sync_stops(rows):
+    # Creates or updates the stops of a batch of CSV rows, skipping the ones whose ModificationDateTime is
+    # the same as when they were last loaded. Returns the number of stops created, updated and unchanged.
+    loaded = dict(Stop.objects.filter(atco_code__in=[row['ATCOCode'] for row in rows])
+                  .values_list('atco_code', 'data__ModificationDateTime'))
+    rows = {row['ATCOCode']: row for row in rows
+            if row['ATCOCode'] not in loaded or loaded[row['ATCOCode']] != row['ModificationDateTime']}
+    unchanged = len(loaded) - len(set(loaded) & set(rows))
+
+    stops = []
+    missing_coordinates = []
+    for atco_code, row in rows.items():
+        stop = Stop(
+            atco_code=atco_code,
+            naptan_code=None if row['NaptanCode'].strip() == '' else row['NaptanCode'].strip(),
+            common_name=row['CommonName'].strip(),
+            indicator=row['Indicator'].strip(),
+            locality_name=row['LocalityName'].strip(),
+            longitude=row['Longitude'].strip(),
+            latitude=row['Latitude'].strip(),
+            modification_date=parse_modification_date(row),
+            data=row,
+            last_modified=now()
+        )
+        if stop.latitude == '' and stop.longitude == '':
+            if row['Easting'].strip() and row['Northing'].strip():
+                missing_coordinates.append(stop)
+            else:
+                stop.latitude = stop.longitude = None
+        stops.append(stop)
+
+    if missing_coordinates:
+        lat, lon = convert_northing_easting_to_lat_lon(
+            [float(stop.data['Easting']) for stop in missing_coordinates],
+            [float(stop.data['Northing']) for stop in missing_coordinates])
+        for stop, stop_lat, stop_lon in zip(missing_coordinates, lat, lon):
+            stop.latitude, stop.longitude = stop_lat, stop_lon
+
+    # bulk_create and bulk_update do not send the pre_save signal that sets gis_location
+    for stop in stops:
+        if stop.latitude is not None and stop.longitude is not None:
+            update_gis_fields(Stop, stop)
+
+    to_create = [stop for stop in stops if stop.atco_code not in loaded]
+    to_update = [stop for stop in stops if stop.atco_code in loaded]
+    with transaction.atomic():
+        Stop.objects.bulk_create(to_create)
+        Stop.objects.bulk_update(to_update, STOP_FIELDS)
+    return len(to_create), len(to_update), unchanged
+
+
 class Command(BaseCommand):
     help = "Updates bus stops from DFT website"
 
     def handle(self, **options):
         """Update Bus Stops data from the DFT website"""
         stops_csv_file = urlopen(
-            'https://naptan.api.dft.gov.uk/v1/access-nodes?dataFormat=csv').read()
-        csv_reader = csv.DictReader(TextIOWrapper(BytesIO(stops_csv_file), encoding='cp1252'))
-        csv_rows = []
-        title = csv_reader.fieldnames
-        for row in csv_reader:
-            csv_rows.extend([{title[i]: row[title[i]] for i in range(len(title))}])
-
-        for element in csv_rows:
-            lat = element['Latitude'].strip()
-            long = element['Longitude'].strip()
-
-            if lat == '' and long == '':
-                easting = element['Easting'].strip()
-                northing = element['Northing'].strip()
-                lat, long = convert_northing_easting_to_lat_lon(easting, northing)
-            
-            Stop.objects.update_or_create(
-                atco_code=element['ATCOCode'],
-                defaults={
-                    'naptan_code': None if element['NaptanCode'].strip() == '' else element['NaptanCode'].strip(),
-                    'common_name': element['CommonName'].strip(),
-                    'indicator': element['Indicator'].strip(),
-                    'locality_name': element['LocalityName'].strip(),
-                    'longitude': long,
-                    'latitude': lat,
-                    'data': element,
-                    'last_modified': now()
-                },
-            )
+            'https://naptan.api.dft.gov.uk/v1/access-nodes?dataFormat=csv')
+        # The CSV is read as it is downloaded, one batch of rows at a time
+        csv_reader = csv.DictReader(TextIOWrapper(stops_csv_file, encoding='cp1252'))
+        created = updated = unchanged = 0
+        while True:
+            rows = list(islice(csv_reader, BATCH_SIZE))
+            if not rows:
+                break
+            batch_created, batch_updated, batch_unchanged = sync_stops(rows)
+            created += batch_created
+            updated += batch_updated
+            unchanged += batch_unchanged
+            logger.info("update_bus_stops: %d stops created, %d updated, %d unchanged so far" %
+                        (created, updated, unchanged))
+        print('update_bus_stops: {} stops created, {} updated, {} unchanged'.format(created, updated, unchanged))
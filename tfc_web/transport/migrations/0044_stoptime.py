@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0043_journeypattern_coordinates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StopTime',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order', models.IntegerField()),
+                ('offset', models.IntegerField()),
+                ('time', models.TimeField()),
+                ('days', models.SmallIntegerField()),
+                ('stop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stop_times', to='transport.stop')),
+                ('vehicle_journey', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stop_times', to='transport.vehiclejourney')),
+            ],
+            options={
+                'ordering': ['time'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stoptime',
+            index=models.Index(fields=['stop', 'time'], name='transport_stoptime_stop_time'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:03
+
+from django.db import migrations, models
+from isodate import parse_duration
+
+
+def populate_offsets(apps, schema_editor):
+    JourneyPattern = apps.get_model('transport', 'JourneyPattern')
+    JourneyPatternTimingLink = apps.get_model('transport', 'JourneyPatternTimingLink')
+    for jp in JourneyPattern.objects.all().iterator():
+        offset = 0
+        jptls = list(JourneyPatternTimingLink.objects.filter(jp=jp).order_by('order'))
+        for jptl in jptls:
+            jptl.from_offset = offset
+            if jptl.run_time:
+                offset += int(parse_duration(jptl.run_time).total_seconds())
+            jptl.to_offset = offset
+        JourneyPatternTimingLink.objects.bulk_update(jptls, ['from_offset', 'to_offset'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0044_stoptime'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='journeypatterntiminglink',
+            name='from_offset',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='journeypatterntiminglink',
+            name='to_offset',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(populate_offsets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0045_journeypatterntiminglink_offsets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transxchange',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='transxchange',
+            name='tnds_zone',
+            field=models.CharField(blank=True, db_index=True, max_length=20, null=True),
+        ),
+    ]
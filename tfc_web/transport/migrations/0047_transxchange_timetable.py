@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 15:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0046_transxchange_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transxchange',
+            name='timetable',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:20
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0047_transxchange_timetable'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CanonicalJourneyPattern',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('direction', models.CharField(blank=True, max_length=50, null=True)),
+                ('route_description', models.CharField(blank=True, max_length=500, null=True)),
+                ('num_timing_links', models.IntegerField()),
+                ('stops', models.JSONField(default=list)),
+                ('coordinates', django.contrib.gis.db.models.fields.LineStringField(blank=True, null=True, srid=4326)),
+                ('journey_pattern', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='canonical', to='transport.journeypattern')),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='canonical_journey_patterns', to='transport.service')),
+            ],
+            options={
+                'unique_together': {('service', 'direction')},
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:05
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0048_canonicaljourneypattern'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CanonicalJourneyPatternGeometry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zoom', models.SmallIntegerField()),
+                ('coordinates', django.contrib.gis.db.models.fields.LineStringField(srid=4326)),
+                ('canonical_journey_pattern', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='geometries', to='transport.canonicaljourneypattern')),
+            ],
+            options={
+                'unique_together': {('canonical_journey_pattern', 'zoom')},
+            },
+        ),
+    ]
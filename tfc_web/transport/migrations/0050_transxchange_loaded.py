@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0049_canonicaljourneypatterngeometry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transxchange',
+            name='loaded',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
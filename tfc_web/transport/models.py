@@ -3,9 +3,12 @@ from django.contrib.gis.geos import Point, Polygon, MultiPoint, LineString
 from django.db.models.signals import pre_save
 from django.dispatch import receiver
 from django.urls import reverse
-from django.db.models import Q
-from datetime import datetime, timedelta
-from isodate import parse_duration
+from django.db.models import F
+from datetime import datetime
+from transport.utils.transxchange import get_bank_holidays, get_other_holidays
+
+
+WEEKDAY_NAMES = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
 
 
 class Stop(models.Model):
@@ -82,59 +85,48 @@ class Stop(models.Model):
         else:
             return '%s, %s' % (self.locality_name, self.common_name) if self.locality_name else '%s' % self.common_name
 
-    def next_departures(self, current_time = datetime.now()):
-        from transport.api.serializers import StopSerializer
-
-        journey_patterns = JourneyPattern.objects.filter(journeypatterntiminglink__from_stop=self).distinct()
-
-        day_of_week = current_time.strftime('%A').lower()
-        vehicle_journeys = VehicleJourney.objects.filter(
-            Q(**{day_of_week: True}),
-            journey_pattern__in=journey_patterns
-        )
-
-        next_departures = []
-        for vehicle_journey in vehicle_journeys:
-            journey_pattern_timing_links = JourneyPatternTimingLink.objects.filter(
-                jp=vehicle_journey.journey_pattern
-            ).order_by('order')
-
-            departure_time = vehicle_journey.departure_time
-            origin_departure_datetime = current_time.replace(hour=departure_time.hour, minute=departure_time.minute, second=departure_time.second)
-
-            timetable = []
-            order = 1
-            stop_id = journey_pattern_timing_links[0].from_stop_id
-            timetable.append({
+    def next_departures(self, current_time=None, nresults=None):
+        # Departures from this stop from current_time until the end of the day, using the precomputed
+        # StopTime index built by update_bus_info (a single indexed range query on stop and time), narrowed
+        # down to the journeys running that day by the service calendar
+        from transport.utils.service_calendar import get_active_vehicle_journeys
+
+        if current_time is None:
+            current_time = datetime.now()
+        active_vehicle_journeys = get_active_vehicle_journeys(current_time.date())
+
+        candidates = StopTime.objects.filter(stop=self, time__gte=current_time.time())
+        if not get_bank_holidays(current_time.date()) and not get_other_holidays(current_time.date()):
+            # Journeys not running on this day of the week can be skipped by the database already, unless their
+            # BankHolidayOperation may make them run on a named day (see service_calendar.runs_on_bank_holiday)
+            candidates = candidates.annotate(
+                runs_today=F('days').bitand(1 << current_time.weekday())
+            ).filter(runs_today__gt=0)
+        stop_time_ids = [
+            stop_time_id for stop_time_id, vehicle_journey_id in
+            candidates.order_by('time', 'vehicle_journey_id').values_list('id', 'vehicle_journey_id')
+            if vehicle_journey_id in active_vehicle_journeys
+        ]
+        if nresults is not None:
+            stop_time_ids = stop_time_ids[:nresults]
+
+        stop_times = list(StopTime.objects.filter(id__in=stop_time_ids).select_related(
+            'vehicle_journey__journey_pattern__service__line', 'vehicle_journey__journey_pattern__service__operator'
+        ).order_by('time', 'vehicle_journey_id'))
+
+        # Full timetable of every selected vehicle journey, fetched in one go
+        timetables = {stop_time.vehicle_journey_id: [] for stop_time in stop_times}
+        for vehicle_journey_id, order, stop_id, time in StopTime.objects.filter(
+                vehicle_journey_id__in=timetables).order_by('vehicle_journey_id', 'order').values_list(
+                'vehicle_journey_id', 'order', 'stop_id', 'time'):
+            timetables[vehicle_journey_id].append({
                 "order": order,
                 "stop_id": stop_id,
-                "time": departure_time
+                "time": time
             })
-            if stop_id == self.atco_code:
-                current_stop_departure_time = departure_time
-            total_run_time = timedelta()
-            for jptl in journey_pattern_timing_links:
-                total_run_time += parse_duration(jptl.run_time)
-                stop_id = jptl.to_stop_id
-                departure_datetime = origin_departure_datetime + total_run_time
-                departure_time = departure_datetime.time()
-                order += 1
-                timetable.append({
-                    "order": order,
-                    "stop_id": stop_id,
-                    "time": departure_time
-                })
-                if stop_id == self.atco_code:
-                    current_stop_departure_time = departure_time
-
-            time_diff = (datetime.combine(current_time.date(), current_stop_departure_time) - current_time) % timedelta(days=1)
-            departure_datetime = current_time + time_diff
-            departure_time = departure_datetime.time()
-            if departure_datetime.date() == current_time.date() and departure_time >= current_time.time():
-                next_departures.append({'vehicle_journey': vehicle_journey, 'time': departure_time, 'timetable': timetable})
-
-        next_departures.sort(key=lambda x: x['time'])
-        return next_departures
+
+        return [{'vehicle_journey': stop_time.vehicle_journey, 'time': stop_time.time,
+                 'timetable': timetables[stop_time.vehicle_journey_id]} for stop_time in stop_times]
 
     def get_coordinates(self):
         return [self.latitude, self.longitude]
@@ -152,6 +144,14 @@ class TransXChange(models.Model):
     modification_date_time = models.DateTimeField()
     schema_version = models.CharField(max_length=50)
     revision_number = models.IntegerField()
+    # TNDS zone of the zip the file was loaded from and sha256 of its content, used by update_bus_info to skip
+    # the files which have not changed since they were loaded and to find the ones which disappeared
+    tnds_zone = models.CharField(max_length=20, blank=True, null=True, db_index=True)
+    content_hash = models.CharField(max_length=64, blank=True, null=True)
+    # Compiled timetable of the file for the timetable pages, see transxchange.timetable_from_service
+    timetable = models.BinaryField(blank=True, null=True)
+    # When update_bus_info last wrote the timetables of the file, see service_calendar.get_timetables_version
+    loaded = models.DateTimeField(blank=True, null=True)
 
 class Operator(models.Model):
     operator_id = models.CharField(max_length=20, primary_key=True, db_index=True)
@@ -233,6 +233,16 @@ class JourneyPattern(models.Model):
             coordinates.append(jptl.to_stop.gis_location)
         return coordinates
 
+    def get_stop_offsets(self):
+        # List of (stop_id, seconds from the origin departure) for every stop of the journey pattern, in order
+        offsets = []
+        for from_stop_id, to_stop_id, from_offset, to_offset in self.journeypatterntiminglink_set.values_list(
+                'from_stop_id', 'to_stop_id', 'from_offset', 'to_offset'):
+            if not offsets:
+                offsets.append((from_stop_id, from_offset))
+            offsets.append((to_stop_id, to_offset))
+        return offsets
+
     def update_coordinates(self):
         # Generate coordinates from journey pattern timing links, cache them and generate bounding box
         coordinates = self.get_coordinates()
@@ -253,6 +263,8 @@ class JourneyPatternTimingLink(models.Model):
     distance = models.IntegerField(blank=True, null=True)
     direction = models.CharField(max_length=50, blank=True, null=True) # outbound or inbound
     run_time = models.CharField(max_length=50, blank=True, null=True) # Format is e.g. PT3M0S
+    from_offset = models.IntegerField(blank=True, null=True) # Cumulative run time in seconds from the start of the journey pattern
+    to_offset = models.IntegerField(blank=True, null=True) # from_offset + run_time in seconds
     jp = models.ForeignKey(JourneyPattern, on_delete=models.CASCADE)
     order = models.IntegerField()
 
@@ -315,6 +327,11 @@ class VehicleJourney(models.Model):
     def __str__(self):
         return f"{self.vehicle_journey_code} ({self.departure_time})"
 
+    @property
+    def days_of_week(self):
+        # Bitmask of the days of the week the journey runs, Monday is bit 0 as in date.weekday()
+        return sum(1 << day for day, day_name in enumerate(WEEKDAY_NAMES) if getattr(self, day_name))
+
     # VehicleJourney TransXchange XML example
     # <VehicleJourney SequenceNumber="1065">
     #   <PrivateCode>4SU:O:0:3439:t4h-E8L86BA</PrivateCode>
@@ -351,3 +368,56 @@ class VehicleJourney(models.Model):
     #   <JourneyPatternRef>JP3</JourneyPatternRef>
     #   <DepartureTime>16:39:00</DepartureTime>
     # </VehicleJourney>
+
+
+class StopTime(models.Model):
+    # Precomputed time at which a VehicleJourney calls at each stop of its JourneyPattern, built by
+    # update_bus_info so that Stop.next_departures does not have to walk every timing link of every journey
+    stop = models.ForeignKey(Stop, on_delete=models.CASCADE, related_name='stop_times')
+    vehicle_journey = models.ForeignKey(VehicleJourney, on_delete=models.CASCADE, related_name='stop_times')
+    order = models.IntegerField()
+    offset = models.IntegerField()  # seconds from the departure of the vehicle journey from its origin
+    time = models.TimeField()
+    days = models.SmallIntegerField()  # VehicleJourney.days_of_week
+
+    class Meta:
+        ordering = ['time']
+        indexes = [models.Index(fields=['stop', 'time'], name='transport_stoptime_stop_time')]
+
+
+# Zoom levels for which the coordinates of each CanonicalJourneyPattern are simplified, see
+# CanonicalJourneyPatternGeometry. Maps zoomed in further than the last level get the full coordinates.
+SIMPLIFIED_ZOOM_LEVELS = [8, 10, 12, 14]
+
+
+def simplify_tolerance(zoom):
+    # Half a pixel of a 256 pixel web map tile at the zoom level, in degrees
+    return 360 / (256 * 2 ** zoom) / 2
+
+
+class CanonicalJourneyPattern(models.Model):
+    # Representative JourneyPattern of each direction of a Service, the one with the most timing links as it is
+    # the most likely to be the standard route, with its geometry and stops. Built by update_bus_info so that
+    # the service maps select one row per service and direction in a single query.
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='canonical_journey_patterns')
+    direction = models.CharField(max_length=50, blank=True, null=True)
+    journey_pattern = models.OneToOneField(JourneyPattern, on_delete=models.CASCADE, related_name='canonical')
+    route_description = models.CharField(max_length=500, blank=True, null=True)
+    num_timing_links = models.IntegerField()
+    stops = models.JSONField(default=list)  # atco_code of every stop of the journey pattern, in order
+    coordinates = models.LineStringField(blank=True, null=True)
+
+    class Meta:
+        unique_together = [['service', 'direction']]
+
+
+class CanonicalJourneyPatternGeometry(models.Model):
+    # Coordinates of a CanonicalJourneyPattern simplified (Douglas-Peucker) for the maps shown at zoom levels up to
+    # zoom, built by update_bus_info with the CanonicalJourneyPattern
+    canonical_journey_pattern = models.ForeignKey(CanonicalJourneyPattern, on_delete=models.CASCADE,
+                                                  related_name='geometries')
+    zoom = models.SmallIntegerField()
+    coordinates = models.LineStringField()
+
+    class Meta:
+        unique_together = [['canonical_journey_pattern', 'zoom']]
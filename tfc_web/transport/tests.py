@@ -0,0 +1,125 @@
+import datetime
+from django.contrib.gis.geos import LineString
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils.timezone import now
+from transport.models import CanonicalJourneyPattern, CanonicalJourneyPatternGeometry, JourneyPattern, Line, \
+    Operator, Service, TransXChange, SIMPLIFIED_ZOOM_LEVELS, simplify_tolerance
+from transport.utils.service_calendar import runs_on_bank_holiday
+from transport.utils.transxchange import bank_holidays, get_bank_holidays, get_other_holidays
+
+
+class BankHolidaysTest(SimpleTestCase):
+    def test_2019(self):
+        self.assertEqual(bank_holidays(2019), {
+            datetime.date(2019, 1, 1): ('NewYearsDay', 'NewYearsDayHoliday'),
+            datetime.date(2019, 4, 19): ('GoodFriday',),
+            datetime.date(2019, 4, 22): ('EasterMonday', 'HolidayMondays'),
+            datetime.date(2019, 5, 6): ('MayDay', 'HolidayMondays'),
+            datetime.date(2019, 5, 27): ('SpringBank', 'HolidayMondays'),
+            datetime.date(2019, 8, 26): ('LateSummerBankHolidayNotScotland', 'HolidayMondays'),
+            datetime.date(2019, 12, 25): ('ChristmasDay', 'ChristmasDayHoliday'),
+            datetime.date(2019, 12, 26): ('BoxingDay', 'BoxingDayHoliday'),
+        })
+
+    def test_2020_may_day_moved(self):
+        self.assertEqual(get_bank_holidays(datetime.date(2020, 5, 4)), ())
+        self.assertEqual(get_bank_holidays(datetime.date(2020, 5, 8)), ('MayDay',))
+
+    def test_2022_jubilee_and_funeral(self):
+        self.assertEqual(get_bank_holidays(datetime.date(2022, 5, 30)), ())
+        self.assertEqual(get_bank_holidays(datetime.date(2022, 6, 2)), ('SpringBank',))
+        self.assertEqual(get_bank_holidays(datetime.date(2022, 6, 3)), ('QueensPlatinumJubilee',))
+        self.assertEqual(get_bank_holidays(datetime.date(2022, 9, 19)), ('QueensFuneral',))
+        # New Year's Day and Christmas Day fall on a weekend and are given on the following weekdays
+        self.assertEqual(len([date for date in bank_holidays(2022) if date.weekday() < 5]), 10)
+
+    def test_christmas_on_saturday(self):
+        self.assertEqual(get_bank_holidays(datetime.date(2021, 12, 25)), ('ChristmasDay',))
+        self.assertEqual(get_bank_holidays(datetime.date(2021, 12, 26)), ('BoxingDay',))
+        self.assertEqual(get_bank_holidays(datetime.date(2021, 12, 27)), ('ChristmasDayHoliday',))
+        self.assertEqual(get_bank_holidays(datetime.date(2021, 12, 28)), ('BoxingDayHoliday',))
+
+    def test_christmas_on_sunday(self):
+        self.assertEqual(get_bank_holidays(datetime.date(2022, 12, 25)), ('ChristmasDay',))
+        self.assertEqual(get_bank_holidays(datetime.date(2022, 12, 26)), ('BoxingDay', 'BoxingDayHoliday'))
+        self.assertEqual(get_bank_holidays(datetime.date(2022, 12, 27)), ('ChristmasDayHoliday',))
+
+    def test_new_years_day_on_saturday(self):
+        self.assertEqual(get_bank_holidays(datetime.date(2022, 1, 1)), ('NewYearsDay',))
+        self.assertEqual(get_bank_holidays(datetime.date(2022, 1, 3)), ('NewYearsDayHoliday',))
+
+    def test_other_holidays_are_not_bank_holidays(self):
+        for date, name in [(datetime.date(2023, 8, 7), 'AugustBankHolidayScotland'),
+                           (datetime.date(2023, 12, 24), 'ChristmasEve'),
+                           (datetime.date(2023, 12, 31), 'NewYearsEve')]:
+            self.assertEqual(get_bank_holidays(date), ())
+            self.assertEqual(get_other_holidays(date), (name,))
+
+
+class RunsOnBankHolidayTest(SimpleTestCase):
+    NOT_ON_BANK_HOLIDAYS = ('<BankHolidayOperation xmlns="http://www.transxchange.org.uk/"><DaysOfNonOperation>'
+                            '<AllBankHolidays/></DaysOfNonOperation></BankHolidayOperation>')
+    NOT_ON_CHRISTMAS_EVE = ('<BankHolidayOperation xmlns="http://www.transxchange.org.uk/"><DaysOfNonOperation>'
+                            '<ChristmasEve/></DaysOfNonOperation></BankHolidayOperation>')
+
+    def test_all_bank_holidays(self):
+        self.assertFalse(runs_on_bank_holiday(('ChristmasDay',), True, self.NOT_ON_BANK_HOLIDAYS))
+        self.assertTrue(runs_on_bank_holiday((), True, self.NOT_ON_BANK_HOLIDAYS, ('ChristmasEve',)))
+
+    def test_named_other_holiday(self):
+        self.assertFalse(runs_on_bank_holiday((), True, self.NOT_ON_CHRISTMAS_EVE, ('ChristmasEve',)))
+        self.assertTrue(runs_on_bank_holiday((), True, self.NOT_ON_CHRISTMAS_EVE, ('NewYearsEve',)))
+
+
+class ServicesGeoJSONTest(TestCase):
+    CAMBRIDGE = '0.05,52.15,0.2,52.25'
+
+    @classmethod
+    def setUpTestData(cls):
+        tx = TransXChange.objects.create(file_name='SCCM_1.xml', creation_date_time=now(),
+                                         modification_date_time=now(), schema_version='2.1', revision_number=1)
+        line = Line.objects.create(line_id='SL1', line_name='1')
+        operator = Operator.objects.create(operator_id='OId_SCCM', operator_code='SCCM', national_operator_code='SCCM')
+        service = Service.objects.create(service_code='EA_SC_SCCM_1_1', operating_period_start=datetime.date(2023, 1, 1),
+                                         line=line, operator=operator, tx=tx, description='Trumpington - Arbury')
+        coordinates = LineString((0.1, 52.18), (0.12, 52.2), (0.121, 52.2001), (0.15, 52.22), srid=4326)
+        journey_pattern = JourneyPattern.objects.create(jp_id='JP1', service=service, direction='outbound',
+                                                        coordinates=coordinates)
+        canonical_journey_pattern = CanonicalJourneyPattern.objects.create(
+            service=service, direction='outbound', journey_pattern=journey_pattern, num_timing_links=3,
+            stops=['S1', 'S2', 'S3', 'S4'], coordinates=coordinates)
+        for zoom in SIMPLIFIED_ZOOM_LEVELS:
+            CanonicalJourneyPatternGeometry.objects.create(
+                canonical_journey_pattern=canonical_journey_pattern, zoom=zoom,
+                coordinates=coordinates.simplify(simplify_tolerance(zoom)))
+
+    def get(self, **params):
+        return self.client.get(reverse('services-geojson'), params)
+
+    def test_services_in_bbox(self):
+        response = self.get(bbox=self.CAMBRIDGE, zoom=13)
+        self.assertEqual(response.status_code, 200)
+        features = response.json()['features']
+        self.assertEqual(len(features), 1)
+        self.assertEqual(features[0]['properties']['service_code'], 'EA_SC_SCCM_1_1')
+        self.assertEqual(features[0]['properties']['line'], '1')
+        self.assertEqual(features[0]['geometry']['type'], 'LineString')
+
+        self.assertEqual(self.get(bbox='1,53,1.1,53.1', zoom=13).json()['features'], [])
+
+    def test_simplified_for_zoom_level(self):
+        full = self.get(bbox=self.CAMBRIDGE, zoom=18).json()['features'][0]['geometry']['coordinates']
+        simplified = self.get(bbox=self.CAMBRIDGE, zoom=10).json()['features'][0]['geometry']['coordinates']
+        self.assertEqual(len(full), 4)
+        self.assertLess(len(simplified), len(full))
+
+    def test_single_service_zoomed_out(self):
+        response = self.get(bbox='-6,50,2,56', zoom=5, service='EA_SC_SCCM_1_1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['features']), 1)
+
+    def test_all_services_zoomed_out(self):
+        self.assertEqual(self.get(bbox='-6,50,2,56', zoom=13).status_code, 400)
+        self.assertEqual(self.get(bbox=self.CAMBRIDGE, zoom=5).status_code, 400)
+        self.assertEqual(self.get(zoom=13).status_code, 400)
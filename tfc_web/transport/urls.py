@@ -29,6 +29,7 @@ urlpatterns = [
 
     # Journey Patterns
     url(r'^services/$', views.bus_jp_map, name='bus-jp-map'),
+    url(r'^services/geojson/$', views.services_geojson, name='services-geojson'),
 
     # Service
     re_path(r'^service/(?P<service_code>[^/]+)?$', views.service_map, name='service-map'),
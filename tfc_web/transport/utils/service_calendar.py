@@ -0,0 +1,94 @@
+"""Work out which vehicle journeys loaded by update_bus_info run on a given date, honouring the operating
+period of the journey and its service, its days of the week and its bank holiday operation.
+"""
+import ast
+import xml.etree.ElementTree as ET
+from django.core.cache import cache
+from django.db.models import Count, Max, Q
+from transport.models import TransXChange, VehicleJourney, WEEKDAY_NAMES
+from transport.utils.transxchange import get_bank_holidays, get_other_holidays
+
+
+def parse_bank_holiday_operation(bank_holiday_operation):
+    """Given a VehicleJourney.bank_holiday_operation, return the sets of the bank holidays the journey
+    runs and does not run on.
+    """
+    if not bank_holiday_operation:
+        return frozenset(), frozenset()
+    if bank_holiday_operation[:2] in ("b'", 'b"'):
+        # Older imports stored the repr of the serialized element
+        bank_holiday_operation = ast.literal_eval(bank_holiday_operation).decode()
+    element = ET.fromstring(bank_holiday_operation)
+    days = {child.tag.rsplit('}', 1)[-1]: frozenset(day.tag.rsplit('}', 1)[-1] for day in child) for child in element}
+    return days.get('DaysOfOperation', frozenset()), days.get('DaysOfNonOperation', frozenset())
+
+
+def runs_on_bank_holiday(holidays, runs_on_weekday, bank_holiday_operation, other_holidays=()):
+    """Whether a journey runs on a bank holiday (or on one of the other named days of get_other_holidays),
+    following the same rules as OperatingProfile.should_show.
+    """
+    operation, nonoperation = parse_bank_holiday_operation(bank_holiday_operation)
+    if holidays:
+        if 'AllBankHolidays' in operation:
+            return True
+        if 'AllBankHolidays' in nonoperation:
+            return False
+    for holiday in holidays + other_holidays:
+        if holiday in operation:
+            return True
+        if holiday in nonoperation:
+            return False
+    return runs_on_weekday
+
+
+def find_active_vehicle_journeys(date):
+    """Return the frozenset of ids of the VehicleJourneys running on a date."""
+    weekday = WEEKDAY_NAMES[date.weekday()]
+    holidays = get_bank_holidays(date)
+    other_holidays = get_other_holidays(date)
+
+    vehicle_journeys = VehicleJourney.objects.filter(
+        Q(start_date__isnull=True) | Q(start_date__lte=date),
+        Q(end_date__isnull=True) | Q(end_date__gte=date),
+        Q(service__isnull=True) | Q(service__operating_period_start__lte=date),
+        Q(service__operating_period_end__isnull=True) | Q(service__operating_period_end__gte=date),
+    )
+    if not holidays and not other_holidays:
+        return frozenset(vehicle_journeys.filter(**{weekday: True}).values_list('id', flat=True))
+
+    return frozenset(
+        vehicle_journey_id for vehicle_journey_id, runs_on_weekday, bank_holiday_operation in
+        vehicle_journeys.filter(Q(**{weekday: True}) | Q(bank_holiday_operation__isnull=False)).values_list(
+            'id', weekday, 'bank_holiday_operation')
+        if runs_on_bank_holiday(holidays, runs_on_weekday, bank_holiday_operation, other_holidays)
+    )
+
+
+def get_timetables_version():
+    """Return a string changing whenever update_bus_info writes or deletes the timetables of a TransXChange file
+    (new or reloaded files update TransXChange.loaded, deleted ones the number of TransXChange rows).
+    """
+    version = TransXChange.objects.aggregate(files=Count('id'), loaded=Max('loaded'))
+    return '{}_{}'.format(version['files'], version['loaded'].timestamp() if version['loaded'] else 0)
+
+
+# The active vehicle journeys of the last dates and timetables versions asked for in this process, to save
+# fetching and unpickling them from the cache on every call
+_active_vehicle_journeys = {}
+
+
+def get_active_vehicle_journeys(date):
+    """Return the frozenset of ids of the VehicleJourneys running on a date, computed once per date and
+    per version of the timetables in the database.
+    """
+    cache_key = 'active_vehicle_journeys_{}_{}'.format(date, get_timetables_version())
+    active_vehicle_journeys = _active_vehicle_journeys.get(cache_key)
+    if active_vehicle_journeys is None:
+        active_vehicle_journeys = cache.get(cache_key)
+        if active_vehicle_journeys is None:
+            active_vehicle_journeys = find_active_vehicle_journeys(date)
+            cache.set(cache_key, active_vehicle_journeys, 24 * 60 * 60)
+        if len(_active_vehicle_journeys) >= 2:
+            _active_vehicle_journeys.clear()
+        _active_vehicle_journeys[cache_key] = active_vehicle_journeys
+    return active_vehicle_journeys
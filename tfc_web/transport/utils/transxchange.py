@@ -5,10 +5,15 @@ import os
 import re
 import xml.etree.cElementTree as ET
 import calendar
+import copy
 import datetime
 import difflib
+import hashlib
+import pickle
 import zipfile
-from functools import cmp_to_key
+import zlib
+from array import array
+from functools import cmp_to_key, lru_cache
 from django.conf import settings
 from django.core.cache import cache
 from django.utils.text import slugify
@@ -24,31 +29,107 @@ DURATION_REGEX = re.compile(
     r'P((?P<days>-?\d+?)D)?T((?P<hours>-?\d+?)H)?((?P<minutes>-?\d+?)M)?((?P<seconds>-?\d+?)S)?'
 )
 WEEKDAYS = {day: i for i, day in enumerate(calendar.day_name)}
-BANK_HOLIDAYS = {
-    datetime.date(2018, 1, 1): ('NewYearsDay', 'NewYearsDayHoliday'),
-    datetime.date(2018, 3, 30): ('GoodFriday',),
-    datetime.date(2018, 4, 2): ('EasterMonday', 'HolidayMondays'),
-    datetime.date(2018, 5, 7): ('MayDay', 'HolidayMondays'),
-    datetime.date(2018, 5, 28): ('SpringBank', 'HolidayMondays'),
-    datetime.date(2018, 8, 6): ('AugustBankHolidayScotland',),
-    datetime.date(2018, 8, 27): ('LateSummerBankHolidayNotScotland', 'HolidayMondays'),
-    datetime.date(2018, 12, 24): ('ChristmasEve',),
-    datetime.date(2018, 12, 25): ('ChristmasDay', 'ChristmasDayHoliday'),
-    datetime.date(2018, 12, 26): ('BoxingDay',),
-    datetime.date(2019, 1, 1): ('NewYearsDay', 'NewYearsDayHoliday'),
-    datetime.date(2019, 4, 19): ('GoodFriday',),
-    datetime.date(2019, 4, 22): ('EasterMonday', 'HolidayMondays'),
-    datetime.date(2019, 5, 6): ('MayDay', 'HolidayMondays'),
-    datetime.date(2019, 5, 27): ('SpringBank', 'HolidayMondays'),
-    datetime.date(2019, 8, 5): ('AugustBankHolidayScotland',),
-    datetime.date(2019, 8, 26): ('LateSummerBankHolidayNotScotland', 'HolidayMondays'),
-    datetime.date(2019, 12, 24): ('ChristmasEve',),
-    datetime.date(2019, 12, 25): ('ChristmasDay', 'ChristmasDayHoliday'),
-    datetime.date(2019, 12, 26): ('BoxingDay',),
-    datetime.date(2020, 1, 1): ('NewYearsDay', 'NewYearsDayHoliday'),
+# Times of Rows and TimetableJourneys are minutes since midnight in an array('H'), this one meaning no time
+NO_TIME = 0xFFFF
+# One-off changes to the usual England and Wales bank holidays, None removes a holiday
+BANK_HOLIDAY_CHANGES = {
+    datetime.date(2020, 5, 4): None,
+    datetime.date(2020, 5, 8): ('MayDay',),
+    datetime.date(2022, 5, 30): None,
+    datetime.date(2022, 6, 2): ('SpringBank',),
+    datetime.date(2022, 6, 3): ('QueensPlatinumJubilee',),
+    datetime.date(2022, 9, 19): ('QueensFuneral',),
+    datetime.date(2023, 5, 8): ('CoronationKingCharlesIII',),
 }
 
 
+def easter_sunday(year):
+    """Return the date of Easter Sunday (anonymous Gregorian algorithm)."""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    g = (8 * b + 13) // 25
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 19 * l) // 433
+    month = (h + l - 7 * m + 90) // 25
+    day = (h + l - 7 * m + 33 * month + 19) % 32
+    return datetime.date(year, month, day)
+
+
+def monday_on_or_after(date):
+    return date + datetime.timedelta(days=-date.weekday() % 7)
+
+
+def last_monday(year, month):
+    date = datetime.date(year, month, calendar.monthrange(year, month)[1])
+    return date - datetime.timedelta(days=date.weekday())
+
+
+@lru_cache(maxsize=32)
+def bank_holidays(year):
+    """Return a dict of the bank holidays of a year, mapping each date to its TransXChange BankHolidayOperation
+    names (e.g. ChristmasDayHoliday is the day off given for Christmas Day, which may be a substitute day).
+    """
+    easter = easter_sunday(year)
+    holidays = {
+        easter - datetime.timedelta(days=2): ('GoodFriday',),
+        easter + datetime.timedelta(days=1): ('EasterMonday', 'HolidayMondays'),
+        monday_on_or_after(datetime.date(year, 5, 1)): ('MayDay', 'HolidayMondays'),
+        last_monday(year, 5): ('SpringBank', 'HolidayMondays'),
+        last_monday(year, 8): ('LateSummerBankHolidayNotScotland', 'HolidayMondays'),
+    }
+
+    def add(date, name):
+        holidays[date] = holidays.get(date, ()) + (name,)
+
+    # Fixed date holidays falling on a weekend are given on the following weekday(s)
+    new_years_day = datetime.date(year, 1, 1)
+    add(new_years_day, 'NewYearsDay')
+    add(monday_on_or_after(new_years_day) if new_years_day.weekday() >= 5 else new_years_day, 'NewYearsDayHoliday')
+    christmas_day = datetime.date(year, 12, 25)
+    add(christmas_day, 'ChristmasDay')
+    add(christmas_day + datetime.timedelta(days=1), 'BoxingDay')
+    christmas_day_holiday, boxing_day_holiday = {
+        4: (25, 28),
+        5: (27, 28),
+        6: (27, 26),
+    }.get(christmas_day.weekday(), (25, 26))
+    add(datetime.date(year, 12, christmas_day_holiday), 'ChristmasDayHoliday')
+    add(datetime.date(year, 12, boxing_day_holiday), 'BoxingDayHoliday')
+
+    for date, names in BANK_HOLIDAY_CHANGES.items():
+        if date.year == year:
+            if names is None:
+                del holidays[date]
+            else:
+                holidays[date] = holidays.get(date, ()) + names
+    return holidays
+
+
+@lru_cache(maxsize=32)
+def other_holidays(year):
+    """Return a dict of the days of a year with a TransXChange BankHolidayOperation name which are not bank
+    holidays in England, so that they only apply to the journeys naming them (not to AllBankHolidays).
+    """
+    return {
+        monday_on_or_after(datetime.date(year, 8, 1)): ('AugustBankHolidayScotland',),
+        datetime.date(year, 12, 24): ('ChristmasEve',),
+        datetime.date(year, 12, 31): ('NewYearsEve',),
+    }
+
+
+def get_bank_holidays(date):
+    """Return the TransXChange names of the bank holidays falling on a date, empty if it is not a bank holiday."""
+    return bank_holidays(date.year).get(date, ())
+
+
+def get_other_holidays(date):
+    """Return the TransXChange names of the days falling on a date which are not bank holidays in England."""
+    return other_holidays(date.year).get(date, ())
+
+
 def parse_duration(string):
     """Given an ISO 8601 formatted duration string like "PT2M", return a timedelta.
 
@@ -79,6 +160,48 @@ def sanitize_description_part(part):
     return sanitized_part.group(1) if sanitized_part is not None else part
 
 
+def minutes_from_time(time):
+    """Given a time, or '' where a journey does not stop, return the minutes since midnight stored in the
+    times of Rows and TimetableJourneys (seconds are not shown by the timetables).
+    """
+    if time == '':
+        return NO_TIME
+    return time.hour * 60 + time.minute
+
+
+def time_from_minutes(minutes):
+    if minutes == NO_TIME:
+        return ''
+    return datetime.time(*divmod(minutes, 60))
+
+
+@lru_cache(maxsize=None)
+def all_slots(cls):
+    return tuple(name for klass in reversed(cls.__mro__) for name in getattr(klass, '__slots__', ()))
+
+
+class CompactPickle(object):
+    """Pickles the __slots__ of a class as a tuple of the values set (and a bitmask of which are set,
+    as some are optional and tested with hasattr) rather than as a dict of their names and values.
+    """
+    __slots__ = ()
+
+    def __getstate__(self):
+        values = []
+        mask = 0
+        for i, name in enumerate(all_slots(type(self))):
+            if hasattr(self, name):
+                values.append(getattr(self, name))
+                mask |= 1 << i
+        return (mask, *values)
+
+    def __setstate__(self, state):
+        mask, values = state[0], iter(state[1:])
+        for i, name in enumerate(all_slots(type(self))):
+            if mask & 1 << i:
+                setattr(self, name, next(values))
+
+
 def correct_description(description):
     """Given an description, return a version with any typos pedantically corrected."""
     for old, new in (
@@ -91,12 +214,12 @@ def correct_description(description):
     return description
 
 
-class Stop(object):
+class Stop(CompactPickle):
     """A TransXChange StopPoint."""
-    stop = None
-    locality = None
+    __slots__ = ('atco_code', 'common_name', 'locality', 'stop')
 
     def __init__(self, element):
+        self.stop = None
         self.atco_code = element.find('txc:StopPointRef', NS).text or ''
         self.common_name = element.find('txc:CommonName', NS)
         self.locality = element.find('txc:LocalityName', NS)
@@ -115,7 +238,7 @@ class Stop(object):
         this stop's locality's name, or this stop's name
         (e.g. 'kings-lynn' matches 'kings-lynn-bus-station' and vice versa).
         """
-        name = slugify(self.stop.locality if self.stop else self.locality)
+        name = slugify(self.stop.locality_name if self.stop else self.locality)
         if name != 'none' and name in text or text in name:
             if name == text:
                 return 2
@@ -178,17 +301,30 @@ class Rows(object):
         row.parent = self
 
 
-class Row(object):
+class Row(CompactPickle):
     """A row in a grouping in a timetable.
     Each row is associated with a Stop, and a list of times.
     """
+    __slots__ = ('part', 'minutes', 'next', 'parent')
+
     def __init__(self, part):
         self.part = part
         part.row = self
-        self.times = []
+        self.minutes = array('H')
         self.next = None
         self.parent = None
 
+    @property
+    def times(self):
+        return [time_from_minutes(minutes) for minutes in self.minutes]
+
+    @times.setter
+    def times(self, times):
+        self.minutes = array('H', map(minutes_from_time, times))
+
+    def append_time(self, time):
+        self.minutes.append(minutes_from_time(time))
+
     def __repr__(self):
         if self.next is not None:
             return '[%s] -> %s' % (self.part.stop, self.next)
@@ -202,10 +338,12 @@ class Row(object):
         self.next = row
 
 
-class Grouping(object):
+class Grouping(CompactPickle):
     """Probably either 'outbound' or 'inbound'.
     (Could perhaps be extended to group by weekends, bank holidays in the future).
     """
+    __slots__ = ('direction', 'parent', 'column_feet', 'journeypatterns', 'journeys', 'rows')
+
     def __init__(self, direction, parent):
         self.direction = direction
         self.parent = parent
@@ -253,8 +391,6 @@ class Grouping(object):
                         self.column_feet[key].append(ColumnFoot(None, 1))
             prev_journey = journey
 
-        for row in self.rows:
-            row.times = [time for time in row.times if time is not None]
 
     def __str__(self):
         if self.parent.description_parts:
@@ -361,8 +497,10 @@ class JourneyPatternSection(object):
         ]
 
 
-class JourneyPatternStopUsage(object):
+class JourneyPatternStopUsage(CompactPickle):
     """Either a 'From' or 'To' element in TransXChange."""
+    __slots__ = ('activity', 'sequencenumber', 'stop', 'timingstatus', 'waittime', 'row', 'parent')
+
     def __init__(self, element, stops):
         self.activity = element.find('txc:Activity', NS)
         if self.activity is not None:
@@ -407,17 +545,19 @@ def get_deadrun_ref(deadrun_element):
         return deadrun_element.find('txc:ShortWorking/txc:JourneyPatternTimingLinkRef', NS).text
 
 
-class VehicleJourney(object):
+class VehicleJourney(CompactPickle):
     """A journey represents a scheduled journey that happens at most once per
     day. A sort of "instance" of a JourneyPattern, made distinct by having its
     own start time (and possibly operating profile and dead run).
     """
-    operating_profile = None
+    __slots__ = ('code', 'journeypattern', 'journeyref', 'operating_profile', 'departure_time', 'operator',
+                 'sequencenumber', 'start_deadrun', 'end_deadrun', 'notes')
 
     def __init__(self, element, journeypatterns, servicedorgs, date):
         # ensure the journey has a code and pattern, even if it won't be shown
         # (because it might be referenced by a shown journey)
 
+        self.operating_profile = None
         self.code = element.find('txc:PrivateCode', NS).text
 
         journeypatternref_element = element.find('txc:JourneyPatternRef', NS)
@@ -483,17 +623,17 @@ class VehicleJourney(object):
                     time = add_time(time, stopusage.waittime)
 
     def add_times(self):
-        row_length = len(self.journeypattern.grouping.rows.first().times)
+        row_length = len(self.journeypattern.grouping.rows.first().minutes)
 
         for stopusage, time in self.get_times():
             if stopusage.sequencenumber is not None:
-                self.journeypattern.grouping.rows[stopusage.sequencenumber].times.append(time)
+                self.journeypattern.grouping.rows[stopusage.sequencenumber].append_time(time)
             else:
-                stopusage.row.times.append(time)
+                stopusage.row.append_time(time)
 
         for row in iter(self.journeypattern.grouping.rows.values()):
-            if len(row.times) == row_length:
-                row.times.append('')
+            if len(row.minutes) == row_length:
+                row.append_time('')
 
     def cmp(self, x, y):
         x_time = x.departure_time
@@ -583,7 +723,9 @@ class ServicedOrganisationDayType(object):
                 self.operation_workingdays = servicedorgs[op_workingdays_element.text]
 
 
-class DayOfWeek(object):
+class DayOfWeek(CompactPickle):
+    __slots__ = ('day',)
+
     def __init__(self, day):
         if isinstance(day, int):
             self.day = day
@@ -599,7 +741,10 @@ class DayOfWeek(object):
         return calendar.day_name[self.day]
 
 
-class OperatingProfile(object):
+class OperatingProfile(CompactPickle):
+    __slots__ = ('regular_days', 'nonoperation_days', 'operation_days', 'servicedorganisation',
+                 'operation_bank_holidays', 'nonoperation_bank_holidays')
+
     def __init__(self, element, servicedorgs):
         element = element
 
@@ -656,16 +801,17 @@ class OperatingProfile(object):
         if self.regular_days:
             if date.weekday() not in self.regular_days:
                 return False
-        if date in BANK_HOLIDAYS:
+        holidays = get_bank_holidays(date)
+        if holidays:
             if 'AllBankHolidays' in self.operation_bank_holidays:
                 return True
             if 'AllBankHolidays' in self.nonoperation_bank_holidays:
                 return False
-            for bank_holiday in BANK_HOLIDAYS[date]:
-                if bank_holiday in self.operation_bank_holidays:
-                    return True
-                if bank_holiday in self.nonoperation_bank_holidays:
-                    return False
+        for bank_holiday in holidays + get_other_holidays(date):
+            if bank_holiday in self.operation_bank_holidays:
+                return True
+            if bank_holiday in self.nonoperation_bank_holidays:
+                return False
         if not self.regular_days and not hasattr(self, 'operation_days'):
             return False
 
@@ -696,7 +842,9 @@ class OperatingProfile(object):
         return True
 
 
-class DateRange(object):
+class DateRange(CompactPickle):
+    __slots__ = ('start', 'end')
+
     def __init__(self, element):
         self.start = datetime.datetime.strptime(element.find('txc:StartDate', NS).text, '%Y-%m-%d').date()
         self.end = element.find('txc:EndDate', NS)
@@ -714,6 +862,8 @@ class DateRange(object):
 
 
 class OperatingPeriod(DateRange):
+    __slots__ = ()
+
     def __str__(self):
         if self.start == self.end:
             return self.start.strftime('on %-d %B %Y')
@@ -738,20 +888,17 @@ class OperatingPeriod(DateRange):
         return ''
 
 
-class ColumnFoot(object):
+class ColumnFoot(CompactPickle):
+    __slots__ = ('notes', 'span')
+
     def __init__(self, notes, span):
         self.notes = notes
         self.span = span
 
 
 class Timetable(object):
-    def __get_journeys(self, journeys_element, servicedorgs):
-        journeys = {
-            journey.code: journey for journey in (
-                VehicleJourney(element, self.journeypatterns, servicedorgs, self.date)
-                for element in journeys_element
-            )
-        }
+    def __get_journeys(self):
+        journeys = self.journeys
 
         if self.service_code == '21-584-_-y08-1':  # 584 - Diss - Pulham Market
             journeys['VJ_21-584-_-y08-1-2-T0'].departure_time = datetime.time(9, 20)
@@ -775,102 +922,110 @@ class Timetable(object):
             yield self.date
 
     def __init__(self, open_file, date, description=''):
-        iterator = ET.iterparse(open_file)
-
-        element = None
-        servicedorgs = None
-
+        """Parse a TransXChange file. With open_file None, the caller streaming the file itself gives its
+        elements to feed() as they end, and its root element to finish() at the end (see update_bus_info).
+        """
         self.description = description
         self.date = date
+        self.servicedorgs = None
+        self.journeys = {}
+        if open_file is None:
+            return
 
-        for _, element in iterator:
+        element = None
+        for _, element in ET.iterparse(open_file):
+            if not self.feed(element):
+                return
             tag = element.tag[33:]
-
-            if tag == 'StopPoints':
-                self.stops = {
-                    stop.find('txc:StopPointRef', NS).text: Stop(stop)
-                    for stop in element
-                }
-                element.clear()
-            elif tag.startswith('Route'):
-                element.clear()
-            elif tag == 'Operators':
-                self.operators = element
-            elif tag == 'JourneyPatternSections':
-                journeypatternsections = {
-                    section.id: section for section in (
-                        JourneyPatternSection(section, self.stops) for section in element
-                    ) if section.timinglinks
-                }
-                element.clear()
-            elif tag == 'ServicedOrganisations':
-                servicedorgs = {
-                    org.code: org for org in (ServicedOrganisation(org_element) for org_element in element)
-                }
-            elif tag == 'VehicleJourneys':
-                # time calculation begins here:
-                try:
-                    journeys = self.__get_journeys(element, servicedorgs)
-                except AttributeError as e:
-                    print(e)
-                    return
+            if tag in ('StopPoints', 'JourneyPatternSections', 'VehicleJourney') or tag.startswith('Route'):
                 element.clear()
-            elif tag == 'Service':
-                mode_element = element.find('txc:Mode', NS)
-                if mode_element is not None:
-                    self.mode = mode_element.text
-                else:
-                    self.mode = ''
 
-                self.operator = element.find('txc:RegisteredOperatorRef', NS)
-                if self.operator is not None:
-                    self.operator = self.operator.text
+        self.finish(element)
 
-                operatingprofile_element = element.find('txc:OperatingProfile', NS)
-                if operatingprofile_element is not None:
-                    self.operating_profile = OperatingProfile(operatingprofile_element, servicedorgs)
+    def feed(self, element):
+        """Parse an element of the file which has just ended, only looking at the top level sections and at
+        the Service and VehicleJourney elements. Return False if the file has no Timetable for the date.
+        """
+        tag = element.tag[33:]
 
-                self.operating_period = OperatingPeriod(element.find('txc:OperatingPeriod', NS))
-                if self.date and not self.operating_period.contains(self.date):
-                    return
+        if tag == 'StopPoints':
+            self.stops = {
+                stop.find('txc:StopPointRef', NS).text: Stop(stop)
+                for stop in element
+            }
+        elif tag == 'JourneyPatternSections':
+            self.journeypatternsections = {
+                section.id: section for section in (
+                    JourneyPatternSection(section, self.stops) for section in element
+                ) if section.timinglinks
+            }
+        elif tag == 'ServicedOrganisations':
+            self.servicedorgs = {
+                org.code: org for org in (ServicedOrganisation(org_element) for org_element in element)
+            }
+        elif tag == 'VehicleJourney':
+            # time calculation begins here, one journey at a time:
+            try:
+                journey = VehicleJourney(element, self.journeypatterns, self.servicedorgs, self.date)
+            except AttributeError as e:
+                print(e)
+                return False
+            self.journeys[journey.code] = journey
+        elif tag == 'Service':
+            mode_element = element.find('txc:Mode', NS)
+            if mode_element is not None:
+                self.mode = mode_element.text
+            else:
+                self.mode = ''
 
-                self.service_code = element.find('txc:ServiceCode', NS).text
+            self.operator = element.find('txc:RegisteredOperatorRef', NS)
+            if self.operator is not None:
+                self.operator = self.operator.text
 
-                description_element = element.find('txc:Description', NS)
-                if description_element is not None:
-                    description = description_element.text
-                    self.description = correct_description(description)
+            operatingprofile_element = element.find('txc:OperatingProfile', NS)
+            if operatingprofile_element is not None:
+                self.operating_profile = OperatingProfile(operatingprofile_element, self.servicedorgs)
 
-                self.via = None
-                if self.description:
-                    self.description_parts = list(map(sanitize_description_part, self.description.split(' - ')))
-                    if ' via ' in self.description_parts[-1]:
-                        self.description_parts[-1], self.via = self.description_parts[-1].split(' via ', 1)
-                else:
-                    self.description_parts = None
+            self.operating_period = OperatingPeriod(element.find('txc:OperatingPeriod', NS))
+            if self.date and not self.operating_period.contains(self.date):
+                return False
+
+            self.service_code = element.find('txc:ServiceCode', NS).text
 
-                self.groupings = (
-                    Grouping('outbound', self),
-                    Grouping('inbound', self)
-                )
-                self.journeypatterns = {
-                    pattern.id: pattern for pattern in (
-                       JourneyPattern(pattern, journeypatternsections, self.groupings)
-                       for pattern in element.findall('txc:StandardService/txc:JourneyPattern', NS)
-                    ) if pattern.sections
-                }
+            description_element = element.find('txc:Description', NS)
+            if description_element is not None:
+                description = description_element.text
+                self.description = correct_description(description)
+            self.set_description(self.description)
 
-        self.element = element
+            self.groupings = (
+                Grouping('outbound', self),
+                Grouping('inbound', self)
+            )
+            self.journeypatterns = {
+                pattern.id: pattern for pattern in (
+                   JourneyPattern(pattern, self.journeypatternsections, self.groupings)
+                   for pattern in element.findall('txc:StandardService/txc:JourneyPattern', NS)
+                ) if pattern.sections
+            }
+        return True
+
+    def finish(self, root):
+        """Given the root element of the file, make the groupings of the Timetable from the journeys fed."""
+        if not hasattr(self, 'groupings'):
+            return
 
         self.transxchange_date = max(
-            element.attrib['CreationDateTime'], element.attrib['ModificationDateTime']
+            root.attrib['CreationDateTime'], root.attrib['ModificationDateTime']
         )[:10]
 
-        for journey in journeys:
+        for journey in self.__get_journeys():
             journey.journeypattern.grouping.journeys.append(journey)
             journey.journeypattern.has_journeys = True
 
-        del journeys
+        del self.journeys
+        del self.servicedorgs
+        del self.journeypatternsections
 
         for grouping in self.groupings:
             grouping.journeys.sort(key=VehicleJourney.get_order)
@@ -880,15 +1035,122 @@ class Timetable(object):
 
             grouping.do_heads_and_feet()
 
+        self.correct_times()
+
+    def set_description(self, description):
+        self.description = description
+        self.via = None
+        if self.description:
+            self.description_parts = list(map(sanitize_description_part, self.description.split(' - ')))
+            if ' via ' in self.description_parts[-1]:
+                self.description_parts[-1], self.via = self.description_parts[-1].split(' via ', 1)
+        else:
+            self.description_parts = None
+
+    def correct_times(self):
         if self.service_code == 'MGZO460':
             previous_row = None
             for row in self.groupings[1].rows:
-                if row.part.stop.atco_code == '5230AWD72040' and previous_row.times[:2] == ['', '']:
-                    previous_row.times[0] = row.times[0]
-                    previous_row.times[1] = row.times[1]
+                if row.part.stop.atco_code == '5230AWD72040' and previous_row.minutes[:2] == array('H', [NO_TIME] * 2):
+                    previous_row.minutes[0] = row.minutes[0]
+                    previous_row.minutes[1] = row.minutes[1]
                 previous_row = row
 
 
+class TimetableStopUsage(CompactPickle):
+    """The stop and timing status of a row of a DayTimetable, in place of a JourneyPatternStopUsage."""
+    __slots__ = ('stop', 'timingstatus', 'sequencenumber', 'row')
+
+    def __init__(self, stop, timingstatus):
+        self.stop = stop
+        self.timingstatus = timingstatus
+        self.sequencenumber = None
+        self.row = None
+
+
+class TimetableJourney(VehicleJourney):
+    """What a CompiledTimetable keeps of a VehicleJourney: enough to know whether it runs on a date, and its
+    times at each row of its grouping (see Row.minutes).
+    """
+    __slots__ = ('minutes',)
+
+    def __init__(self, journey, minutes, operating_profile):
+        self.code = journey.code
+        self.departure_time = journey.departure_time
+        self.operating_profile = operating_profile
+        self.notes = journey.notes
+        self.minutes = array('H', minutes)
+
+
+class CompiledTimetable(object):
+    """The Timetable of a TransXChange file for every date, compiled once when update_bus_info loads the file.
+    The Timetable of a date (a DayTimetable) is made from it without parsing the file again.
+    """
+    # To be changed with the stored form of the compiled timetables, so that the older ones are not used
+    VERSION = 2
+
+    def __init__(self, timetable):
+        # timetable is the Timetable of the file for every date (i.e. for date None)
+        if not hasattr(timetable, 'groupings'):
+            raise ValueError('No journeys found')
+
+        self.version = self.VERSION
+        self.service_code = timetable.service_code
+        self.description = timetable.description
+        self.mode = timetable.mode
+        self.operator = timetable.operator
+        self.operating_period = timetable.operating_period
+        self.operating_profile = getattr(timetable, 'operating_profile', None)
+        self.transxchange_date = timetable.transxchange_date
+
+        # Journeys with the same operating profile share it, so that it is stored once
+        operating_profiles = {}
+        self.groupings = []
+        for grouping in timetable.groupings:
+            if any(len(row.minutes) != len(grouping.journeys) for row in grouping.rows):
+                raise ValueError('Journeys stopping more than once at a stop of %s' % grouping.direction)
+            journeys = []
+            for i, journey in enumerate(grouping.journeys):
+                operating_profile = journey.operating_profile
+                if operating_profile is not None:
+                    operating_profile = operating_profiles.setdefault(pickle.dumps(operating_profile), operating_profile)
+                journeys.append(TimetableJourney(journey, [row.minutes[i] for row in grouping.rows], operating_profile))
+            self.groupings.append((
+                grouping.direction,
+                [(row.part.stop, row.part.timingstatus) for row in grouping.rows],
+                journeys
+            ))
+
+
+class DayTimetable(Timetable):
+    """The Timetable of a date, made from a CompiledTimetable."""
+    def __init__(self, compiled_timetable, date, description=''):
+        self.date = date
+        self.service_code = compiled_timetable.service_code
+        self.mode = compiled_timetable.mode
+        self.operator = compiled_timetable.operator
+        self.operating_period = compiled_timetable.operating_period
+        self.transxchange_date = compiled_timetable.transxchange_date
+        self.set_description(compiled_timetable.description or description)
+
+        self.groupings = []
+        for direction, stops, journeys in compiled_timetable.groupings:
+            grouping = Grouping(direction, self)
+            grouping.journeys = [journey for journey in journeys if journey.should_show(date, compiled_timetable)]
+            for stop, timingstatus in reversed(stops):
+                # The view adds the Stop from the database to the stops of the rows
+                grouping.rows.prepend(Row(TimetableStopUsage(copy.copy(stop), timingstatus)))
+            for i, row in enumerate(grouping.rows):
+                row.minutes = array('H', [journey.minutes[i] for journey in grouping.journeys])
+            grouping.do_heads_and_feet()
+            del grouping.journeypatterns
+            for row in grouping.rows:
+                del row.next
+            self.groupings.append(grouping)
+
+        self.correct_times()
+
+
 def timetable_from_filename(path, filename, day):
     """Given a path and filename, join them, and return a Timetable."""
     if filename[-4:] == '.xml':
@@ -896,22 +1158,112 @@ def timetable_from_filename(path, filename, day):
             return Timetable(xmlfile, day)
 
 
+def compile_timetable(open_file):
+    """Given a TransXChange file, return its CompiledTimetable as stored in TransXChange.timetable."""
+    return dump_compiled_timetable(Timetable(open_file, None))
+
+
+def dump_compiled_timetable(timetable):
+    """Given the Timetable of a TransXChange file for every date, return its CompiledTimetable as stored in
+    TransXChange.timetable.
+    """
+    return zlib.compress(pickle.dumps(CompiledTimetable(timetable), pickle.HIGHEST_PROTOCOL))
+
+
+def get_compiled_timetable(service):
+    """Given a Service, return the CompiledTimetable of its TransXChange file, None if there is none."""
+    from transport.models import TransXChange
+
+    compiled_timetable = TransXChange.objects.filter(id=service.tx_id).values_list('timetable', flat=True).first()
+    if compiled_timetable is None:
+        return None
+    try:
+        compiled_timetable = pickle.loads(zlib.decompress(compiled_timetable))
+    except Exception:
+        return None
+    if getattr(compiled_timetable, 'version', None) != CompiledTimetable.VERSION:
+        return None
+    return compiled_timetable
+
+
+def timetable_cache_version(service):
+    """Given a Service (preferably with its TransXChange selected), return the part of the cache keys of its
+    Timetables changing with its TransXChange file: a new revision is a new TransXChange, and a file changed
+    without a new revision is updated in place with its new content hash.
+    """
+    return '{}{}'.format(service.tx_id, service.tx.content_hash)
+
+
 def timetable_from_service(service, day=None):
     """Given a Service, return a list of Timetables."""
     if day is None:
         day = datetime.date.today()
 
-    cache_key = '{}{}'.format(service.pk, day).replace(' ', '')
+    cache_key = '{}{}{}v{}'.format(service.pk, timetable_cache_version(service), day,
+                                   CompiledTimetable.VERSION).replace(' ', '')
+    timetables = cache.get(cache_key)
+    if timetables is not None:
+        return timetables
+
+    compiled_timetable = get_compiled_timetable(service)
+    if compiled_timetable is not None:
+        timetables = []
+        if compiled_timetable.operating_period.contains(day):
+            timetables.append(DayTimetable(compiled_timetable, day, service.description))
+    else:
+        timetables = timetables_from_archive(service, day)
+
+    cache.set(cache_key, timetables, seconds_until_day_after(day))
+    return timetables
+
+
+def timetables_from_services(services, day=None):
+    """Given Services, return the list of their Timetables as shown by the timetable page: without the groupings
+    and rows without times, and with the Stop from the database of each row (from a single query).
+    """
+    if day is None:
+        day = datetime.date.today()
+
+    services = sorted(services, key=lambda service: service.pk)
+    cache_key = 'timetables{}v{}'.format(day, CompiledTimetable.VERSION) + hashlib.sha1(' '.join(
+        '{}{}'.format(service.pk, timetable_cache_version(service)) for service in services).encode()).hexdigest()
     timetables = cache.get(cache_key)
     if timetables is not None:
         return timetables
 
-    archive_path = os.path.join(settings.TNDS_DIR, '%s.zip' % service.area)
+    from transport.models import Stop
+
+    timetables = [timetable for service in services for timetable in timetable_from_service(service, day)]
+    rows = []
+    for timetable in timetables:
+        timetable.groupings = [grouping for grouping in timetable.groupings if grouping.rows and grouping.rows[0].minutes]
+        for grouping in timetable.groupings:
+            grouping.rows = [row for row in grouping.rows if any(minutes != NO_TIME for minutes in row.minutes)]
+            rows += grouping.rows
+    stops = Stop.objects.in_bulk({row.part.stop.atco_code for row in rows})
+    for row in rows:
+        row.part.stop.stop = stops.get(row.part.stop.atco_code)
+
+    cache.set(cache_key, timetables, seconds_until_day_after(day))
+    return timetables
+
+
+def seconds_until_day_after(day):
+    expiry = datetime.datetime.combine(
+        day + datetime.timedelta(days=1), datetime.time(0)
+    )
+    max_age = expiry - datetime.datetime.now()
+    return max_age.seconds
+
+
+def timetables_from_archive(service, day):
+    """Given a Service without a CompiledTimetable, return a list of Timetables parsed from its TNDS zip."""
+    archive_path = os.path.join(settings.TNDS_DIR, '%s.zip' % service.tx.tnds_zone)
 
     try:
         with zipfile.ZipFile(archive_path) as archive:
-            if service.filename in archive.namelist():
-                timetables = [Timetable(archive.open(service.filename), day, service.description)]
+            if service.tx.file_name in archive.namelist():
+                timetables = [Timetable(archive.open(service.tx.file_name), day, service.description)]
             else:
                 timetables = []
     except (zipfile.BadZipfile, IOError, KeyError, OSError):
@@ -927,11 +1279,4 @@ def timetable_from_service(service, day=None):
                 del row.next
         del timetable.journeypatterns
         del timetable.stops
-        del timetable.operators
-        del timetable.element
-    expiry = datetime.datetime.combine(
-        day + datetime.timedelta(days=1), datetime.time(0)
-    )
-    max_age = expiry - datetime.datetime.now()
-    cache.set(cache_key, timetables, max_age.seconds)
     return timetables
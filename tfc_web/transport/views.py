@@ -1,16 +1,18 @@
 import json
 from datetime import datetime, timedelta, timezone
 from django.conf import settings
+from django.contrib.gis.db.models import Extent
+from django.contrib.gis.db.models.functions import AsGeoJSON, Intersection
 from django.contrib.gis.geos import Polygon
-from django.db.models import Count
-from django.http import Http404
+from django.http import Http404, HttpResponseBadRequest, JsonResponse
 from django.shortcuts import render, get_object_or_404
 from django.utils import timezone
 from django.views.generic import DetailView
 from django.urls import reverse
 from smartpanel.views.smartpanel import smartpanel_settings
-from transport.models import Line, VehicleJourney, Stop, JourneyPattern, Service
-from transport.utils.transxchange import timetable_from_service
+from transport.models import Line, VehicleJourney, Stop, Service, CanonicalJourneyPattern, \
+    SIMPLIFIED_ZOOM_LEVELS
+from transport.utils.transxchange import timetables_from_services
 from smartcambridge.decorator import smartcambridge_admin
 from smartcambridge import rt_crypto
 
@@ -38,57 +40,73 @@ def bus_stops_map(request):
                                                             'SMARTPANEL_API_TOKEN': settings.SMARTPANEL_API_TOKEN})
 
 
-def bus_jp_map(request):
-    area = Polygon.from_bbox((-0.11230006814002992, 52.29464119811643, 0.24690136313438418, 52.10594080364339))
-    # Retrieve all JourneyPatterns which coordinates intersect the area but select only one for each Service for inbound and for outbound
-    # We will choose the JourneyPattern with the longer amount of JourneyPatterTimmingLinks associated to it as this is the most likely to be the Standard Service
-
-    # Filter JourneyPatterns based on the intersection with the area
-    journey_patterns = JourneyPattern.objects.filter(coordinates__intersects=area)
-
-    # Annotate the queryset with the count of related JourneyPatternTimingLinks
-    journey_patterns = journey_patterns.annotate(
-        num_jptls=Count('journeypatterntiminglink'),
-    )
-
-    # Get the distinct combinations of Service, direction, and the maximum count of JourneyPatternTimingLinks
-    distinct_combinations = journey_patterns.values('service', 'direction').annotate(
-        max_jptl_count=Count('journeypatterntiminglink')
-    ).order_by()
+# Lowest zoom level and largest bbox (in degrees of longitude and of latitude) of the services map, for which
+# services_geojson returns the journey patterns of all the services
+SERVICES_MAP_MIN_ZOOM = 10
+SERVICES_MAP_MAX_BBOX = 6
 
-    # Initialize an empty queryset to store the final results
-    jp_per_service_and_direction = JourneyPattern.objects.none()
 
-    # Iterate over the distinct combinations and filter the JourneyPattern objects based on these combinations
-    for combination in distinct_combinations:
-        journey_pattern = journey_patterns.filter(
-            service=combination['service'],
-            direction=combination['direction']
-        ).order_by('num_jptls').first()
-
-        if journey_pattern:
-            jp_per_service_and_direction |= JourneyPattern.objects.filter(pk=journey_pattern.pk)
-
-    jp_per_service_and_direction = jp_per_service_and_direction.order_by('service__line__line_id').prefetch_related('service__line', 'service')
-
-    # Now, jp_per_service_and_direction will contain one JourneyPattern per service and direction
-    return render(request, 'transport/bus_jp_map.html', {'jps': jp_per_service_and_direction})
+def bus_jp_map(request):
+    # The journey patterns are loaded by the map from services_geojson for the area shown
+    return render(request, 'transport/bus_jp_map.html', {'min_zoom': SERVICES_MAP_MIN_ZOOM})
+
+
+def services_geojson(request):
+    # GeoJSON of the CanonicalJourneyPatterns in the bbox (west,south,east,north) of a map, of every service or of
+    # a single service, simplified for the zoom level of the map and clipped to the bbox
+    try:
+        west, south, east, north = [float(value) for value in request.GET['bbox'].split(',')]
+        zoom = int(request.GET.get('zoom', SIMPLIFIED_ZOOM_LEVELS[-1] + 1))
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest("bbox (west,south,east,north) and zoom parameters required")
+    if not request.GET.get('service') and (zoom < SERVICES_MAP_MIN_ZOOM or east - west > SERVICES_MAP_MAX_BBOX or
+                                           north - south > SERVICES_MAP_MAX_BBOX):
+        return HttpResponseBadRequest("The journey patterns of all the services are only available from zoom level "
+                                      "%d and for a bbox of at most %d degrees" %
+                                      (SERVICES_MAP_MIN_ZOOM, SERVICES_MAP_MAX_BBOX))
+    area = Polygon.from_bbox((west, south, east, north))
+    area.srid = 4326
+    # Maps zoomed out further than the first level get the coarsest coordinates
+    zoom = max(zoom, SIMPLIFIED_ZOOM_LEVELS[0])
+
+    zoom_level = next((level for level in SIMPLIFIED_ZOOM_LEVELS if level >= zoom), None)
+    if zoom_level is None:
+        coordinates = 'coordinates'
+        jps = CanonicalJourneyPattern.objects.filter(coordinates__intersects=area)
+    else:
+        coordinates = 'geometries__coordinates'
+        jps = CanonicalJourneyPattern.objects.filter(geometries__zoom=zoom_level, geometries__coordinates__intersects=area)
+    if request.GET.get('service'):
+        jps = jps.filter(service_id=request.GET['service'])
+    jps = jps.annotate(geometry=AsGeoJSON(Intersection(coordinates, area), precision=5)) \
+        .select_related('service__line').order_by('service__line__line_id')
+
+    return JsonResponse({
+        'type': 'FeatureCollection',
+        'features': [{
+            'type': 'Feature',
+            'id': jp.id,
+            'properties': {
+                'line': jp.service.line.line_name,
+                'service_code': jp.service.service_code,
+                'service_description': jp.service.description,
+                'route_description': jp.route_description,
+                'direction': jp.direction
+            },
+            'geometry': json.loads(jp.geometry)
+        } for jp in jps]
+    })
 
 
 def service_map(request, service_code):
     service = get_object_or_404(Service, service_code=service_code)
 
-    # Retrieve the longer JourneyPattern for the given service for inbound and for outbound
-    journey_patterns = JourneyPattern.objects.filter(service=service).annotate(
-        num_jptls=Count('journeypatterntiminglink'),
-    ).order_by('num_jptls')
-    
-    # Get the longest JourneyPattern for inbound and for outbound
-    inbound_journey_pattern = journey_patterns.filter(direction='inbound').first()
-    outbound_journey_pattern = journey_patterns.filter(direction='outbound').first()
-
-    # Bounding box for the coordinates of the JourneyPattern
-    area = Polygon.from_bbox(inbound_journey_pattern.coordinates.extent)
+    # Bounding box of the longest JourneyPattern for inbound and for outbound, precomputed by update_bus_info,
+    # which are loaded by the map from services_geojson
+    extent = CanonicalJourneyPattern.objects.filter(service=service).aggregate(extent=Extent('coordinates'))['extent']
+    if extent is None:
+        raise Http404("No journey patterns found for service %s" % service_code)
+    area = Polygon.from_bbox(extent)
     area = json.loads(area.boundary.json)['coordinates']
     # Invert from longlat to latlong
     area = [area[0][::-1], area[1][::-1], area[2][::-1], area[3][::-1]]
@@ -100,7 +118,7 @@ def service_map(request, service_code):
     bus_stops = list(Stop.objects.filter(journey_departures__jp__service=service).distinct()) + bus_stops
 
     return render(request, 'transport/bus_jp_map.html', {
-        'jps': [inbound_journey_pattern, outbound_journey_pattern],
+        'service_code': service.service_code,
         'area': area, 'bus_stops': bus_stops, 'line_name': service.line.line_name,
         'service_description': service.description})
 
@@ -128,6 +146,7 @@ class ServiceDetailView(DetailView):
     "A service and the stops it stops at"
 
     model = Line
+    slug_field = 'line_id'
     template_name = "transport/new_timetable.html"
 
     def get_object(self, queryset=None):
@@ -174,22 +193,11 @@ class ServiceDetailView(DetailView):
             date = timezone.now().date()
 
         try:
-            context['timetables'] = timetable_from_service(self.object, date)
+            context['timetables'] = timetables_from_services(
+                self.object.service_set.select_related('tx').defer('tx__timetable'), date)
         except:
             raise Http404("No timetable found matching your query")
 
-        if context.get('timetables'):
-            for table in context['timetables']:
-                table.groupings = [grouping for grouping in table.groupings if grouping.rows and grouping.rows[0].times]
-                for grouping in table.groupings:
-                    grouping.rows = [row for row in grouping.rows if any(row.times)]
-                    stops_id = []
-                    for row in grouping.rows:
-                        stops_id.append(row.part.stop.atco_code)
-                    stops_dict = {stop.pk: stop for stop in Stop.objects.filter(atco_code__in=stops_id)}
-                    for row in grouping.rows:
-                        row.part.stop.stop = stops_dict.get(row.part.stop.atco_code)
-
         return context
 
 ## Bus Analysis page